@@ -1,199 +1,668 @@
-from flask import Flask, request, jsonify
-from flask_cors import CORS
-from map import Map, get_map_data, astar_multitarget
-import server
-
-app = Flask(__name__)
-CORS(app)
-
-# Assuming you have some data structure to hold the grid state
-grid_state = {
-    "obstacles": [],
-    "start": None,
-    "goal": None
-}
-
-shelves = []
-
-# Sample grid size, this should be configurable based on your needs
-GRID_WIDTH = 20
-GRID_HEIGHT = 20
-
-# Initialize a default map
-label = 'warehouse_0'
-server.create_tables()
-map_instance = get_map_data(label)
-
-if map_instance:
-    if map_instance.obstacles is not None and len(grid_state['obstacles']) == 0:
-        for e in list(map_instance.obstacles):
-            grid_state['obstacles'].append({'col':e[1],'row':e[0]})
-    if map_instance.shelves is not None and len(shelves) == 0:
-        positions = list(map_instance.shelves.keys())
-        for i in range(len(map_instance.shelves)):
-            x,y = positions[i][0], positions[i][1]
-            shelves.append({
-                'position': (x, y),
-                'flower': map_instance.shelves[(x, y)]['flower'],
-                'color': map_instance.shelves[(x, y)]['color'],
-                'quantity': map_instance.shelves[(x, y)]['quantity']
-            })
-    print(f"Map '{label}' loaded successfully")
-else:
-    print(f"Map '{label}' does not exist. Creating a new map.")
-    map_instance = Map(GRID_WIDTH, GRID_HEIGHT)
-    map_instance.assign_id()
-    # You can add initial obstacles or shelves to the new map if needed
-
-@app.route('/connect_obs', methods=['GET'])
-def connect_obs():
-    return grid_state['obstacles']
-
-@app.route('/connect_shel', methods=['GET'])
-def connect_shel():
-    global shelves
-    return shelves
-
-@app.route('/add_obstacle', methods=['POST'])
-def add_obstacle():
-    data = request.get_json()
-    #print("Received data:", data)  # Add this line for debugging
-    positions = data.get('positions', [])
-    #print("Received positions:", positions)  # Add this line for debugging
-    # Update your grid state with the new obstacle positions
-    global shelves
-    for pos in positions:
-        x , y = pos['row'],pos['col']
-        shelves = [shelf for shelf in shelves if shelf['position'] != (x,y)]
-        map_instance.add_obstacle(x,y)
-        grid_state["obstacles"].append(pos)
-    return jsonify({"message": "Obstacles added", "obstacles": grid_state["obstacles"]})
-
-@app.route('/remove_obstacle', methods=['POST'])
-def remove_obstacle():
-    data = request.get_json()
-    position = data['position']
-    if len(position) == 2:
-        x , y = position['row'], position['col']
-        map_instance.remove_obstacle(x,y)
-    else:
-        for pos in position:
-            x , y = pos['row'],pos['col']
-            map_instance.remove_obstacle(x,y)
-    # Remove the obstacle from grid_state
-    grid_state['obstacles'] = [obs for obs in grid_state['obstacles'] if obs != position]
-    return jsonify({"message": "Obstacle removed", "obstacles": grid_state['obstacles']})
-
-@app.route('/add_shelf', methods=['POST'])
-def add_shelf():
-    data = request.get_json()
-    data = data['details']
-    for pos in data:
-        print(pos)
-        x = pos['row']
-        y = pos['col']
-        flower = pos['flower']
-        color = pos['color']
-        quantity = pos['quantity']
-        map_instance.add_shelf(x,y,flower,color,quantity)
-        shelf = {
-            'position': (x,y),
-            'flower': flower,
-            'color': color,
-            'quantity': quantity
-        }
-        shelves.append(shelf)
-    return jsonify({'message': 'Shelf added successfully', 'shelf': shelf}), 200
-
-@app.route('/remove_shelf', methods=['POST'])
-def remove_shelf():
-    data = request.get_json()
-    print(data)
-    position = data['position']
-    if len(position) == 2:
-        x , y = position['row'],position['col']
-        map_instance.remove_shelf(x,y)
-    else:
-        for pos in position:
-            x , y = pos['row'],pos['col']
-            map_instance.remove_shelf(x,y)
-    # Remove the shelf from the shelves list
-    global shelves
-    shelves = [shelf for shelf in shelves if shelf['position'] != position]
-    return jsonify({"message": "Shelf removed", "shelves": shelves})
-
-#adjust this func
-@app.route('/get_shelf', methods=['POST'])
-def get_shelf():
-    ret = []
-    data = request.get_json()
-    positions = data.get('selectedCells', [])
-    #print(positions)
-    if len(positions) != 0:
-        for pos in positions:
-            x , y = pos['row'], pos['col']
-            temp = map_instance.get_shelf(x, y)
-            print(temp)
-            if temp != None:
-                ret.append(temp)
-            else:
-                ret = None
-    else:
-        ret = shelves
-    return jsonify(ret)
-
-@app.route('/set_start_goal', methods=['POST'])
-def set_start_goal():
-    data = request.get_json()
-    start = data.get('start', None)
-    goal = data.get('goal', None)
-    if start and goal:
-        x1, y1 = start['row'], start['col']
-        x2, y2 = goal['row'], goal['col']
-        map_instance.set_start(x1, y1)
-        map_instance.set_goal(x2, y2)
-        grid_state["start"] = start
-        grid_state["goal"] = goal
-        return jsonify({"message": "Start and goal positions set", "start": start, "goal": goal})
-    else:
-        return jsonify({"message": "Invalid start or goal positions"}), 400
-
-@app.route('/run_simulation', methods=['POST'])
-def run_simulation():
-    data = request.get_json()
-    print(data['goals'])
-    print("Obstacles:", map_instance.obstacles)
-    print("Shelves:",map_instance.shelves)
-    print("Start:", map_instance.start)
-    print("Goal:", map_instance.goal)
-    goals = [(e['row'],e['col']) for e in data['goals']]
-    path = astar_multitarget(map_instance, goals)
-    if path:
-        return jsonify({'path': path})
-    else:
-        return jsonify({'message': 'No path found'}), 404
-
-@app.route('/exit_simulation', methods=['POST'])
-def exit_simulation():
-    map_instance.reset_start()
-    map_instance.reset_goal()
-    return jsonify({"message": "Exiting the simulation"})
-
-@app.route('/reset_map', methods=['POST'])
-def reset_map():
-    map_instance.obstacles = set()
-    map_instance.shelves = {}
-    map_instance.reset_start()
-    map_instance.reset_goal()
-    global grid_state
-    grid_state = {
-        "obstacles": [],
-        "start": None,
-        "goal": None
-    }
-    shelves = []
-    server.reset_map(map_instance.id)
-    return jsonify({"message": "Map and state reset"})
-
-if __name__ == '__main__':
-    app.run(debug=True)
+import gzip
+import json
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+from flask import Flask, Response, abort, g, make_response, request, jsonify
+from flask_cors import CORS
+from map import plan_path, plan_batch
+import distance_fields
+import metrics
+import multiagent
+import orders
+import path_cache
+import persistence
+import profiler
+import registry
+import replan
+import route
+import search
+import server
+
+# LOG_LEVEL=DEBUG also logs the requests and every database write
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper(),
+                    format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+log = logging.getLogger(__name__)
+
+app = Flask(__name__)
+CORS(app)
+
+# Sample grid size, this should be configurable based on your needs
+GRID_WIDTH = 20
+GRID_HEIGHT = 20
+
+# Map used by requests that don't name one with 'map' (label) or 'map_id'
+DEFAULT_MAP = os.environ.get('DEFAULT_MAP', 'warehouse_0')
+
+# Full lists sent to the frontend by /connect_obs and /connect_shel, read from
+# the map (shelf cells are in both, the frontend draws shelves over obstacles)
+def obstacles_json(map_instance):
+    return [{'col': y, 'row': x} for x, y in map_instance.obstacles]
+
+def shelves_json(map_instance):
+    return [{'position': cell, 'flower': shelf['flower'], 'color': shelf['color'], 'quantity': shelf['quantity']}
+            for cell, shelf in map_instance.shelves.items()]
+
+PAYLOADS = {'obstacles': obstacles_json, 'shelves': shelves_json}
+
+# Route sessions kept per map (every one repairs its route on every edit), the
+# least recently used beyond the limit and those idle for longer than
+# ROUTE_SESSION_IDLE seconds are closed
+MAX_ROUTE_SESSIONS = int(os.environ.get('MAX_ROUTE_SESSIONS', 64))
+ROUTE_SESSION_IDLE = float(os.environ.get('ROUTE_SESSION_IDLE', 600))
+
+# What the app keeps for one map besides the map itself: the full lists
+# serialized at the last map version they were asked for (plain and gzipped),
+# and the start/goal and running route of every simulation, by the 'session'
+# sent with the requests ('default' when there is none). The map is the only
+# copy of the obstacles and shelves. Requests may run on several threads: the
+# map guards itself, the rest is only changed under the state lock.
+class MapState:
+    def __init__(self, map_instance):
+        self.map = map_instance
+        self.lock = threading.Lock()
+        self.payloads = {}  # 'obstacles'/'shelves' -> (map version, JSON bytes, gzipped JSON bytes)
+        self.endpoints = {}
+        self.route_sessions = OrderedDict()  # session -> replan.RouteSession, least recently used first
+
+    # Serialized full list at the current map version, built once per version
+    def payload(self, key):
+        cached = self.payloads.get(key)
+        if cached is not None and cached[0] == self.map.version:
+            return cached
+        with self.map.lock.reading():
+            version = self.map.version
+            data = PAYLOADS[key](self.map)
+        body = json.dumps(data, separators=(',', ':')).encode()
+        built = (version, body, gzip.compress(body, compresslevel=6))
+        with self.lock:
+            cached = self.payloads.get(key)
+            if cached is None or cached[0] < version:
+                self.payloads[key] = built
+        return built
+
+    # Running route of a session, None when there is none or it expired
+    def route_session(self, session):
+        self.expire_route_sessions()
+        with self.lock:
+            route_session = self.route_sessions.get(session)
+            if route_session is not None:
+                self.route_sessions.move_to_end(session)
+        return route_session
+
+    def open_route_session(self, session, route_session):
+        with self.lock:
+            closed = [self.route_sessions.pop(session, None)]
+            self.route_sessions[session] = route_session
+            while len(self.route_sessions) > MAX_ROUTE_SESSIONS:
+                closed.append(self.route_sessions.popitem(last=False)[1])
+        for old in closed:
+            if old is not None:
+                old.close()
+
+    def expire_route_sessions(self):
+        idle_since = time.monotonic() - ROUTE_SESSION_IDLE
+        with self.lock:
+            expired = [session for session, route_session in self.route_sessions.items()
+                       if route_session.used < idle_since]
+            closed = [self.route_sessions.pop(session) for session in expired]
+        for route_session in closed:
+            route_session.close()
+
+    def close_route_session(self, session):
+        with self.lock:
+            route_session = self.route_sessions.pop(session, None)
+        if route_session is not None:
+            route_session.close()
+
+    def close(self):
+        for session in list(self.route_sessions):
+            self.close_route_session(session)
+
+states = {}  # Map.uid -> MapState
+states_lock = threading.Lock()
+
+def drop_state(map_instance):
+    with states_lock:
+        state = states.pop(map_instance.uid, None)
+    if state is not None:
+        state.close()
+
+registry.maps.evict_listeners.append(drop_state)
+
+# State of the map named by the request, loaded on first use. Requests for a
+# map that doesn't exist end with a 404, except for the default map which is
+# created.
+def map_state(data=None):
+    data = data or {}
+    key = data.get('map_id', request.args.get('map_id'))
+    if key is not None:
+        try:
+            key = int(key)
+        except ValueError:
+            abort(make_response(jsonify({'message': f"Invalid map id '{key}'"}), 400))
+    else:
+        key = data.get('map', request.args.get('map', DEFAULT_MAP))
+    create = (GRID_WIDTH, GRID_HEIGHT) if key == DEFAULT_MAP else None
+    map_instance = registry.maps.get(key, create)
+    if map_instance is None:
+        abort(make_response(jsonify({'message': f"Unknown map '{key}'"}), 404))
+    with states_lock:
+        state = states.get(map_instance.uid)
+        if state is None:
+            state = states[map_instance.uid] = MapState(map_instance)
+    return state
+
+# Not in the batch planning workers (see batch.py), which import this file
+# again as __mp_main__ when the app was started with "python app.py"
+if __name__ != '__mp_main__':
+    server.create_tables()
+    # Optional write-behind mode: edits are acknowledged once journaled and
+    # written to the database in the background
+    if os.environ.get('WRITE_BEHIND', '').lower() in ('1', 'true', 'yes'):
+        persistence.enable()
+
+# Requests can be profiled with ?profile=1 or an X-Profile header when
+# PROFILE_REQUESTS is set, see profiler.py and /profiles
+PROFILE_REQUESTS = os.environ.get('PROFILE_REQUESTS', '').lower() in ('1', 'true', 'yes')
+
+metrics.collect_stats('path_cache_', path_cache.cache.stats)
+metrics.collect_stats('storage_', server.storage_stats)
+metrics.collect_stats('maps_', registry.maps.stats)
+metrics.collect_stats('write_behind_', persistence.stats)
+
+# One process serves the maps. Every process keeps its own Map objects and is
+# never told about the edits made through another, so several WSGI worker
+# processes would answer from diverging maps: scale with threads instead
+# (gunicorn --threads, waitress). The process answering the first request
+# takes an exclusive lock on PROCESS_LOCK and any other process answers 503.
+PROCESS_LOCK = os.environ.get('PROCESS_LOCK', 'app.lock')
+_process_lock = None  # (pid, locked file)
+_process_lock_guard = threading.Lock()
+
+def hold_process_lock():
+    global _process_lock
+    held = _process_lock
+    if held is not None and held[0] == os.getpid():
+        return True
+    with _process_lock_guard:
+        if _process_lock is None or _process_lock[0] != os.getpid():
+            # A forked child gets a lock of its own, not the parent's
+            file = open(PROCESS_LOCK, 'a+')
+            try:
+                if fcntl is not None:
+                    fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                else:
+                    file.seek(0)
+                    msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+            except OSError:
+                file.close()
+                return False
+            _process_lock = (os.getpid(), file)
+    return True
+
+@app.before_request
+def start_request():
+    g.began = time.perf_counter()
+    if not hold_process_lock():
+        log.error("Another process holds %s, this one doesn't serve the maps", PROCESS_LOCK)
+        return jsonify({'message': 'Another process is serving the maps, run the app as a single process'}), 503
+    g.profile = None
+    if PROFILE_REQUESTS and (request.args.get('profile') or request.headers.get('X-Profile')):
+        g.profile = profiler.Profile(request.endpoint).start()
+
+# Latency of every request by endpoint (unknown URLs together), a streamed
+# answer being timed until its first byte
+@app.after_request
+def finish_request(response):
+    profile = g.pop('profile', None)
+    if profile is not None:
+        response.headers['X-Profile-Id'] = str(profile.stop().id)
+    endpoint = request.endpoint or 'unmatched'
+    metrics.REQUEST_SECONDS.observe(time.perf_counter() - g.pop('began', time.perf_counter()), endpoint, request.method)
+    metrics.REQUESTS.inc(endpoint, request.method, str(response.status_code))
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# Profiles of the last profiled requests, and one of them as collapsed stacks
+@app.route('/profiles', methods=['GET'])
+def list_profiles():
+    return jsonify({'enabled': PROFILE_REQUESTS, 'profiles': profiler.recent()})
+
+@app.route('/profiles/<int:profile_id>', methods=['GET'])
+def get_profile(profile_id):
+    profile = profiler.find(profile_id)
+    if profile is None:
+        return jsonify({'message': f"No profile {profile_id}"}), 404
+    return Response(profile.collapsed(), mimetype='text/plain')
+
+# Full lists, answered with 304 Not Modified while the client's ETag is current
+# (checked before anything is serialized), else from the serialized payload,
+# gzipped for the clients accepting it
+def full_state(state, key):
+    compressed = 'gzip' in request.accept_encodings
+    suffix = '-gzip' if compressed else ''
+    etag = f"{state.map.uid}-{state.map.version}{suffix}"
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    version, body, gzipped = state.payload(key)
+    response = Response(gzipped if compressed else body, mimetype='application/json')
+    if compressed:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    response.set_etag(f"{state.map.uid}-{version}{suffix}")
+    return response
+
+@app.route('/connect_obs', methods=['GET'])
+def connect_obs():
+    return full_state(map_state(), 'obstacles')
+
+@app.route('/connect_shel', methods=['GET'])
+def connect_shel():
+    return full_state(map_state(), 'shelves')
+
+def change_json(cell, cell_state):
+    change = {'row': cell[0], 'col': cell[1], 'state': 'free' if cell_state is None else 'obstacle'}
+    if isinstance(cell_state, tuple):
+        _, flower, color, quantity = cell_state
+        change.update(state='shelf', flower=flower, color=color, quantity=quantity)
+    return change
+
+# Cells changed after version 'since', with their current state. When the
+# server no longer remembers that far back the answer says 'full' and the
+# client reloads /connect_obs and /connect_shel.
+@app.route('/changes', methods=['GET'])
+def changes():
+    map_instance = map_state().map
+    try:
+        since = int(request.args.get('since', 0))
+    except ValueError:
+        return jsonify({'message': 'since must be a map version'}), 400
+    version = map_instance.version
+    changed = map_instance.changes_since(since)
+    if changed is None:
+        return jsonify({'version': version, 'full': True})
+    return jsonify({'version': version, 'changes': [change_json(cell, cell_state) for cell, cell_state in changed]})
+
+# Mutations answer with the cells they changed and the map version after them
+def applied(state, cells):
+    version, cell_states = state.map.cell_states(cells)
+    return {'version': version, 'changes': [change_json(cell, cell_state) for cell, cell_state in cell_states]}
+
+def position_list(position):
+    # A single cell comes as {'row', 'col'}, several cells as a list of them
+    if isinstance(position, dict):
+        return [position]
+    return position
+
+# Request parameters: a bad value ends the request with a 400
+def bad_request(message):
+    abort(make_response(jsonify({'message': message}), 400))
+
+def positive_int(data, key, default=None):
+    value = data.get(key)
+    if value is None:
+        return default
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        bad_request(f"{key} must be a positive integer")
+    try:
+        value = int(value)
+    except ValueError:
+        bad_request(f"{key} must be a positive integer")
+    if value < 1:
+        bad_request(f"{key} must be a positive integer")
+    return value
+
+# Seconds the order solvers may spend, a finite number >= 0
+def time_budget(data, default=route.DEFAULT_TIME_BUDGET):
+    value = data.get('time_budget')
+    if value is None:
+        return default
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        bad_request('time_budget must be a number of seconds')
+    try:
+        value = float(value)
+    except ValueError:
+        bad_request('time_budget must be a number of seconds')
+    if not math.isfinite(value) or value < 0:
+        bad_request('time_budget must be a number of seconds')
+    return value
+
+# Lines of an order: a flower, a color and a positive quantity each
+def order_lines(data):
+    lines = data.get('lines', [])
+    if not isinstance(lines, list):
+        bad_request('lines must be a list of order lines')
+    result = []
+    for line in lines:
+        if not isinstance(line, dict):
+            bad_request('lines must be a list of order lines')
+        flower, color = line.get('flower'), line.get('color')
+        if not isinstance(flower, str) or not flower or not isinstance(color, str) or not color:
+            bad_request('Every order line needs a flower and a color')
+        quantity = positive_int(line, 'quantity')
+        if quantity is None:
+            bad_request('quantity must be a positive integer')
+        result.append((flower, color, quantity))
+    return result
+
+def session_id(data):
+    return str((data or {}).get('session', 'default'))
+
+def with_route(state, data, response):
+    # During a simulation edits also answer with its repaired route
+    route_session = state.route_session(session_id(data))
+    if route_session is not None:
+        response['route'] = route_session.path()
+    return response
+
+@app.route('/add_obstacle', methods=['POST'])
+def add_obstacle():
+    data = request.get_json()
+    state = map_state(data)
+    positions = data.get('positions', [])
+    log.debug("Adding obstacles: %s", positions)
+    # Write all the cells in one transaction
+    cells = [(pos['row'], pos['col']) for pos in positions]
+    if any(state.map.cell_id_or_none(x, y) is None for x, y in cells):
+        return jsonify({'message': 'Obstacles must be inside the map'}), 400
+    if not state.map.add_obstacles_bulk(cells):
+        return jsonify({"message": "Obstacles not added"}), 500
+    return jsonify(with_route(state, data, {"message": "Obstacles added", **applied(state, cells)}))
+
+@app.route('/remove_obstacle', methods=['POST'])
+def remove_obstacle():
+    data = request.get_json()
+    state = map_state(data)
+    position = data['position']
+    cells = [(pos['row'], pos['col']) for pos in position_list(position)]
+    if not state.map.remove_obstacles_bulk(cells):
+        return jsonify({"message": "Obstacle not removed"}), 500
+    return jsonify(with_route(state, data, {"message": "Obstacle removed", **applied(state, cells)}))
+
+@app.route('/add_shelf', methods=['POST'])
+def add_shelf():
+    data = request.get_json()
+    state = map_state(data)
+    details = [(pos['row'], pos['col'], pos['flower'], pos['color'], pos['quantity']) for pos in data['details']]
+    if any(state.map.cell_id_or_none(x, y) is None for x, y, _, _, _ in details):
+        return jsonify({'message': 'Shelves must be inside the map'}), 400
+    if not state.map.add_shelves_bulk(details):
+        return jsonify({'message': 'Shelf not added'}), 500
+    # Shelves already on those cells were overwritten
+    cells = list(dict.fromkeys((x, y) for x, y, _, _, _ in details))
+    shelf = None
+    if details:
+        x, y, flower, color, quantity = details[-1]
+        shelf = {'position': (x, y), 'flower': flower, 'color': color, 'quantity': quantity}
+    response = {'message': 'Shelf added successfully', 'shelf': shelf, **applied(state, cells)}
+    return jsonify(with_route(state, data, response)), 200
+
+@app.route('/remove_shelf', methods=['POST'])
+def remove_shelf():
+    data = request.get_json()
+    state = map_state(data)
+    log.debug("Removing shelves: %s", data)
+    position = data['position']
+    cells = [(pos['row'], pos['col']) for pos in position_list(position)]
+    if not state.map.remove_shelves_bulk(cells):
+        return jsonify({"message": "Shelf not removed"}), 500
+    return jsonify(with_route(state, data, {"message": "Shelf removed", **applied(state, cells)}))
+
+#adjust this func
+@app.route('/get_shelf', methods=['POST'])
+def get_shelf():
+    ret = []
+    data = request.get_json()
+    state = map_state(data)
+    positions = data.get('selectedCells', [])
+    if len(positions) != 0:
+        for pos in positions:
+            x , y = pos['row'], pos['col']
+            temp = state.map.get_shelf(x, y)
+            log.debug("Shelf at (%s, %s): %s", x, y, temp)
+            if temp != None:
+                ret.append(temp)
+            else:
+                ret = None
+    else:
+        return full_state(state, 'shelves')
+    return jsonify(ret)
+
+@app.route('/set_start_goal', methods=['POST'])
+def set_start_goal():
+    data = request.get_json()
+    state = map_state(data)
+    start = data.get('start', None)
+    goal = data.get('goal', None)
+    if start and goal:
+        x1, y1 = start['row'], start['col']
+        x2, y2 = goal['row'], goal['col']
+        # Kept per session, the shared map is never changed
+        with state.lock:
+            state.endpoints[session_id(data)] = ((x1, y1), (x2, y2))
+        return jsonify({"message": "Start and goal positions set", "start": start, "goal": goal})
+    else:
+        return jsonify({"message": "Invalid start or goal positions"}), 400
+
+@app.route('/run_simulation', methods=['POST'])
+def run_simulation():
+    data = request.get_json()
+    state = map_state(data)
+    map_instance = state.map
+    session = session_id(data)
+    # start and goal come with the request or from /set_start_goal
+    start, goal = state.endpoints.get(session, (None, None))
+    if data.get('start'):
+        start = (data['start']['row'], data['start']['col'])
+    if data.get('goal'):
+        goal = (data['goal']['row'], data['goal']['col'])
+    goals = [(e['row'],e['col']) for e in data['goals']]
+    log.debug("Simulation from %s to %s through %s", start, goal, goals)
+    algorithm = data.get('algorithm', 'astar')
+    if algorithm not in search.ALGORITHMS:
+        return jsonify({'message': f"Unknown algorithm '{algorithm}'"}), 400
+    budget = time_budget(data)
+    if start is None or goal is None:
+        return jsonify({'message': 'Start and goal must be set'}), 400
+    # Refuse targets that can't be reached before planning anything
+    try:
+        with map_instance.lock.reading():
+            route.check_targets(map_instance, start, goals, goal)
+    except route.Unreachable as e:
+        return jsonify({'message': str(e),
+                        'target': {'row': e.cell[0], 'col': e.cell[1]},
+                        'reason': e.reason}), 404
+    path = plan_path(map_instance, start, goals, goal, algorithm, budget)
+    if path:
+        # The session follows the visiting order of the planned path
+        waypoints = route.order_along(path, goals, goal)
+        state.open_route_session(session, replan.RouteSession(map_instance, start, goals, goal, waypoints=waypoints))
+        return jsonify({'path': path})
+    else:
+        return jsonify({'message': 'No path found'}), 404
+
+@app.route('/plan_batch', methods=['POST'])
+def plan_batch_route():
+    data = request.get_json()
+    map_instance = map_state(data).map
+    jobs = []
+    for job in data.get('jobs', []):
+        start, end = job['start'], job['end']
+        goals = [(e['row'], e['col']) for e in job.get('goals', [])]
+        jobs.append(((start['row'], start['col']), goals, (end['row'], end['col'])))
+    workers = positive_int(data, 'workers')
+    if workers is not None:
+        workers = min(workers, os.cpu_count() or 1)  # the pool has one worker per core
+    budget = time_budget(data)
+
+    # One JSON line per job, in the order they finish
+    def results():
+        for index, path, error in plan_batch(map_instance, jobs, workers, budget):
+            if error is None:
+                line = {'index': index, 'path': path}
+            else:
+                line = {'index': index, 'message': error['message'],
+                        'target': {'row': error['cell'][0], 'col': error['cell'][1]},
+                        'reason': error['reason']}
+            yield json.dumps(line) + '\n'
+    return Response(results(), mimetype='application/x-ndjson')
+
+# Conflict-free, time-indexed paths for several pickers sharing the map: path[t]
+# is the cell of the picker at step t
+@app.route('/plan_team', methods=['POST'])
+def plan_team():
+    data = request.get_json()
+    map_instance = map_state(data).map
+    pickers = []
+    for picker in data.get('pickers', []):
+        start = (picker['start']['row'], picker['start']['col'])
+        end = (picker['end']['row'], picker['end']['col']) if picker.get('end') else start
+        pickers.append((start, [(e['row'], e['col']) for e in picker.get('goals', [])], end))
+    mode = data.get('mode', 'cooperative')
+    if mode not in ('cooperative', 'cbs'):
+        return jsonify({'message': f"Unknown mode '{mode}'"}), 400
+    budget = time_budget(data, multiagent.DEFAULT_TIME_BUDGET)
+    try:
+        with map_instance.lock.reading():
+            mode, paths = multiagent.plan_team(map_instance, pickers, mode, budget, data.get('stay', True))
+    except route.Unreachable as e:
+        return jsonify({'message': str(e),
+                        'target': {'row': e.cell[0], 'col': e.cell[1]},
+                        'reason': e.reason}), 404
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    planned = [path for path in paths if path is not None]
+    return jsonify({'mode': mode, 'paths': paths,
+                    'unplanned': [index for index, path in enumerate(paths) if path is None],
+                    'makespan': max((len(path) - 1 for path in planned), default=0),
+                    'sum_of_costs': sum(len(path) - 1 for path in planned)})
+
+@app.route('/update_route', methods=['POST'])
+def update_route():
+    data = request.get_json(silent=True) or {}
+    state = map_state(data)
+    route_session = state.route_session(session_id(data))
+    if route_session is None:
+        return jsonify({'message': 'No simulation running'}), 404
+    position = data.get('position')
+    if position is not None:
+        route_session.move_to((position['row'], position['col']))
+    path = route_session.path()
+    if path is None:
+        return jsonify({'message': 'No path found'}), 404
+    return jsonify({'path': path})
+
+@app.route('/exit_simulation', methods=['POST'])
+def exit_simulation():
+    data = request.get_json(silent=True)
+    state = map_state(data)
+    session = session_id(data)
+    state.close_route_session(session)
+    with state.lock:
+        state.endpoints.pop(session, None)
+    return jsonify({"message": "Exiting the simulation"})
+
+@app.route('/reset_map', methods=['POST'])
+def reset_map():
+    state = map_state(request.get_json(silent=True))
+    state.close()
+    state.map.reset()
+    if persistence.writer is not None:
+        persistence.writer.discard(state.map.id)
+        persistence.flush()  # nothing queued before may land after the reset
+    with state.lock:
+        state.endpoints.clear()
+    server.reset_map(state.map.id)
+    return jsonify({"message": "Map and state reset"})
+
+@app.route('/route_to_shelf', methods=['POST'])
+def route_to_shelf():
+    data = request.get_json()
+    map_instance = map_state(data).map
+    start = (data['start']['row'], data['start']['col'])
+    shelf = (data['shelf']['row'], data['shelf']['col'])
+    if map_instance.get_shelf(*shelf) is None:
+        return jsonify({'message': 'No shelf at this position'}), 404
+    with map_instance.lock.reading():
+        path = distance_fields.fields_for(map_instance).path_to_shelf(start, shelf)
+    if path:
+        return jsonify({'path': path})
+    else:
+        return jsonify({'message': 'No path found'}), 404
+
+# The k nearest shelves, in walking distance from start, holding at least
+# 'quantity' of the flower and/or color
+@app.route('/find_stock', methods=['POST'])
+def find_stock():
+    data = request.get_json()
+    map_instance = map_state(data).map
+    start = (data['start']['row'], data['start']['col'])
+    flower, color = data.get('flower'), data.get('color')
+    quantity = positive_int(data, 'quantity', 1)
+    k = positive_int(data, 'k', 1)
+    if not map_instance.is_valid(*start):
+        return jsonify({'message': 'Start must be a free cell of the map'}), 400
+    with map_instance.lock.reading():
+        nearest = distance_fields.nearest_shelves(map_instance, start, map_instance.find_stock(flower, color, quantity), k)
+        shelves = [{'position': shelf, 'flower': map_instance.shelves[shelf]['flower'],
+                    'color': map_instance.shelves[shelf]['color'],
+                    'quantity': map_instance.shelves[shelf]['quantity'],
+                    'distance': distance, 'path': path}
+                   for distance, shelf, path in nearest]
+    if not shelves:
+        return jsonify({'message': 'No reachable shelf holds this stock'}), 404
+    return jsonify({'shelves': shelves})
+
+# Plan an order of (flower, color, quantity) lines from start to the dock (the
+# start by default): the shelves to draw from and the route, with the
+# quantities reserved on the shelves
+@app.route('/fulfil_order', methods=['POST'])
+def fulfil_order():
+    data = request.get_json()
+    state = map_state(data)
+    start = (data['start']['row'], data['start']['col'])
+    dock = (data['dock']['row'], data['dock']['col']) if data.get('dock') else None
+    lines = order_lines(data)
+    budget = time_budget(data)
+    try:
+        plan = orders.fulfil_order(state.map, start, lines, dock, budget)
+    except route.Unreachable as e:
+        return jsonify({'message': str(e),
+                        'target': {'row': e.cell[0], 'col': e.cell[1]},
+                        'reason': e.reason}), 404
+    except orders.OutOfStock as e:
+        return jsonify({'message': str(e), 'flower': e.flower, 'color': e.color, 'missing': e.missing}), 404
+    if plan is None:
+        return jsonify({'message': 'Stock could not be reserved, try again'}), 409
+    taken = {shelf: quantity for shelf, quantity in plan.takes()}
+    picks = [{'shelf': {'row': shelf[0], 'col': shelf[1]}, 'stop': {'row': stop[0], 'col': stop[1]},
+              'flower': flower, 'color': color, 'quantity': quantity}
+             for shelf, stop, flower, color, quantity in plan.picks]
+    goals = [{'row': x, 'col': y} for x, y in dict.fromkeys(stop for _, stop, _, _, _ in plan.picks)]
+    return jsonify({'path': plan.path, 'picks': picks, 'goals': goals, **applied(state, list(taken))})
+
+@app.route('/maps', methods=['GET'])
+def list_maps():
+    return jsonify({'loaded': registry.maps.loaded(), 'registry': registry.maps.stats()})
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    return jsonify({'path_cache': path_cache.cache.stats(), 'storage': server.storage_stats(),
+                    'maps': registry.maps.stats(), 'write_behind': persistence.stats()})
+
+if __name__ == '__main__':
+    app.run(debug=True)
@@ -0,0 +1,148 @@
+import collections
+import itertools
+import multiprocessing
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+import route
+
+# Batch route planning over a process pool. The occupancy grid of a batch is
+# copied once into shared memory and the workers attach to it on its first
+# job, so a job only carries its own cells across the process boundary, never
+# the Map. Results are yielded in completion order.
+
+# Read-only stand-in for Map inside the workers, with what the planners use
+class GridSnapshot:
+    def __init__(self, width, height, cells, map_id, uid, version):
+        self.width = width
+        self.height = height
+        self.stride = height + 2
+        self.cells = cells
+        self.offsets = (1, self.stride, -1, -self.stride)
+        self.id = map_id
+        self.uid = uid
+        self.version = version
+        self.listeners = []  # never called, the snapshot doesn't change
+
+    def edits_since(self, version):
+        return [] if version == self.version else None
+
+    def cell_id(self, x, y):
+        return (x + 1) * self.stride + y + 1
+
+    def cell_id_or_none(self, x, y):
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return (x + 1) * self.stride + y + 1
+        return None
+
+    def cell_xy(self, i):
+        x, y = divmod(i, self.stride)
+        return (x - 1, y - 1)
+
+# One pool for the whole process, started on first use. Its workers are
+# started by a fork server (or spawned), never forked from the threaded app
+# process, which could hand a child a lock held by another thread.
+_pool = None
+_pool_lock = threading.Lock()
+
+def _context():
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+def pool_size():
+    return os.cpu_count() or 1
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=pool_size(), mp_context=_context())
+        return _pool
+
+def _reset_pool(broken):
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+# Snapshots a worker is attached to, by shared memory name, the most recent
+# last; jobs of a few batches can be interleaved on the same worker
+ATTACHED = 4
+_attached = collections.OrderedDict()
+
+def _snapshot(name, width, height, map_id, uid, version):
+    attached = _attached.get(name)
+    if attached is not None:
+        _attached.move_to_end(name)
+        return attached[0]
+    while len(_attached) >= ATTACHED:
+        _, (old, shm, views) = _attached.popitem(last=False)
+        for view in views:
+            view.release()
+        shm.close()
+    shm = shared_memory.SharedMemory(name=name)
+    size = (width + 2) * (height + 2)
+    window = shm.buf[:size]
+    cells = window.toreadonly()
+    snapshot = GridSnapshot(width, height, cells, map_id, uid, version)
+    _attached[name] = (snapshot, shm, (cells, window))
+    return snapshot
+
+# One job: returns (index, path, error), error being None or a dict with the
+# message, the offending cell and the reason
+def _plan(grid, index, start, targets, end, time_budget):
+    return plan_job(_snapshot(*grid), index, start, targets, end, time_budget)
+
+def plan_job(map, index, start, targets, end, time_budget=route.DEFAULT_TIME_BUDGET):
+    try:
+        path = route.plan_route(map, start, targets, end, time_budget)
+    except route.Unreachable as e:
+        return index, None, {'message': str(e), 'cell': e.cell, 'reason': e.reason}
+    return index, path, None
+
+# Plans every (start, targets, end) job on a snapshot of the map taken now and
+# yields (index, path, error) as the jobs finish. At most `workers` jobs of
+# the batch run at once on the shared pool, by default and at most as many as
+# there are cores; with one worker the jobs run in this process.
+def plan_batch(map, jobs, workers=None, time_budget=route.DEFAULT_TIME_BUDGET):
+    jobs = list(jobs)
+    if workers is None:
+        workers = pool_size()
+    workers = max(1, min(workers, pool_size(), len(jobs)))
+    if workers == 1:
+        for index, (start, targets, end) in enumerate(jobs):
+            with map.lock.reading():
+                result = plan_job(map, index, start, targets, end, time_budget)
+            yield result
+        return
+    shm = shared_memory.SharedMemory(create=True, size=len(map.cells))
+    pool = _get_pool()
+    running = set()
+    try:
+        with map.lock.reading():
+            shm.buf[:len(map.cells)] = map.cells
+            version = map.version
+        grid = (shm.name, map.width, map.height, map.id, map.uid, version)
+        pending = enumerate(jobs)
+        for index, (start, targets, end) in itertools.islice(pending, workers):
+            running.add(pool.submit(_plan, grid, index, start, list(targets), end, time_budget))
+        while running:
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    result = future.result()
+                except BrokenProcessPool:
+                    _reset_pool(pool)
+                    raise
+                for index, (start, targets, end) in itertools.islice(pending, 1):
+                    running.add(pool.submit(_plan, grid, index, start, list(targets), end, time_budget))
+                yield result
+    finally:
+        for future in running:
+            future.cancel()
+        wait(running)  # no job may still read the snapshot
+        shm.close()
+        shm.unlink()
@@ -0,0 +1,103 @@
+import argparse
+import heapq
+import random
+import time
+from map import Map
+import search
+
+# Benchmark of the flat-index search engine against the original tuple/dict A*,
+# and of Jump Point Search against A*. The default layout scatters random
+# obstacles (--clutter); --layout aisles builds shelf aisles, where JPS pays off.
+# Usage: python bench_search.py [--sizes 100 500 1000 2000] [--queries 5] [--layout {clutter,aisles}]
+
+def legacy_astar(map, start, goal):
+    open_set = [(0, start)]
+    came_from = {}
+    cost_so_far = {start: 0}
+    while open_set:
+        _, current = heapq.heappop(open_set)
+        if current == goal:
+            path = [current]
+            while current in came_from:
+                current = came_from[current]
+                path.insert(0, current)
+            return path
+        for neighbor in map.neighbors(*current):
+            new_cost = cost_so_far[current] + 1
+            if neighbor not in cost_so_far or new_cost < cost_so_far[neighbor]:
+                cost_so_far[neighbor] = new_cost
+                priority = new_cost + abs(goal[0] - neighbor[0]) + abs(goal[1] - neighbor[1])
+                heapq.heappush(open_set, (priority, neighbor))
+                came_from[neighbor] = current
+    return None
+
+def make_map(size, clutter, rnd):
+    map = Map(size, size)
+    for _ in range(int(size * size * clutter)):
+        map.obstacles.add((rnd.randrange(size), rnd.randrange(size)))
+    return map
+
+# Racks two cells deep separated by one-cell aisles, with a cross aisle every
+# `block` cells
+def make_aisles(size, block=20):
+    map = Map(size, size)
+    for x in range(1, size - 1):
+        if x % 3 == 0:
+            continue
+        for y in range(1, size - 1):
+            if y % block:
+                map.obstacles.add((x, y))
+    return map
+
+def free_cell(map, rnd):
+    while True:
+        cell = (rnd.randrange(map.width), rnd.randrange(map.height))
+        if map.is_valid(*cell):
+            return cell
+
+def timed(fn, *args):
+    began = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - began
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 500, 1000, 2000])
+    parser.add_argument('--queries', type=int, default=5)
+    parser.add_argument('--clutter', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--layout', choices=['clutter', 'aisles'], default='clutter')
+    parser.add_argument('--skip-legacy', action='store_true')
+    args = parser.parse_args()
+
+    print(f"{'size':>6} {'legacy s':>10} {'astar s':>10} {'speedup':>8} {'expanded':>10} "
+          f"{'jps s':>10} {'jps expanded':>13}")
+    for size in args.sizes:
+        rnd = random.Random(args.seed)
+        if args.layout == 'aisles':
+            map = make_aisles(size)
+        else:
+            map = make_map(size, args.clutter, rnd)
+        legacy_time = engine_time = jps_time = 0.0
+        expanded = jps_expanded = 0
+        for _ in range(args.queries):
+            start, goal = free_cell(map, rnd), free_cell(map, rnd)
+            path, elapsed = timed(search.find_path, map, start, goal, True, 'astar', False)
+            engine_time += elapsed
+            expanded += search.engine_for(map).expanded
+            jps_path, elapsed = timed(search.find_path, map, start, goal, True, 'jps', False)
+            jps_time += elapsed
+            jps_expanded += search.engine_for(map).expanded
+            assert (path is None) == (jps_path is None)
+            assert path is None or len(path) == len(jps_path)
+            if not args.skip_legacy:
+                expected, elapsed = timed(legacy_astar, map, start, goal)
+                legacy_time += elapsed
+                assert (path is None) == (expected is None)
+                assert path is None or len(path) == len(expected)
+        speedup = legacy_time / max(engine_time, 1e-9)
+        print(f"{size:>6} {legacy_time:>10.3f} {engine_time:>10.3f} {speedup:>7.1f}x {expanded:>10} "
+              f"{jps_time:>10.3f} {jps_expanded:>13}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,339 @@
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from bench_search import free_cell
+from map import Map
+import orders
+import registry
+import route
+import search
+import server
+import snapshot
+import storage
+import warehouse
+
+# Reproducible benchmark suite on generated warehouses (see warehouse.py):
+#
+#   pathfinding  single paths with every search algorithm, and how much longer
+#                the HPA* paths are than the optimal ones
+#   ordering     multi-target routes (route.plan_route) and order plans, with
+#                the tour length against the exact optimum where that is
+#                still computable
+#   load         map hydration from the stored rows and from snapshot files
+#   edits        the bulk obstacle and shelf edits of Map
+#   endpoints    the edit, sync and simulation endpoints through the Flask test
+#                client (skipped when Flask is not installed)
+#
+# The maps are stored in the storage backend chosen with --storage (see
+# storage.py, PostgreSQL by default); the benchmark maps are deleted afterwards.
+# Results are written as JSON with --output, and --compare prints the
+# change of every timing against an earlier results file.
+# Usage: python benchmarks.py [--sizes 20 100 500] [--suites pathfinding ordering]
+#                             [--storage sqlite] [--output results.json] [--compare old.json]
+
+SUITES = ('pathfinding', 'ordering', 'load', 'edits', 'endpoints')
+# Tours up to this many targets are also solved exactly to rate the solver
+OPTIMAL_MAX = 12
+RESULTS_FORMAT = 1
+
+# Store a generated map under a new map id
+def save_map(map_instance):
+    map_id = server.create_map(map_instance.width, map_instance.height, map_instance.label)
+    if map_id is None:
+        raise RuntimeError("The benchmark map could not be created")
+    changes = [(cell, map_instance._cell_state(cell)) for cell in map_instance.obstacles]
+    if changes and not server.apply_changes(map_id, changes):
+        server.delete_map(map_id)
+        raise RuntimeError("The benchmark map could not be written")
+    return map_id
+
+def summary(samples):
+    ordered = sorted(samples)
+    return {'samples': len(ordered),
+            'mean_s': statistics.fmean(ordered),
+            'p50_s': statistics.median(ordered),
+            'p95_s': ordered[max(0, math.ceil(0.95 * len(ordered)) - 1)],
+            'min_s': ordered[0],
+            'max_s': ordered[-1]}
+
+def timed(fn, *args, **kwargs):
+    began = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - began
+
+class Run:
+    def __init__(self, args):
+        self.args = args
+        self.results = []
+
+    def record(self, suite, case, map_instance, samples, **extra):
+        if not samples:
+            return
+        result = {'suite': suite, 'case': case, 'layout': self.args.layout,
+                  'size': map_instance.width, **summary(samples), **extra}
+        self.results.append(result)
+        print(f"{suite:>12} {case:<28} {map_instance.width:>5} {result['p50_s'] * 1000:>10.3f} "
+              f"{result['p95_s'] * 1000:>10.3f} {result['samples']:>6}", file=sys.stderr)
+
+    def skip(self, suite, map_instance, reason):
+        self.results.append({'suite': suite, 'case': None, 'layout': self.args.layout,
+                             'size': map_instance.width, 'skipped': reason})
+        print(f"{suite:>12} skipped: {reason}", file=sys.stderr)
+
+def bench_pathfinding(run, map_instance, rnd):
+    pairs = [(free_cell(map_instance, rnd), free_cell(map_instance, rnd)) for _ in range(run.args.queries)]
+    lengths = {}
+    for algorithm in search.ALGORITHMS:
+        # The first query also builds the component labels and the hierarchy
+        _, first = timed(search.find_path, map_instance, *pairs[0], False, algorithm, False)
+        samples, expanded, lengths[algorithm] = [], 0, []
+        for start, goal in pairs:
+            path, elapsed = timed(search.find_path, map_instance, start, goal, False, algorithm, False)
+            samples.append(elapsed)
+            if algorithm != 'hpa':
+                expanded += search.engine_for(map_instance).expanded
+            lengths[algorithm].append(None if path is None else len(path))
+        extra = {'first_s': first}
+        if algorithm == 'hpa':
+            ratios = [hpa / optimal for hpa, optimal in zip(lengths['hpa'], lengths['astar']) if optimal and hpa]
+            if ratios:
+                extra.update(length_ratio_mean=statistics.fmean(ratios), length_ratio_max=max(ratios))
+        else:
+            extra['expanded_mean'] = expanded / len(pairs)
+        run.record('pathfinding', algorithm, map_instance, samples, **extra)
+    if lengths['astar'] != lengths['jps']:
+        raise AssertionError("A* and JPS disagree on a path length")
+
+def bench_ordering(run, map_instance, rnd):
+    args = run.args
+    for count in args.targets:
+        samples, ratios, baseline = [], [], []
+        for _ in range(args.queries):
+            start, end = free_cell(map_instance, rnd), free_cell(map_instance, rnd)
+            targets = [free_cell(map_instance, rnd) for _ in range(count)]
+            try:
+                path, elapsed = timed(route.plan_route, map_instance, start, targets, end, args.time_budget)
+            except route.Unreachable:
+                continue  # cut off by the clutter
+            samples.append(elapsed)
+            cells = [start] + targets + [end]
+            dist, _ = route.distance_matrix(map_instance, [map_instance.cell_id(*cell) for cell in cells])
+            length = len(path) - 1
+            if count <= OPTIMAL_MAX:
+                optimal = route.route_length(route.held_karp(dist), dist)
+                ratios.append(length / optimal if optimal else 1.0)
+            else:
+                nearest = route.route_length(route.nearest_neighbor(dist), dist)
+                baseline.append(length / nearest if nearest else 1.0)
+        extra = {'targets': count}
+        if ratios:
+            extra.update(optimal_ratio_mean=statistics.fmean(ratios), optimal_ratio_max=max(ratios))
+        if baseline:
+            extra['nearest_neighbor_ratio_mean'] = statistics.fmean(baseline)
+        run.record('ordering', f"plan_route_{count}", map_instance, samples, **extra)
+
+    products = [product for product in warehouse.PRODUCTS if map_instance.find_stock(*product)]
+    samples = []
+    for _ in range(args.queries if products else 0):
+        start = free_cell(map_instance, rnd)
+        lines = [product + (rnd.randint(1, 20),) for product in rnd.sample(products, min(args.order_lines, len(products)))]
+        try:
+            _, elapsed = timed(orders.plan_order, map_instance, start, lines, None, args.time_budget)
+        except (route.Unreachable, orders.OutOfStock):
+            continue
+        samples.append(elapsed)
+    run.record('ordering', f"plan_order_{args.order_lines}_lines", map_instance, samples)
+
+def bench_load(run, map_instance, rnd):
+    queries = max(1, run.args.queries // 4)
+    samples = []
+    for _ in range(queries):
+        loaded, elapsed = timed(Map.load, map_id=map_instance.id)
+        samples.append(elapsed)
+    run.record('load', f"hydrate_{run.args.storage}", map_instance, samples,
+               obstacles=len(loaded.obstacles), shelves=len(loaded.shelves))
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.snap')
+        writes, reads = [], []
+        for _ in range(queries):
+            _, elapsed = timed(snapshot.save_snapshot, loaded, path)
+            writes.append(elapsed)
+            _, elapsed = timed(snapshot.load_snapshot, path)
+            reads.append(elapsed)
+        run.record('load', 'snapshot_write', map_instance, writes, bytes=os.path.getsize(path))
+        run.record('load', 'snapshot_read', map_instance, reads)
+
+def _free_cells(map_instance, rnd, count):
+    cells = set()
+    for _ in range(count * 10):
+        if len(cells) == count:
+            break
+        cells.add(free_cell(map_instance, rnd))
+    return list(cells)
+
+def bench_edits(run, map_instance, rnd):
+    for batch in run.args.batches:
+        timings = {'add_obstacles': [], 'remove_obstacles': [], 'add_shelves': [], 'remove_shelves': []}
+        for _ in range(max(1, run.args.queries // 4)):
+            cells = _free_cells(map_instance, rnd, batch)  # fewer on a small map
+            shelves = [cell + rnd.choice(warehouse.PRODUCTS) + (rnd.randint(1, 50),) for cell in cells]
+            for name, method, arg in (('add_obstacles', map_instance.add_obstacles_bulk, cells),
+                                      ('remove_obstacles', map_instance.remove_obstacles_bulk, cells),
+                                      ('add_shelves', map_instance.add_shelves_bulk, shelves),
+                                      ('remove_shelves', map_instance.remove_shelves_bulk, cells)):
+                ok, elapsed = timed(method, arg)
+                if not ok:
+                    raise RuntimeError(f"{name} of {batch} cells failed")
+                timings[name].append(elapsed)
+        for name, samples in timings.items():
+            run.record('edits', f"{name}_{batch}", map_instance, samples, batch=batch, cells=len(cells))
+
+def bench_endpoints(run, map_instance, rnd):
+    # Not the lock of an app serving from this directory (see app.py)
+    os.environ.setdefault('PROCESS_LOCK', os.path.join(tempfile.gettempdir(), 'benchmarks.lock'))
+    try:
+        import app
+    except ImportError as e:
+        run.skip('endpoints', map_instance, str(e))
+        return
+    client = app.app.test_client()
+    registry.maps.add(map_instance)
+    queries = run.args.queries
+    key = {'map_id': map_instance.id}
+    query = f"map_id={map_instance.id}"
+    position = lambda cell: {'row': cell[0], 'col': cell[1]}
+
+    def call(samples, method, url, **kwargs):
+        response, elapsed = timed(getattr(client, method), url, **kwargs)
+        if response.status_code >= 400:
+            raise RuntimeError(f"{url} answered {response.status_code}")
+        samples.append(elapsed)
+        return response
+
+    full, conditional = [], []
+    for _ in range(queries):
+        response = call(full, 'get', f"/connect_obs?{query}")
+        call(conditional, 'get', f"/connect_obs?{query}", headers={'If-None-Match': response.headers['ETag']})
+    run.record('endpoints', 'connect_obs', map_instance, full, bytes=len(response.data))
+    run.record('endpoints', 'connect_obs_not_modified', map_instance, conditional)
+    gzipped = []
+    for _ in range(queries):
+        response = call(gzipped, 'get', f"/connect_shel?{query}", headers={'Accept-Encoding': 'gzip'})
+    run.record('endpoints', 'connect_shel_gzip', map_instance, gzipped, bytes=len(response.data))
+
+    for batch in run.args.batches:
+        added, removed, changes = [], [], []
+        for _ in range(max(1, queries // 4)):
+            version = map_instance.version
+            positions = [position(cell) for cell in _free_cells(map_instance, rnd, batch)]
+            call(added, 'post', '/add_obstacle', json={**key, 'positions': positions})
+            call(changes, 'get', f"/changes?{query}&since={version}")
+            call(removed, 'post', '/remove_obstacle', json={**key, 'position': positions})
+        run.record('endpoints', f"add_obstacle_{batch}", map_instance, added, batch=batch)
+        run.record('endpoints', f"remove_obstacle_{batch}", map_instance, removed, batch=batch)
+        run.record('endpoints', f"changes_{batch}", map_instance, changes, batch=batch)
+
+    samples = []
+    for _ in range(queries):
+        goals = [position(free_cell(map_instance, rnd)) for _ in range(5)]
+        body = {**key, 'start': position(free_cell(map_instance, rnd)), 'goal': position(free_cell(map_instance, rnd)),
+                'goals': goals, 'time_budget': run.args.time_budget}
+        response, elapsed = timed(client.post, '/run_simulation', json=body)
+        if response.status_code == 200:
+            samples.append(elapsed)
+    run.record('endpoints', 'run_simulation_5', map_instance, samples)
+    app.drop_state(map_instance)
+
+BENCHMARKS = {'pathfinding': bench_pathfinding, 'ordering': bench_ordering, 'load': bench_load,
+              'edits': bench_edits, 'endpoints': bench_endpoints}
+
+def environment(args):
+    def git(*command):
+        try:
+            return subprocess.run(('git',) + command, capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+    status = git('status', '--porcelain', '--untracked-files=no')
+    return {'format': RESULTS_FORMAT,
+            'commit': git('rev-parse', 'HEAD'),
+            'dirty': bool(status) if status is not None else None,
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'storage': args.storage,
+            'options': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')}}
+
+def _key(result):
+    return (result['suite'], result['case'], result['layout'], result['size'])
+
+# Print the median timings against an earlier run; returns the regressions
+def compare(results, path, threshold):
+    with open(path) as file:
+        before = {_key(result): result for result in json.load(file)['results'] if 'p50_s' in result}
+    regressions = []
+    print(f"{'suite':>12} {'case':<28} {'size':>5} {'before ms':>10} {'after ms':>10} {'change':>8}")
+    for result in results:
+        old = before.get(_key(result))
+        if old is None or 'p50_s' not in result:
+            continue
+        ratio = result['p50_s'] / max(old['p50_s'], 1e-9)
+        flag = ' slower' if ratio > threshold else ''
+        print(f"{result['suite']:>12} {result['case']:<28} {result['size']:>5} {old['p50_s'] * 1000:>10.3f} "
+              f"{result['p50_s'] * 1000:>10.3f} {ratio:>7.2f}x{flag}")
+        if flag:
+            regressions.append(result)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the backend on generated warehouses")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[20, 100, 500])
+    parser.add_argument('--layout', choices=warehouse.LAYOUTS, default='aisles')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--suites', nargs='+', choices=SUITES, default=list(SUITES))
+    parser.add_argument('--storage', choices=sorted(storage.BACKENDS), default='postgres')
+    parser.add_argument('--queries', type=int, default=20)
+    parser.add_argument('--targets', type=int, nargs='+', default=[5, OPTIMAL_MAX, 30])
+    parser.add_argument('--order-lines', type=int, default=4)
+    parser.add_argument('--batches', type=int, nargs='+', default=[1, 100, 1000])
+    parser.add_argument('--time-budget', type=float, default=route.DEFAULT_TIME_BUDGET)
+    parser.add_argument('--output')
+    parser.add_argument('--compare')
+    parser.add_argument('--threshold', type=float, default=1.25, help="slowdown reported as a regression")
+    args = parser.parse_args()
+
+    server.use_storage(args.storage)
+    run = Run(args)
+    print(f"{'suite':>12} {'case':<28} {'size':>5} {'p50 ms':>10} {'p95 ms':>10} {'runs':>6}", file=sys.stderr)
+    for size in args.sizes:
+        map_instance, generation = timed(warehouse.generate_warehouse, size, size, args.seed, args.layout)
+        print(f"{args.layout} {size}x{size}: {len(map_instance.obstacles)} obstacles, "
+              f"{len(map_instance.shelves)} shelves, generated in {generation:.2f}s", file=sys.stderr)
+        map_instance.id = save_map(map_instance)
+        try:
+            for suite in args.suites:
+                # Every suite gets its own stream of random cells
+                BENCHMARKS[suite](run, map_instance, random.Random(f"{args.seed}-{size}-{suite}"))
+        finally:
+            server.delete_map(map_instance.id)
+
+    report = {'environment': environment(args), 'results': run.results}
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+        print(f"Results written to {args.output}", file=sys.stderr)
+    if args.compare:
+        regressions = compare(run.results, args.compare, args.threshold)
+        print(f"{len(regressions)} timings more than {args.threshold:.2f}x slower")
+        sys.exit(1 if regressions else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+import re
+import threading
+from array import array
+from collections import deque
+
+# Connected-component labels of the free cells of a map, so that "can b be
+# reached from a" is answered in O(1) instead of by a search that floods the
+# whole reachable area.
+#
+# Every free cell holds a label, labels are merged with union-find. The first
+# labeling works on runs of free cells row by row. Freeing a cell unions the
+# components around it. Blocking a cell may split its component: searches
+# started from its free neighbors run side by side until they meet, and the
+# regions of the searches that run out of cells first (the smaller pieces) get
+# a new label, so the cost is bounded by the size of those pieces.
+
+_FREE_RUN = re.compile(b'\x00+')
+
+class ComponentIndex:
+    def __init__(self, map):
+        self.map = map
+        self.labels = array('i', [0]) * len(map.cells)  # 0 for blocked cells
+        self._parent = [0]  # union-find over labels, label 0 is unused
+        self._lock = threading.RLock()
+        self._label_runs()
+        map.listeners.append(self.cell_changed)
+
+    def _new_label(self):
+        self._parent.append(len(self._parent))
+        return len(self._parent) - 1
+
+    def find(self, label):
+        parent = self._parent
+        root = label
+        while parent[root] != root:
+            root = parent[root]
+        while parent[label] != root:
+            parent[label], label = root, parent[label]
+        return root
+
+    def _union(self, a, b):
+        a, b = self.find(a), self.find(b)
+        if a != b:
+            self._parent[b] = a
+        return a
+
+    def _label_runs(self):
+        map = self.map
+        cells, stride, labels = map.cells, map.stride, self.labels
+        previous = []  # (start, end, label) of the runs of the row above
+        for x in range(map.width):
+            row = (x + 1) * stride
+            runs = []
+            k = 0
+            for match in _FREE_RUN.finditer(cells, row + 1, row + stride - 1):
+                start, end = match.start() - row, match.end() - row
+                label = None
+                while k < len(previous) and previous[k][1] <= start:
+                    k += 1
+                j = k
+                while j < len(previous) and previous[j][0] < end:
+                    label = previous[j][2] if label is None else self._union(label, previous[j][2])
+                    j += 1
+                if label is None:
+                    label = self._new_label()
+                runs.append((start, end, label))
+            previous = runs
+            for start, end, label in runs:
+                labels[row + start:row + end] = array('i', [label]) * (end - start)
+
+    def component(self, i):
+        label = self.labels[i]
+        return self.find(label) if label else 0
+
+    # True if both flat cell ids are free and in the same component
+    def connected(self, a, b):
+        with self._lock:
+            ca = self.component(a)
+            return ca != 0 and ca == self.component(b)
+
+    def cell_changed(self, i):
+        map = self.map
+        cells, labels = map.cells, self.labels
+        with self._lock:
+            if not cells[i]:
+                around = [labels[i + offset] for offset in map.offsets if not cells[i + offset]]
+                if not around:
+                    labels[i] = self._new_label()
+                    return
+                label = around[0]
+                for other in around[1:]:
+                    label = self._union(label, other)
+                labels[i] = label
+            else:
+                labels[i] = 0
+                starts = [i + offset for offset in map.offsets if not cells[i + offset]]
+                if len(starts) > 1:
+                    self._split(starts)
+
+    def _split(self, starts):
+        map = self.map
+        cells, offsets, labels = map.cells, map.offsets, self.labels
+        k = len(starts)
+        group = list(range(k))  # union-find over the searches that met
+
+        def root(a):
+            while group[a] != a:
+                a = group[a]
+            return a
+
+        owner = {}
+        frontiers = []
+        visited = []
+        for a, start in enumerate(starts):
+            owner[start] = a
+            frontiers.append(deque([start]))
+            visited.append([start])
+        done = set()
+        while True:
+            for a in range(k):
+                frontier = frontiers[a]
+                if not frontier or root(a) in done:
+                    continue
+                current = frontier.popleft()
+                for offset in offsets:
+                    neighbor = current + offset
+                    if cells[neighbor]:
+                        continue
+                    other = owner.get(neighbor)
+                    if other is None:
+                        owner[neighbor] = a
+                        visited[a].append(neighbor)
+                        frontier.append(neighbor)
+                    elif root(other) != root(a):
+                        group[root(other)] = root(a)
+            # A group whose searches all ran out of cells is a piece of its own,
+            # the last group left keeps the old label
+            active = sorted({root(a) for a in range(k)} - done)
+            remaining = len(active)
+            for r in active:
+                if remaining <= 1:
+                    return
+                members = [a for a in range(k) if root(a) == r]
+                if all(not frontiers[a] for a in members):
+                    label = self._new_label()
+                    for a in members:
+                        for cell in visited[a]:
+                            labels[cell] = label
+                    done.add(r)
+                    remaining -= 1
+            if remaining <= 1:
+                return
+
+_create_lock = threading.Lock()
+
+# Component index of the map, built on first use and kept up to date through
+# the map listeners
+def components_for(map):
+    index = getattr(map, '_components', None)
+    if index is None:
+        with _create_lock:
+            index = getattr(map, '_components', None)
+            if index is None:
+                index = map._components = ComponentIndex(map)
+    return index
@@ -0,0 +1,264 @@
+import itertools
+import os
+import queue
+import threading
+from array import array
+from collections import OrderedDict, deque
+import search
+
+# Breadth-first distance field of every shelf: the walking distance from each
+# cell of the map to the nearest access cell of the shelf (its free neighbors,
+# the cells from which Map.is_near_shelf is true). With the field, the route
+# from any cell to the shelf is a greedy descent, no search needed.
+#
+# Fields are built the first time a shelf is asked for and stored as uint16 per
+# cell; the least recently used ones are dropped beyond max_bytes. After a map
+# edit the fields it can affect are marked stale and rebuilt by a background
+# thread; until then the queries fall back to A*. So do the queries for cells
+# farther than UNREACHABLE - 1 steps, where the field stops.
+
+UNREACHABLE = 0xFFFF
+DEFAULT_MAX_BYTES = int(os.environ.get('DISTANCE_FIELDS_MB', 64)) * 1024 * 1024
+
+class ShelfField:
+    __slots__ = ('shelf', 'values', 'stale', 'dirty', 'capped')
+
+    def __init__(self, shelf):
+        self.shelf = shelf
+        self.values = None
+        self.stale = True
+        self.dirty = 0  # bumped on every edit that invalidates the field
+        self.capped = False  # some cells were too far for uint16
+
+class DistanceFields:
+    def __init__(self, map, max_bytes=DEFAULT_MAX_BYTES):
+        self.map = map
+        # At least one field, whatever the size of the map
+        self.max_fields = max(1, max_bytes // (len(map.cells) * array('H').itemsize))
+        self._fields = OrderedDict()  # shelf id -> ShelfField, least recently used first
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._worker = None
+        self.stats = {'builds': 0, 'rebuilds': 0, 'evictions': 0, 'descents': 0, 'fallbacks': 0}
+        map.listeners.append(self.cell_changed)
+
+    def _access_cells(self, shelf):
+        cells = self.map.cells
+        return [shelf + offset for offset in self.map.offsets if not cells[shelf + offset]]
+
+    def _compute(self, shelf):
+        map = self.map
+        cells, offsets = map.cells, map.offsets
+        values = array('H', [UNREACHABLE]) * len(cells)
+        frontier = deque(self._access_cells(shelf))
+        for cell in frontier:
+            values[cell] = 0
+        while frontier:
+            current = frontier.popleft()
+            d = values[current] + 1
+            if d >= UNREACHABLE:
+                return values, True
+            for offset in offsets:
+                neighbor = current + offset
+                if not cells[neighbor] and values[neighbor] == UNREACHABLE:
+                    values[neighbor] = d
+                    frontier.append(neighbor)
+        return values, False
+
+    def _build(self, field):
+        dirty = field.dirty
+        values, capped = self._compute(field.shelf)
+        with self._lock:
+            if field.dirty != dirty:
+                return False  # edited while building, the worker will try again
+            field.values = values
+            field.capped = capped
+            field.stale = False
+        return True
+
+    def field(self, shelf_id):
+        with self._lock:
+            field = self._fields.get(shelf_id)
+            if field is None:
+                field = self._fields[shelf_id] = ShelfField(shelf_id)
+                while len(self._fields) > self.max_fields:
+                    self._fields.popitem(last=False)
+                    self.stats['evictions'] += 1
+                build = True
+            else:
+                self._fields.move_to_end(shelf_id)
+                build = False
+        if build:
+            self.stats['builds'] += 1
+            if not self._build(field):
+                self._schedule(field)
+        return field
+
+    def cell_changed(self, i):
+        map = self.map
+        cells = map.cells
+        blocked = cells[i] != 0
+        stale = []
+        with self._lock:
+            for shelf, field in list(self._fields.items()):
+                if i == shelf:
+                    del self._fields[shelf]  # the shelf was removed
+                    continue
+                values = field.values
+                if field.stale or values is None:
+                    field.dirty += 1
+                    continue
+                if abs(i - shelf) in (1, map.stride):
+                    affected = True  # the access cells changed
+                elif blocked:
+                    affected = values[i] != UNREACHABLE
+                else:
+                    affected = any(values[i + offset] != UNREACHABLE for offset in map.offsets)
+                if affected:
+                    field.stale = True
+                    field.dirty += 1
+                    stale.append(field)
+        for field in stale:
+            self._schedule(field)
+
+    def _schedule(self, field):
+        self._queue.put(field)
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name='distance-fields', daemon=True)
+            self._worker.start()
+
+    def _run(self):
+        while True:
+            field = self._queue.get()
+            if field is None:
+                self._queue.task_done()
+                return  # closed
+            if field.stale and self._fields.get(field.shelf) is field:
+                self.stats['rebuilds'] += 1
+                if not self._build(field):
+                    self._queue.put(field)
+            self._queue.task_done()
+
+    # Stop the rebuild thread and drop the fields
+    def close(self):
+        if self._worker is not None and self._worker.is_alive():
+            self._queue.put(None)
+        with self._lock:
+            self._fields.clear()
+        if self.cell_changed in self.map.listeners:
+            self.map.listeners.remove(self.cell_changed)
+
+    # Wait until every scheduled rebuild is done
+    def wait(self):
+        self._queue.join()
+
+    def distance(self, start, shelf):
+        map = self.map
+        start_id = map.cell_id_or_none(*start)
+        shelf_id = map.cell_id_or_none(*shelf)
+        if start_id is None or shelf not in map.shelves or map.cells[start_id]:
+            return None
+        field = self.field(shelf_id)
+        if field.stale:
+            path = self._fallback(start, shelf_id)
+            return None if path is None else len(path) - 1
+        d = field.values[start_id]
+        if d == UNREACHABLE:
+            if field.capped:
+                path = self._fallback(start, shelf_id)
+                return None if path is None else len(path) - 1
+            return None
+        return d
+
+    # Path from start to the nearest access cell of the shelf at (x, y)
+    def path_to_shelf(self, start, shelf):
+        map = self.map
+        start_id = map.cell_id_or_none(*start)
+        shelf_id = map.cell_id_or_none(*shelf)
+        if start_id is None or shelf not in map.shelves or map.cells[start_id]:
+            return None
+        field = self.field(shelf_id)
+        if field.stale:
+            return self._fallback(start, shelf_id)
+        values = field.values
+        d = values[start_id]
+        if d == UNREACHABLE:
+            return self._fallback(start, shelf_id) if field.capped else None
+        self.stats['descents'] += 1
+        offsets = map.offsets
+        path = [start_id]
+        current = start_id
+        while d > 0:
+            d -= 1
+            for offset in offsets:
+                if values[current + offset] == d:
+                    current += offset
+                    break
+            else:
+                return self._fallback(start, shelf_id)  # the field changed under us
+            path.append(current)
+        cell_xy = map.cell_xy
+        return [cell_xy(i) for i in path]
+
+    def _fallback(self, start, shelf_id):
+        self.stats['fallbacks'] += 1
+        best = None
+        for access in self._access_cells(shelf_id):
+            path = search.find_path(self.map, start, self.map.cell_xy(access))
+            if path is not None and (best is None or len(path) < len(best)):
+                best = path
+        return best
+
+# The shelves (of the given (x, y) cells) in order of walking distance from
+# start, as (distance, shelf, path to its access cell), nearest first. One
+# breadth-first search from start that only goes as far as the shelves taken
+# from it, instead of a search or a field per shelf.
+def iter_nearest_shelves(map, start, shelves):
+    start_id = map.cell_id_or_none(*start)
+    if start_id is None or map.cells[start_id]:
+        return
+    targets = {}
+    for shelf in shelves:
+        shelf_id = map.cell_id_or_none(*shelf)
+        if shelf_id is not None:
+            targets[shelf_id] = shelf
+    cells, offsets, cell_xy = map.cells, map.offsets, map.cell_xy
+    parent = {start_id: None}
+    distance = {start_id: 0}
+    frontier = deque([start_id])
+    while frontier and targets:
+        current = frontier.popleft()
+        for offset in offsets:
+            shelf = targets.pop(current + offset, None)
+            if shelf is None:
+                continue
+            path = []
+            cell = current
+            while cell is not None:
+                path.append(cell_xy(cell))
+                cell = parent[cell]
+            path.reverse()
+            yield distance[current], shelf, path
+        d = distance[current] + 1
+        for offset in offsets:
+            neighbor = current + offset
+            if not cells[neighbor] and neighbor not in parent:
+                parent[neighbor] = current
+                distance[neighbor] = d
+                frontier.append(neighbor)
+
+# The k nearest of the given shelves, see iter_nearest_shelves
+def nearest_shelves(map, start, shelves, k=1):
+    return list(itertools.islice(iter_nearest_shelves(map, start, shelves), max(k, 0)))
+
+_create_lock = threading.Lock()
+
+# Distance fields of the map, created on first use
+def fields_for(map):
+    fields = getattr(map, '_distance_fields', None)
+    if fields is None:
+        with _create_lock:
+            fields = getattr(map, '_distance_fields', None)
+            if fields is None:
+                fields = map._distance_fields = DistanceFields(map)
+    return fields
@@ -0,0 +1,261 @@
+import heapq
+import threading
+from collections import deque
+
+# Hierarchical pathfinding (HPA*) on top of a Map grid. The map is split in
+# square clusters, the free cell pairs across each cluster border give the
+# entrance nodes and the in-cluster distances between entrances are the edges
+# of an abstract graph. A query searches the abstract graph and then refines
+# every abstract edge with a search bounded to one cluster.
+#
+# Clusters are built lazily the first time a query touches them, so the cost of
+# a query depends on the clusters between start and goal rather than on the
+# size of the map. Editing a cell only drops the cluster holding it, plus the
+# neighbor cluster when the cell lies on their shared border.
+
+CLUSTER_SIZE = 32
+# Runs of free border cells at least this long get an entrance at each end,
+# shorter runs one in the middle
+ENTRANCE_SPLIT = 6
+
+class Cluster:
+    __slots__ = ('key', 'x0', 'x1', 'y0', 'y1', 'partners', 'edges')
+
+    def __init__(self, key, x0, x1, y0, y1):
+        self.key = key
+        self.x0, self.x1, self.y0, self.y1 = x0, x1, y0, y1
+        self.partners = {}  # entrance node -> nodes across the border
+        self.edges = {}  # entrance node -> [(node, distance)] inside the cluster
+
+class HierarchicalMap:
+    def __init__(self, map, cluster_size=CLUSTER_SIZE):
+        self.map = map
+        self.cluster_size = cluster_size
+        self._clusters = {}
+        self._borders = {}  # (cluster key, neighbor key) -> [(cell, cell)]
+        self._lock = threading.RLock()
+        # Counters of the last query
+        self.expanded = 0
+        self.clusters_built = 0
+        map.listeners.append(self.cell_changed)
+
+    def cluster_key(self, i):
+        x, y = divmod(i, self.map.stride)
+        return ((x - 1) // self.cluster_size, (y - 1) // self.cluster_size)
+
+    def cell_changed(self, i):
+        x, y = divmod(i, self.map.stride)
+        x, y = x - 1, y - 1
+        size = self.cluster_size
+        cx, cy = x // size, y // size
+        with self._lock:
+            self._clusters.pop((cx, cy), None)
+            if x % size == 0 and cx > 0:
+                self._drop_border((cx - 1, cy), (cx, cy))
+            if x % size == size - 1:
+                self._drop_border((cx, cy), (cx + 1, cy))
+            if y % size == 0 and cy > 0:
+                self._drop_border((cx, cy - 1), (cx, cy))
+            if y % size == size - 1:
+                self._drop_border((cx, cy), (cx, cy + 1))
+
+    def _drop_border(self, a, b):
+        self._borders.pop((a, b), None)
+        self._clusters.pop(a, None)
+        self._clusters.pop(b, None)
+
+    def invalidate(self):
+        with self._lock:
+            self._clusters.clear()
+            self._borders.clear()
+
+    # Free cell pairs chosen as transitions across the border between cluster
+    # a and cluster b, b being the next cluster along x or along y
+    def _border(self, a, b):
+        transitions = self._borders.get((a, b))
+        if transitions is not None:
+            return transitions
+        map = self.map
+        cells, stride, size = map.cells, map.stride, self.cluster_size
+        if b[0] != a[0]:
+            x = b[0] * size - 1
+            first = (x + 1) * stride + a[1] * size + 1
+            step, across = 1, stride
+            length = min(size, map.height - a[1] * size)
+        else:
+            y = b[1] * size - 1
+            first = (a[0] * size + 1) * stride + y + 1
+            step, across = stride, 1
+            length = min(size, map.width - a[0] * size)
+        transitions = []
+        run = []
+        for k in range(length + 1):
+            i = first + k * step
+            if k < length and not cells[i] and not cells[i + across]:
+                run.append(i)
+                continue
+            if run:
+                if len(run) >= ENTRANCE_SPLIT:
+                    picks = (run[0], run[-1])
+                else:
+                    picks = (run[len(run) // 2],)
+                transitions.extend((i, i + across) for i in picks)
+                run = []
+        self._borders[(a, b)] = transitions
+        return transitions
+
+    def _cluster(self, key):
+        cluster = self._clusters.get(key)
+        if cluster is not None:
+            return cluster
+        map, size = self.map, self.cluster_size
+        cx, cy = key
+        cluster = Cluster(key, cx * size, min((cx + 1) * size, map.width),
+                          cy * size, min((cy + 1) * size, map.height))
+        partners = cluster.partners
+        neighbors = []
+        if cx > 0:
+            neighbors.append(((cx - 1, cy), key, 1))
+        if cluster.x1 < map.width:
+            neighbors.append((key, (cx + 1, cy), 0))
+        if cy > 0:
+            neighbors.append(((cx, cy - 1), key, 1))
+        if cluster.y1 < map.height:
+            neighbors.append((key, (cx, cy + 1), 0))
+        for a, b, side in neighbors:
+            for pair in self._border(a, b):
+                node, partner = pair[side], pair[1 - side]
+                partners.setdefault(node, []).append(partner)
+        for node in partners:
+            dist, _ = self._search_cluster(cluster, node)
+            cluster.edges[node] = [(other, dist[other]) for other in partners
+                                   if other != node and other in dist]
+        self._clusters[key] = cluster
+        self.clusters_built += 1
+        return cluster
+
+    # Breadth-first search from source that never leaves the cluster. Returns
+    # the distance and parent of every cell reached, stops early at goal.
+    def _search_cluster(self, cluster, source, goal=None):
+        cells, stride = self.map.cells, self.map.stride
+        x0, x1, y0, y1 = cluster.x0 + 1, cluster.x1 + 1, cluster.y0 + 1, cluster.y1 + 1
+        dist = {source: 0}
+        parent = {source: None}
+        queue = deque([source])
+        while queue:
+            current = queue.popleft()
+            if current == goal:
+                break
+            x, y = divmod(current, stride)
+            d = dist[current] + 1
+            for neighbor, inside in ((current + 1, y + 1 < y1), (current + stride, x + 1 < x1),
+                                     (current - 1, y > y0), (current - stride, x > x0)):
+                if inside and not cells[neighbor] and neighbor not in dist:
+                    dist[neighbor] = d
+                    parent[neighbor] = current
+                    queue.append(neighbor)
+        return dist, parent
+
+    # Near-optimal path between two (x, y) cells, or None
+    def find_path(self, start, goal):
+        map = self.map
+        start_id = map.cell_id_or_none(*start)
+        goal_id = map.cell_id_or_none(*goal)
+        if start_id is None or goal_id is None:
+            return None
+        if start_id == goal_id:
+            return [start]
+        if map.cells[goal_id]:
+            return None  # a blocked goal is never entered
+        with self._lock:
+            path = self._find_path(start_id, goal_id)
+        if path is None:
+            return None
+        cell_xy = map.cell_xy
+        return [cell_xy(i) for i in path]
+
+    def _find_path(self, start, goal):
+        stride = self.map.stride
+        start_cluster = self._cluster(self.cluster_key(start))
+        goal_cluster = self._cluster(self.cluster_key(goal))
+        start_dist, _ = self._search_cluster(start_cluster, start)
+        goal_dist, _ = self._search_cluster(goal_cluster, goal)
+        start_edges = [(node, start_dist[node]) for node in start_cluster.partners
+                       if node in start_dist and node != start]
+        if goal in start_dist:
+            start_edges.append((goal, start_dist[goal]))
+        goal_x, goal_y = divmod(goal, stride)
+
+        g = {start: 0}
+        parent = {start: None}
+        closed = set()
+        heap = [(0, 0, start)]  # (f, h, node), ties go to the node closest to the goal
+        expanded = 0
+        while heap:
+            _, _, current = heapq.heappop(heap)
+            if current == goal:
+                break
+            if current in closed:
+                continue
+            closed.add(current)
+            expanded += 1
+            cluster = self._cluster(self.cluster_key(current))
+            edges = list(cluster.edges.get(current, ()))
+            edges.extend((partner, 1) for partner in cluster.partners.get(current, ()))
+            if current == start:
+                edges.extend(start_edges)
+            if cluster is goal_cluster and current in goal_dist:
+                edges.append((goal, goal_dist[current]))
+            base = g[current]
+            for node, cost in edges:
+                new_cost = base + cost
+                if node not in closed and (node not in g or new_cost < g[node]):
+                    g[node] = new_cost
+                    parent[node] = current
+                    x, y = divmod(node, stride)
+                    h = abs(goal_x - x) + abs(goal_y - y)
+                    heapq.heappush(heap, (new_cost + h, h, node))
+        self.expanded = expanded
+        if goal not in parent:
+            return None
+
+        abstract = []
+        node = goal
+        while node is not None:
+            abstract.append(node)
+            node = parent[node]
+        abstract.reverse()
+        return self._refine(abstract)
+
+    # Turn the abstract path into a cell by cell path
+    def _refine(self, abstract):
+        path = [abstract[0]]
+        for a, b in zip(abstract, abstract[1:]):
+            key = self.cluster_key(a)
+            if key != self.cluster_key(b):
+                path.append(b)  # transition across a border
+                continue
+            _, parent = self._search_cluster(self._cluster(key), a, b)
+            segment = []
+            node = b
+            while node != a:
+                segment.append(node)
+                node = parent[node]
+            segment.reverse()
+            path.extend(segment)
+        return path
+
+_create_lock = threading.Lock()
+
+# Hierarchy of the map, created on first use and kept up to date through the
+# map listeners
+def hierarchy_for(map, cluster_size=CLUSTER_SIZE):
+    hierarchy = getattr(map, '_hierarchy', None)
+    if hierarchy is None or hierarchy.cluster_size != cluster_size:
+        with _create_lock:
+            hierarchy = getattr(map, '_hierarchy', None)
+            if hierarchy is None or hierarchy.cluster_size != cluster_size:
+                if hierarchy is not None:
+                    map.listeners.remove(hierarchy.cell_changed)
+                hierarchy = map._hierarchy = HierarchicalMap(map, cluster_size)
+    return hierarchy
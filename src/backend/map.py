@@ -1,206 +1,730 @@
-import random
-import heapq
-import psycopg2
-import server
-
-class Map:
-    def __init__(self, width, height):
-        self.width = width
-        self.height = height
-        self.obstacles = set()
-        self.shelves = {}  # Add a dictionary to store shelves
-        self.start = None
-        self.goal = None
-        self.id = 0
-
-    def assign_id(self):
-        server.create_map(self.width,self.height,'warehouse_0')
-
-    def add_obstacle(self, x, y):
-        if (x, y) in self.shelves:
-            self.remove_shelf(x, y)
-            server.remove_shelf(self.id, x, y) 
-        self.obstacles.add((x, y))
-        server.add_obstacle(self.id, x, y)
-
-    def remove_obstacle(self, x, y):
-        if (x, y) in self.obstacles:
-            self.obstacles.remove((x, y))
-            server.remove_obstacle(self.id, x, y) 
-
-    def add_shelf(self, x, y, flower, color, quantity):  # Modified to include quantity
-        self.obstacles.add((x, y))  # Shelf acts as an obstacle
-        self.shelves[(x, y)] = {'flower': flower, 'color': color, 'quantity': quantity}
-        server.add_shelf(self.id, x, y, flower, color, quantity)
-
-    def remove_shelf(self, x, y):
-        if (x, y) in self.shelves:
-            del self.shelves[(x, y)]
-            self.obstacles.remove((x, y)) # Also remove it as an obstacle
-            server.remove_shelf(self.id, x, y)
-
-    def get_shelf(self, x, y):
-        nx, ny = x, y
-        if (nx, ny) in self.shelves:
-            return self.shelves[(nx, ny)]
-        else:
-            return None
-    
-    def set_start(self, x, y):
-        self.start = (x, y)
-
-    def reset_start(self):
-        self.start = None
-
-    def set_goal(self, x, y):
-        self.goal = (x, y)
-
-    def reset_goal(self):
-        self.goal = None
-
-    def is_valid(self, x, y):
-        return 0 <= x < self.width and 0 <= y < self.height and (x, y) not in self.obstacles
-
-    def neighbors(self, x, y):
-        result = []
-        for dx, dy in [(0, 1), (1, 0), (0, -1), (-1, 0)]:
-            nx, ny = x + dx, y + dy
-            if self.is_valid(nx, ny):
-                result.append((nx, ny))
-        return result
-
-    def is_near_shelf(self, x, y):  # New function to check proximity to a shelf
-        for dx, dy in [(0, 1), (1, 0), (0, -1), (-1, 0)]:
-            nx, ny = x + dx, y + dy
-            if (nx, ny) in self.shelves:
-                return True
-        return False
-
-    def interact_with_shelf(self, x, y):  # Modified to work in neighborhood
-        for dx, dy in [(0, 1), (1, 0), (0, -1), (-1, 0)]:
-            nx, ny = x + dx, y + dy
-            if (nx, ny) in self.shelves:
-                shelf_info = self.shelves[(nx, ny)]
-                return f"You are near shelf '{shelf_info['label']}'. It contains: {shelf_info['quantity']} of {shelf_info['flower']}"
-        return "There is no shelf nearby."
-
-    def take_flower(self, x, y, n):  # New function to take flowers from a shelf
-        nx, ny = x, y
-        if (nx, ny) in self.shelves:
-            shelf = self.shelves[(nx, ny)]
-            if shelf['quantity'] >= n:
-                shelf['quantity'] -= n
-                return f"You took {n} of {shelf['flower']} from shelf '{shelf['label']}'."
-            else:
-                return f"Not enough {shelf['flower']} on shelf '{shelf['label']}'."
-        return "No shelf found at this location."
-
-    # Function to query the database and retrieve the Map, Obstacles, and Shelves
-def get_map_data(label):
-    conn_params = server.load_db_credentials('db_credentials.txt')
-    try:
-        conn = psycopg2.connect(**conn_params)
-        cur = conn.cursor()
-
-        # Check if the map exists
-        cur.execute("SELECT map_id, width, height FROM maps WHERE label = %s", (label,))
-        map_data = cur.fetchone()
-        if map_data:
-            map_id, width, height = map_data
-            print(f"Map found: ID={map_id}, Width={width}, Height={height}, Label={label}")
-
-            # Create a Map instance
-            map_instance = Map(width, height)
-            map_instance.id = map_id
-
-            # Get obstacles
-            cur.execute("SELECT x, y FROM obstacles WHERE map_id = %s", (map_id,))
-            obstacles = cur.fetchall()
-            for x, y in obstacles:
-                map_instance.add_obstacle(x, y)
-
-            # Get shelves
-            cur.execute("SELECT x, y, flower, color, quantity FROM shelves WHERE map_id = %s", (map_id,))
-            shelves = cur.fetchall()
-            for x, y, flower, color, quantity in shelves:
-                map_instance.add_shelf(x, y, flower, color, quantity)
-
-            return map_instance
-        else:
-            print(f"No map found with label '{label}'")
-            return None
-
-    except Exception as e:
-        print(f"An error occurred: {e}")
-    finally:
-        cur.close()
-        conn.close()
-
-def reconstruct_path(came_from, current):
-    total_path = [current]
-    while current in came_from:
-        current = came_from[current]
-        total_path.insert(0, current)
-    return total_path
-
-def heuristic(a, b):
-    return abs(a[0] - b[0]) + abs(a[1] - b[1])
-
-def astar(map):
-    open_set = []
-    heapq.heappush(open_set, (0, map.start))
-    came_from = {}
-    cost_so_far = {map.start: 0}
-
-    while open_set:
-        _, current = heapq.heappop(open_set)
-
-        if current == map.goal:
-            return reconstruct_path(came_from, current)
-
-        for neighbor in map.neighbors(*current):
-            new_cost = cost_so_far[current] + 1  # Assuming cost of 1 to move to neighbor
-            if neighbor not in cost_so_far or new_cost < cost_so_far[neighbor]:
-                cost_so_far[neighbor] = new_cost
-                priority = new_cost + heuristic(map.goal, neighbor)
-                heapq.heappush(open_set, (priority, neighbor))
-                came_from[neighbor] = current
-
-    return None  # No path found
-
-def astar_multitarget(map, targets):
-    # Handle the case where targets is None or empty
-    if targets is None or len(targets) == 0:
-        map.set_start(*map.start)  # Ensure start and goal are set correctly
-        map.set_goal(*map.goal)
-        return astar(map)
-
-    # Calculate pairwise distances
-    locations = [map.start] + targets + [map.goal]
-    distances = [[heuristic(a, b) for b in locations] for a in locations]
-
-    # Find optimal target order (replace with a more efficient algorithm if needed)
-    optimal_order = [0]  # Start with the start position
-    remaining_targets = list(range(1, len(locations) - 1))
-    while remaining_targets:
-        current = optimal_order[-1]
-        next_target = min(remaining_targets, key=lambda i: distances[current][i])
-        optimal_order.append(next_target)
-        remaining_targets.remove(next_target)
-    optimal_order.append(len(locations) - 1)  # End with the goal position
-
-    # Perform A* search between consecutive locations
-    total_path = []
-    for i in range(len(optimal_order) - 1):
-        start_idx = optimal_order[i]
-        goal_idx = optimal_order[i + 1]
-        map.set_start(*locations[start_idx])
-        map.set_goal(*locations[goal_idx])
-        path = astar(map)
-        if path:
-            total_path.extend(path[:-1])  # Avoid duplicate nodes
-        else:
-            return None  # No path found
-
-    total_path.append(locations[-1])  # Add the goal position
-    return total_path
\ No newline at end of file
+import random
+import itertools
+import logging
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from collections.abc import MutableMapping, MutableSet
+import batch
+import metrics
+import persistence
+import route
+import search
+import server
+
+log = logging.getLogger(__name__)
+
+# Rows fetched per round-trip by the server-side cursor used to load a map
+HYDRATION_BATCH = 10000
+# Walkability changes remembered by a map, see Map.edits_since
+EDIT_LOG_SIZE = 4096
+# Cell changes remembered for the clients' delta sync, see Map.changes_since
+CHANGE_LOG_SIZE = 10000
+
+_map_uids = itertools.count(1)
+
+# Cell flags stored in Map.cells, one byte per cell
+FREE = 0
+OBSTACLE = 1
+SHELF = 2  # a shelf is also an obstacle
+WALL = 3  # border padding around the map, never part of the warehouse
+
+_BLOCKED_PATTERN = re.compile(b'[\x01\x02]')
+_SHELF_PATTERN = re.compile(b'\x02')
+
+# Readers-writer lock guarding a Map: planners hold it for reading, mutations
+# for writing. Writers go first once they wait, a writer may take it again or
+# read under its own write lock, and reads nest.
+class RWLock:
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = None
+        self._writer_depth = 0
+        self._writers_waiting = 0
+        self._local = threading.local()
+
+    @contextmanager
+    def reading(self):
+        local = self._local
+        depth = getattr(local, 'depth', 0)
+        if depth or self._writer == threading.get_ident():
+            local.depth = depth + 1
+            try:
+                yield
+            finally:
+                local.depth = depth
+            return
+        with self._cond:
+            while self._writer is not None or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        local.depth = 1
+        try:
+            yield
+        finally:
+            local.depth = 0
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def writing(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._writer_depth += 1
+            else:
+                self._writers_waiting += 1
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+                self._writers_waiting -= 1
+                self._writer = me
+                self._writer_depth = 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer_depth -= 1
+                if not self._writer_depth:
+                    self._writer = None
+                    self._cond.notify_all()
+
+# Set-like view of the blocked cells (obstacles and shelves) of a Map grid
+class ObstacleView(MutableSet):
+    def __init__(self, map):
+        self._map = map
+
+    def __contains__(self, cell):
+        i = self._map.cell_id_or_none(*cell)
+        return i is not None and self._map.cells[i] in (OBSTACLE, SHELF)
+
+    def __iter__(self):
+        cell_xy = self._map.cell_xy
+        for match in _BLOCKED_PATTERN.finditer(self._map.cells):
+            yield cell_xy(match.start())
+
+    def __len__(self):
+        return self._map.blocked_count
+
+    def add(self, cell):
+        map = self._map
+        i = map.cell_id_or_none(*cell)
+        if i is None:
+            raise ValueError(f"cell {cell} is outside the map")
+        with map.lock.writing():
+            if map.cells[i] == FREE:
+                map.cells[i] = OBSTACLE
+                map.blocked_count += 1
+                map._walkability_changed(i)
+
+    def discard(self, cell):
+        map = self._map
+        i = map.cell_id_or_none(*cell)
+        with map.lock.writing():
+            if i is not None and map.cells[i] in (OBSTACLE, SHELF):
+                map.cells[i] = FREE
+                map.blocked_count -= 1
+                info = map._shelf_info.pop(cell, None)  # no shelf without its obstacle
+                if info is not None:
+                    map._stock.discard(cell, info)
+                map._walkability_changed(i)
+
+    def clear(self):
+        map = self._map
+        with map.lock.writing():
+            for cell in list(self):
+                i = map.cell_id(*cell)
+                map.cells[i] = FREE
+                map._walkability_changed(i)
+            map.blocked_count = 0
+            map._shelf_info.clear()
+            map._stock.clear()
+
+    def __repr__(self):
+        return f"ObstacleView({set(self)!r})"
+
+# Dict-like view of the shelves of a Map grid: the shelf details are kept in a
+# dict, the grid flag marks the cell as a shelf
+class ShelfView(MutableMapping):
+    def __init__(self, map):
+        self._map = map
+
+    def __getitem__(self, cell):
+        return self._map._shelf_info[cell]
+
+    def __setitem__(self, cell, info):
+        map = self._map
+        i = map.cell_id_or_none(*cell)
+        if i is None:
+            raise ValueError(f"cell {cell} is outside the map")
+        with map.lock.writing():
+            was_free = map.cells[i] == FREE
+            map.cells[i] = SHELF
+            old = map._shelf_info.get(cell)
+            if old is not None:
+                map._stock.discard(cell, old)
+            map._shelf_info[cell] = info
+            map._stock.add(cell, info)
+            if was_free:
+                map.blocked_count += 1
+                map._walkability_changed(i)
+
+    def __delitem__(self, cell):
+        map = self._map
+        with map.lock.writing():
+            map._stock.discard(cell, map._shelf_info.pop(cell))
+            map.cells[map.cell_id(*cell)] = OBSTACLE  # the obstacle stays until removed
+
+    def __contains__(self, cell):
+        return cell in self._map._shelf_info
+
+    def __iter__(self):
+        return iter(self._map._shelf_info)
+
+    def __len__(self):
+        return len(self._map._shelf_info)
+
+    def __repr__(self):
+        return f"ShelfView({self._map._shelf_info!r})"
+
+
+# Secondary indexes of the shelves by flower, by color and by (flower, color).
+# Only the cells are indexed; quantities are read from the shelf details when
+# looking up, so taking flowers needs no index update.
+class StockIndex:
+    def __init__(self):
+        self.by_flower = {}
+        self.by_color = {}
+        self.by_product = {}
+
+    def add(self, cell, info):
+        for index, key in self._keys(info):
+            index.setdefault(key, set()).add(cell)
+
+    def discard(self, cell, info):
+        for index, key in self._keys(info):
+            cells = index.get(key)
+            if cells is not None:
+                cells.discard(cell)
+                if not cells:
+                    del index[key]
+
+    def clear(self):
+        self.by_flower.clear()
+        self.by_color.clear()
+        self.by_product.clear()
+
+    def _keys(self, info):
+        flower, color = info['flower'], info['color']
+        return ((self.by_flower, flower), (self.by_color, color), (self.by_product, (flower, color)))
+
+    # Cells of the shelves matching the flower and/or color (any when None)
+    def cells(self, flower=None, color=None):
+        if flower is not None and color is not None:
+            return self.by_product.get((flower, color), ())
+        if flower is not None:
+            return self.by_flower.get(flower, ())
+        if color is not None:
+            return self.by_color.get(color, ())
+        return None
+
+class Map:
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        # Occupancy grid: one flag per cell, padded with a WALL border so that
+        # neighbor lookups never need a bounds check. Cell (x, y) has the flat
+        # id (x + 1) * stride + (y + 1).
+        self.stride = height + 2
+        self.cells = bytearray((width + 2) * self.stride)
+        for x in (-1, width):
+            row = (x + 1) * self.stride
+            self.cells[row:row + self.stride] = bytes([WALL]) * self.stride
+        for x in range(width):
+            self.cells[(x + 1) * self.stride] = WALL
+            self.cells[(x + 1) * self.stride + height + 1] = WALL
+        # Flat id offsets of the 4 neighbors, in the order of neighbors()
+        self.offsets = (1, self.stride, -1, -self.stride)
+        self.blocked_count = 0
+        self._shelf_info = {}
+        self._stock = StockIndex()
+        self._obstacle_view = ObstacleView(self)
+        self._shelf_view = ShelfView(self)
+        # Callables notified with the flat cell id whenever a cell turns from
+        # free to blocked or back
+        self.listeners = []
+        # Held for reading by planners and for writing by every mutation
+        self.lock = RWLock()
+        # Serializes take_flowers, see there
+        self._take_lock = threading.Lock()
+        # Bumped on every mutation. edits logs (version, cell id, blocked) for
+        # the last walkability changes, all the edits after edits_floor are in it.
+        self.version = 0
+        self.edits = deque()
+        self.edits_floor = 0
+        # (version, (x, y), stored state) of every cell changed through the Map
+        # methods, all the changes after changes_floor are in it
+        self.changes = deque()
+        self.changes_floor = 0
+        self.uid = next(_map_uids)  # tells apart Map objects sharing a map id
+        self.start = None
+        self.goal = None
+        self.id = 0
+        self.label = None
+        # Database revision the map content was loaded at (see
+        # server.map_revision), None when unknown
+        self.revision = None
+        self.load_time = None
+
+    # Build a map straight from stored rows without writing anything back.
+    # rows: (x, y, flower, color, quantity), flower/color/quantity are None for
+    # plain obstacles
+    @classmethod
+    def from_rows(cls, width, height, map_id, rows):
+        map_instance = cls(width, height)
+        map_instance.id = map_id
+        cells = map_instance.cells
+        shelf_info = map_instance._shelf_info
+        stock = map_instance._stock
+        cell_id_or_none = map_instance.cell_id_or_none
+        for x, y, flower, color, quantity in rows:
+            i = cell_id_or_none(x, y)
+            if i is None:
+                continue
+            if quantity is not None:
+                cells[i] = SHELF
+                info = shelf_info[(x, y)] = {'flower': flower, 'color': color, 'quantity': quantity}
+                stock.add((x, y), info)
+            else:
+                cells[i] = OBSTACLE
+        map_instance.blocked_count = len(_BLOCKED_PATTERN.findall(cells))
+        return map_instance
+
+    # Load the map with the given label (or map_id) from the storage backend in
+    # one read (a single joined query streamed through a server-side cursor on
+    # PostgreSQL). Returns None if there is no such map.
+    @classmethod
+    @metrics.db_call
+    def load(cls, label=None, batch_size=HYDRATION_BATCH, map_id=None):
+        began = time.perf_counter()
+        with server.map_rows(label, map_id, batch_size) as found:
+            if found is None:
+                return None
+            map_id, width, height, label, revision, rows = found
+            map_instance = cls.from_rows(width, height, map_id, rows)
+            map_instance.label = label
+            map_instance.revision = revision
+        map_instance.load_time = time.perf_counter() - began
+        log.info("Map found: ID=%s, Width=%s, Height=%s, Label=%s, %s obstacles and %s shelves loaded in %.3fs",
+                 map_id, width, height, label, len(map_instance.obstacles), len(map_instance.shelves),
+                 map_instance.load_time)
+        return map_instance
+
+    @property
+    def obstacles(self):
+        return self._obstacle_view
+
+    @obstacles.setter
+    def obstacles(self, cells):
+        if cells is self._obstacle_view:
+            return  # in-place update such as map.obstacles |= cells
+        cells = list(cells)
+        self._obstacle_view.clear()
+        for cell in cells:
+            self._obstacle_view.add(cell)
+
+    @property
+    def shelves(self):
+        return self._shelf_view
+
+    @shelves.setter
+    def shelves(self, shelves):
+        if shelves is self._shelf_view:
+            return
+        shelves = dict(shelves)
+        for cell in list(self._shelf_info):
+            del self._shelf_view[cell]
+        for cell, info in shelves.items():
+            self._shelf_view[cell] = info
+
+    def _walkability_changed(self, i):
+        self.version += 1
+        if len(self.edits) >= EDIT_LOG_SIZE:
+            self.edits_floor = self.edits.popleft()[0]
+        self.edits.append((self.version, i, self.cells[i] != FREE))
+        for listener in self.listeners:
+            listener(i)
+
+    def _bump_version(self):
+        self.version += 1
+
+    # Walkability changes made after the given version, oldest first, or None
+    # if some of them are no longer in the log
+    def edits_since(self, version):
+        if version < self.edits_floor:
+            return None
+        changes = []
+        for edit in reversed(self.edits):
+            if edit[0] <= version:
+                break
+            changes.append(edit)
+        changes.reverse()
+        return changes
+
+    def _log_changes(self, cells):
+        changes = self.changes
+        for cell in cells:
+            if len(changes) >= CHANGE_LOG_SIZE:
+                self.changes_floor = changes.popleft()[0]
+            changes.append((self.version, cell, self._cell_state(cell)))
+
+    # Latest state of every cell changed after the given version, as
+    # [((x, y), state)] in the order of their last change, or None if the log
+    # no longer goes back that far (the client has to reload everything)
+    def changes_since(self, version):
+        with self.lock.reading():
+            if version < self.changes_floor:
+                return None
+            seen = set()
+            latest = []
+            for changed_version, cell, state in reversed(self.changes):
+                if changed_version <= version:
+                    break
+                if cell not in seen:
+                    seen.add(cell)
+                    latest.append((cell, state))
+        latest.reverse()
+        return latest
+
+    # Current version and state of the given cells
+    def cell_states(self, cells):
+        with self.lock.reading():
+            return self.version, [(cell, self._cell_state(cell)) for cell in cells]
+
+    def cell_id(self, x, y):
+        return (x + 1) * self.stride + y + 1
+
+    def cell_id_or_none(self, x, y):
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return (x + 1) * self.stride + y + 1
+        return None
+
+    def cell_xy(self, i):
+        x, y = divmod(i, self.stride)
+        return (x - 1, y - 1)
+
+    # Store the map as a new map with the given label and take its map id
+    def assign_id(self, label='warehouse_0'):
+        map_id = server.create_map(self.width, self.height, label)
+        if map_id is None:
+            return False
+        self.id = map_id
+        self.label = label
+        self.revision = 0
+        return True
+
+    # Stop the background work of the map indexes once the map is dropped
+    def close(self):
+        fields = getattr(self, '_distance_fields', None)
+        if fields is not None:
+            fields.close()
+            self._distance_fields = None
+
+    # Rough bytes held by the map and its indexes, for the map registry
+    def memory_bytes(self):
+        size = len(self.cells) + 300 * len(self._shelf_info)
+        if getattr(self, '_components', None) is not None:
+            size += 4 * len(self.cells)
+        fields = getattr(self, '_distance_fields', None)
+        if fields is not None:
+            size += 2 * len(self.cells) * len(fields._fields)
+        return size
+
+    def add_obstacle(self, x, y):
+        if self.cell_id_or_none(x, y) is None:
+            return False  # outside the map, nothing is written
+        if persistence.writer is not None:
+            self.add_obstacles_bulk([(x, y)])
+            return
+        if (x, y) in self.shelves:
+            self.remove_shelf(x, y)
+            server.remove_shelf(self.id, x, y) 
+        with self.lock.writing():
+            self.obstacles.add((x, y))
+            self._bump_version()
+            self._log_changes([(x, y)])
+        server.add_obstacle(self.id, x, y)
+
+    def remove_obstacle(self, x, y):
+        if persistence.writer is not None:
+            self.remove_obstacles_bulk([(x, y)])
+            return
+        if (x, y) in self.obstacles:
+            with self.lock.writing():
+                self.obstacles.discard((x, y))
+                self._bump_version()
+                self._log_changes([(x, y)])
+            server.remove_obstacle(self.id, x, y) 
+
+    def add_shelf(self, x, y, flower, color, quantity):  # Modified to include quantity
+        if self.cell_id_or_none(x, y) is None:
+            return False  # outside the map, nothing is written
+        if persistence.writer is not None:
+            self.add_shelves_bulk([(x, y, flower, color, quantity)])
+            return
+        with self.lock.writing():
+            self.obstacles.add((x, y))  # Shelf acts as an obstacle
+            self.shelves[(x, y)] = {'flower': flower, 'color': color, 'quantity': quantity}
+            self._bump_version()
+            self._log_changes([(x, y)])
+        server.add_shelf(self.id, x, y, flower, color, quantity)
+
+    def remove_shelf(self, x, y):
+        if persistence.writer is not None:
+            self.remove_shelves_bulk([(x, y)])
+            return
+        if (x, y) in self.shelves:
+            with self.lock.writing():
+                del self.shelves[(x, y)]
+                self.obstacles.discard((x, y)) # Also remove it as an obstacle
+                self._bump_version()
+                self._log_changes([(x, y)])
+            server.remove_shelf(self.id, x, y)
+
+    # Clear every obstacle and shelf in memory (the caller resets the database)
+    def reset(self):
+        with self.lock.writing():
+            self.obstacles.clear()
+            self.reset_start()
+            self.reset_goal()
+            self._bump_version()
+            self.changes.clear()
+            self.changes_floor = self.version  # clients from before the reset reload
+
+    # Stored state of a cell for the write-behind queue: None, 'obstacle' or
+    # ('shelf', flower, color, quantity)
+    def _cell_state(self, cell):
+        info = self._shelf_info.get(cell)
+        if info is not None:
+            return ('shelf', info['flower'], info['color'], info['quantity'])
+        return 'obstacle' if cell in self.obstacles else None
+
+    def _states(self, cells):
+        if persistence.writer is None:
+            return None
+        return [self._cell_state(cell) for cell in cells]
+
+    # Log the changed cells for delta sync and queue them for write-behind
+    def _record_changes(self, cells, before):
+        self._log_changes(cells)
+        writer = persistence.writer
+        if writer is not None and before is not None:
+            writer.record(self.id, [(cell, state, self._cell_state(cell)) for cell, state in zip(cells, before)])
+
+    # Bulk versions: the whole batch is written in one transaction and the
+    # in-memory map is only updated once the database commit succeeded. With
+    # write-behind on (see persistence.py) memory is updated at once and the
+    # change is queued for the database instead.
+    def add_obstacles_bulk(self, cells):
+        cells = list(dict.fromkeys(cells))
+        if any(self.cell_id_or_none(x, y) is None for x, y in cells):
+            return False  # nothing is written when a cell is outside the map
+        if persistence.writer is None and not server.add_obstacles_bulk(self.id, cells):
+            return False
+        with self.lock.writing():
+            before = self._states(cells)
+            for cell in cells:
+                self.shelves.pop(cell, None)
+                self.obstacles.add(cell)
+            self._bump_version()
+            self._record_changes(cells, before)
+        return True
+
+    def remove_obstacles_bulk(self, cells):
+        cells = [cell for cell in dict.fromkeys(cells) if cell in self.obstacles]
+        if persistence.writer is None and not server.remove_obstacles_bulk(self.id, cells):
+            return False
+        with self.lock.writing():
+            before = self._states(cells)
+            for cell in cells:
+                self.obstacles.discard(cell)
+                self.shelves.pop(cell, None)  # the database cascades to the shelf
+            self._bump_version()
+            self._record_changes(cells, before)
+        return True
+
+    def add_shelves_bulk(self, details):
+        # details: iterable of (x, y, flower, color, quantity), last one wins per cell
+        details = list({(x, y): (x, y, flower, color, quantity) for x, y, flower, color, quantity in details}.values())
+        if any(self.cell_id_or_none(x, y) is None for x, y, _, _, _ in details):
+            return False  # nothing is written when a cell is outside the map
+        if persistence.writer is None and not server.add_shelves_bulk(self.id, details):
+            return False
+        cells = [(x, y) for x, y, _, _, _ in details]
+        with self.lock.writing():
+            before = self._states(cells)
+            for x, y, flower, color, quantity in details:
+                self.obstacles.add((x, y))
+                self.shelves[(x, y)] = {'flower': flower, 'color': color, 'quantity': quantity}
+            self._bump_version()
+            self._record_changes(cells, before)
+        return True
+
+    def remove_shelves_bulk(self, cells):
+        cells = [cell for cell in dict.fromkeys(cells) if cell in self.shelves]
+        if persistence.writer is None and not server.remove_shelves_bulk(self.id, cells):
+            return False
+        with self.lock.writing():
+            before = self._states(cells)
+            for cell in cells:
+                self.shelves.pop(cell, None)
+                self.obstacles.discard(cell)
+            self._bump_version()
+            self._record_changes(cells, before)
+        return True
+
+    # Cells of the shelves holding at least `quantity` of the flower and/or color
+    # (any product when both are None), through the stock indexes
+    def find_stock(self, flower=None, color=None, quantity=1):
+        shelf_info = self._shelf_info
+        cells = self._stock.cells(flower, color)
+        if cells is None:
+            cells = shelf_info
+        return [cell for cell in cells if shelf_info[cell]['quantity'] >= quantity]
+
+    def get_shelf(self, x, y):
+        nx, ny = x, y
+        if (nx, ny) in self.shelves:
+            return self.shelves[(nx, ny)]
+        else:
+            return None
+    
+    def set_start(self, x, y):
+        self.start = (x, y)
+
+    def reset_start(self):
+        self.start = None
+
+    def set_goal(self, x, y):
+        self.goal = (x, y)
+
+    def reset_goal(self):
+        self.goal = None
+
+    def is_valid(self, x, y):
+        return 0 <= x < self.width and 0 <= y < self.height and self.cells[(x + 1) * self.stride + y + 1] == FREE
+
+    def neighbors(self, x, y):
+        result = []
+        for dx, dy in [(0, 1), (1, 0), (0, -1), (-1, 0)]:
+            nx, ny = x + dx, y + dy
+            if self.is_valid(nx, ny):
+                result.append((nx, ny))
+        return result
+
+    # Free neighbors of the flat cell id i, as flat ids
+    def neighbor_ids(self, i):
+        cells = self.cells
+        return [i + d for d in self.offsets if cells[i + d] == FREE]
+
+    def is_near_shelf(self, x, y):  # New function to check proximity to a shelf
+        for dx, dy in [(0, 1), (1, 0), (0, -1), (-1, 0)]:
+            nx, ny = x + dx, y + dy
+            if (nx, ny) in self.shelves:
+                return True
+        return False
+
+    def interact_with_shelf(self, x, y):  # Modified to work in neighborhood
+        for dx, dy in [(0, 1), (1, 0), (0, -1), (-1, 0)]:
+            nx, ny = x + dx, y + dy
+            if (nx, ny) in self.shelves:
+                shelf_info = self.shelves[(nx, ny)]
+                return f"You are near shelf '{shelf_info['label']}'. It contains: {shelf_info['quantity']} of {shelf_info['flower']}"
+        return "There is no shelf nearby."
+
+    def take_flower(self, x, y, n):  # New function to take flowers from a shelf
+        nx, ny = x, y
+        if (nx, ny) in self.shelves:
+            shelf = self.shelves[(nx, ny)]
+            if self.take_flowers([((nx, ny), n)]):
+                return f"You took {n} of {shelf['flower']} from shelf at ({nx}, {ny})."
+            else:
+                return f"Not enough {shelf['flower']} on shelf at ({nx}, {ny})."
+        return "No shelf found at this location."
+
+    # Take flowers from several shelves at once, all or nothing: takes is
+    # [((x, y), n)]. The new quantities are stored like any shelf edit. Returns
+    # False, taking nothing, when a shelf is missing or holds too little.
+    def take_flowers(self, takes):
+        wanted = {}
+        for cell, n in takes:
+            wanted[cell] = wanted.get(cell, 0) + n
+        with self._take_lock:  # no other take between the check and the write
+            with self.lock.reading():
+                details = []
+                for (x, y), n in wanted.items():
+                    shelf = self._shelf_info.get((x, y))
+                    if shelf is None or n < 0 or shelf['quantity'] < n:
+                        return False
+                    details.append((x, y, shelf['flower'], shelf['color'], shelf['quantity'] - n))
+            return self.add_shelves_bulk(details)
+
+# Function to query the database and retrieve the Map, Obstacles, and Shelves
+def get_map_data(label=None, map_id=None):
+    try:
+        map_instance = Map.load(label, map_id=map_id)
+        if map_instance is None:
+            log.info("No map found with label '%s'" if map_id is None else "No map found with ID %s",
+                     label if map_id is None else map_id)
+        return map_instance
+    except Exception as e:
+        log.error("An error occurred: %s", e)
+
+def reconstruct_path(came_from, current):
+    total_path = [current]
+    while current in came_from:
+        current = came_from[current]
+        total_path.append(current)
+    total_path.reverse()
+    return total_path
+
+def heuristic(a, b):
+    return abs(a[0] - b[0]) + abs(a[1] - b[1])
+
+# Planning only reads the map: start, goal and targets are arguments, never
+# stored on the shared Map, so concurrent requests can't mix up their routes
+def astar(map, algorithm='astar', start=None, goal=None):
+    start = map.start if start is None else start
+    goal = map.goal if goal is None else goal
+    with map.lock.reading():
+        return search.find_path(map, start, goal, algorithm=algorithm)
+
+# Shortest route from start through every target to end, or None
+def plan_path(map, start, targets, end, algorithm='astar', time_budget=route.DEFAULT_TIME_BUDGET):
+    if not targets:
+        return astar(map, algorithm, start, end)
+    # Order the targets on true walking distances and stitch the legs together,
+    # legs are searched again only for an algorithm other than plain A*
+    try:
+        with metrics.ROUTE_SECONDS.time(), map.lock.reading():
+            path = route.plan_route(map, start, targets, end, time_budget,
+                                    None if algorithm == 'astar' else algorithm)
+    except route.Unreachable:
+        metrics.ROUTES.inc('unreachable')
+        return None  # No path found
+    metrics.ROUTES.inc('planned')
+    metrics.ROUTE_LEGS.inc(amount=len(targets) + 1)
+    metrics.PATH_CELLS.observe(len(path), 'route')
+    return path
+
+def astar_multitarget(map, targets, algorithm='astar', time_budget=route.DEFAULT_TIME_BUDGET):
+    return plan_path(map, map.start, targets, map.goal, algorithm, time_budget)
+
+def plan_batch(map, jobs, workers=None, time_budget=route.DEFAULT_TIME_BUDGET):
+    # Plan many (start, targets, end) routes at once on a process pool sharing a
+    # snapshot of the grid, yields (index, path, error) as each one finishes
+    return batch.plan_batch(map, jobs, workers, time_budget)
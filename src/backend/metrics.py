@@ -0,0 +1,169 @@
+import functools
+import math
+import threading
+import time
+from bisect import bisect_left
+
+# Counters and histograms of the backend, exported in the Prometheus text
+# format by render() (served at /metrics). Every metric keeps one series per
+# tuple of label values, given positionally in the order of its labels:
+#
+#   SEARCHES.inc('astar')
+#   REQUEST_SECONDS.observe(0.012, 'run_simulation', 'POST')
+#
+# Updates take the lock of their metric only, so they are cheap enough for
+# every search and database call. Collectors add gauges read at render time
+# (pool, cache and registry statistics).
+
+PREFIX = 'warehouse_'
+# Seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Cells
+SIZE_BUCKETS = (10, 30, 100, 300, 1000, 3000, 10000, 30000, 100000, 300000, 1000000)
+
+_metrics = []
+_collectors = []
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _number(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = PREFIX + name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_labels(self.labels, labels)} {_number(value)}" for labels, value in values]
+        return lines
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = PREFIX + name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [count per bucket (the last one +Inf), sum]
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0]
+            series[0][index] += 1
+            series[1] += value
+
+    # Time the body of a with block
+    def time(self, *labels):
+        return _Timer(self, labels)
+
+    def count(self, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            return sum(series[0]) if series else 0
+
+    def render(self):
+        with self._lock:
+            series = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._series.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labels, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labels, labels)} {cumulative}")
+        return lines
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.began = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.began, *self.labels)
+        return False
+
+# Export the numeric values of a statistics dict (or None) as gauges named
+# PREFIX + prefix + key, read every time the metrics are rendered
+def collect_stats(prefix, stats):
+    _collectors.append((prefix, stats))
+
+def _render_stats(prefix, stats):
+    lines = []
+    values = stats() or {}
+    for key, value in sorted(values.items()):
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        name = f"{PREFIX}{prefix}{key}"
+        lines += [f"# TYPE {name} gauge", f"{name} {_number(value)}"]
+    return lines
+
+def render():
+    lines = []
+    for metric in _metrics:
+        lines += metric.render()
+    for prefix, stats in _collectors:
+        lines += _render_stats(prefix, stats)
+    return '\n'.join(lines) + '\n'
+
+# Count and time the calls of a database function, under its qualified name
+# (create_map, Map.load). Failures are counted by the functions of server.py.
+def db_call(function):
+    operation = function.__qualname__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        DB_CALLS.inc(operation)
+        with DB_SECONDS.time(operation):
+            return function(*args, **kwargs)
+    return wrapper
+
+REQUESTS = Counter('http_requests_total', "HTTP requests by endpoint, method and status", ('endpoint', 'method', 'status'))
+REQUEST_SECONDS = Histogram('http_request_seconds', "Time to answer HTTP requests", ('endpoint', 'method'))
+
+SEARCHES = Counter('searches_total', "Single path searches by algorithm", ('algorithm',))
+SEARCH_EXPANDED = Counter('search_nodes_expanded_total', "Cells expanded by the searches", ('algorithm',))
+SEARCH_PUSHES = Counter('search_heap_pushes_total', "Heap pushes of the searches", ('algorithm',))
+SEARCH_SECONDS = Histogram('search_seconds', "Time of single path searches", ('algorithm',))
+PATH_CELLS = Histogram('path_cells', "Length of the planned paths and routes in cells", ('kind',), SIZE_BUCKETS)
+ROUTES = Counter('routes_total', "Multi-target routes planned, by outcome", ('outcome',))
+ROUTE_LEGS = Counter('route_legs_total', "Legs of the planned multi-target routes")
+ROUTE_SECONDS = Histogram('route_seconds', "Time to plan multi-target routes")
+
+DB_CALLS = Counter('db_calls_total', "Database calls by operation", ('operation',))
+DB_SECONDS = Histogram('db_call_seconds', "Time of the database calls, pool wait included", ('operation',))
+DB_ERRORS = Counter('db_errors_total', "Database calls that raised an error")
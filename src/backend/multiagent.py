@@ -0,0 +1,311 @@
+import heapq
+import itertools
+import time
+from array import array
+import route
+
+# Cooperative routing of several pickers sharing the aisles. Every picker gets
+# a time-indexed path (its cell at t = 0, 1, 2, ...) through its targets, and no
+# two pickers are ever on the same cell at the same time or swap cells in one
+# step.
+#
+# The default mode is cooperative A*: the pickers are planned one after the
+# other by an A* over (cell, time) that avoids the cells and moves reserved by
+# the pickers planned before, then reserves its own. Pickers that can't be
+# planned go first on the next round, while the time budget lasts. The 'cbs'
+# mode runs Conflict-Based Search for small teams: every picker is planned
+# alone, and each conflict found between two paths is resolved by branching on
+# a constraint for either picker, which gives the lowest total travel time.
+#
+# The A* heuristic is the true walking distance to the next target (plus the
+# rest of the route), from a breadth-first search run backwards from the target
+# only as far as the searches need it; pickers sharing a target (a dock) share
+# its search. The same searches give the visiting order of every picker. The
+# time budget bounds the space-time searches, not these.
+
+DEFAULT_TIME_BUDGET = 2.0
+# Teams up to this size can be planned with CBS
+CBS_MAX_AGENTS = 8
+
+INF = float('inf')
+
+# Walking distance to a cell, the breadth-first search from it is resumed when
+# a farther cell is asked for
+class _Distance:
+    def __init__(self, map, goal):
+        self.offsets = map.offsets
+        self.dist = array('i', [-1]) * len(map.cells)
+        self.dist[goal] = 0
+        self.seen = bytearray(map.cells)  # blocked or reached
+        self.seen[goal] = 1
+        self.layer = [goal]
+        self.depth = 0
+
+    def __call__(self, cell):
+        dist = self.dist
+        if dist[cell] >= 0 or not self.layer:
+            return dist[cell] if dist[cell] >= 0 else INF
+        seen = self.seen
+        east, south, west, north = self.offsets
+        layer, depth = self.layer, self.depth
+        # One whole layer at a time
+        while layer and dist[cell] < 0:
+            depth += 1
+            following = []
+            for current in layer:
+                for neighbor in (current + east, current + south, current + west, current + north):
+                    if not seen[neighbor]:
+                        seen[neighbor] = 1
+                        dist[neighbor] = depth
+                        following.append(neighbor)
+            layer = following
+        self.layer, self.depth = layer, depth
+        return dist[cell] if dist[cell] >= 0 else INF
+
+class Agent:
+    def __init__(self, index, start, waypoints):
+        self.index = index
+        self.start = start  # flat cell id
+        self.waypoints = waypoints  # flat cell ids in visiting order, the end last
+        self.distances = None
+        self.tails = None
+
+    # Heuristic of a picker on cell that reached k of its waypoints
+    def h(self, cell, k):
+        if k == len(self.waypoints):
+            return self.distances[-1](cell)
+        return self.distances[k](cell) + self.tails[k]
+
+# Space-time A* for one picker. blocked(cell, t) and crossing(a, b, t) (the
+# move a -> b between t and t + 1) tell the cells and moves it may not use,
+# can_stay(cell, t) whether it may stop for good on its end at t. Returns the
+# flat ids of its cells at t = 0, 1, ... or None.
+def _search(map, agent, blocked, crossing, can_stay, horizon, deadline):
+    cells = map.cells
+    moves = (0,) + map.offsets  # waiting first
+    waypoints = agent.waypoints
+    last = len(waypoints)
+    k = 0
+    while k < last and waypoints[k] == agent.start:
+        k += 1
+    state = (agent.start, 0, k)
+    parent = {state: None}
+    counter = itertools.count()
+    heap = [(agent.h(agent.start, k), 0, next(counter), state)]
+    while heap:
+        _, _, n, state = heapq.heappop(heap)
+        cell, t, k = state
+        if k == last and cell == waypoints[-1] and can_stay(cell, t):
+            path = []
+            while state is not None:
+                path.append(state[0])
+                state = parent[state]
+            path.reverse()
+            return path
+        if n & 0xFF == 0 and time.monotonic() > deadline:
+            return None
+        if t >= horizon:
+            continue
+        nt = t + 1
+        for move in moves:
+            neighbor = cell + move
+            if cells[neighbor] or blocked(neighbor, nt) or move and crossing(cell, neighbor, t):
+                continue
+            nk = k
+            while nk < last and waypoints[nk] == neighbor:
+                nk += 1
+            child = (neighbor, nt, nk)
+            if child in parent:
+                continue
+            h = agent.h(neighbor, nk)
+            if h == INF:
+                continue
+            parent[child] = state
+            heapq.heappush(heap, (nt + h, -nt, next(counter), child))
+    return None
+
+def _horizon(map, agent, agents):
+    return agent.h(agent.start, 0) + map.width + map.height + 2 * agents
+
+# Cell of a finished path at time t; None once the picker left the floor
+def _at(path, t, stay):
+    if t < len(path):
+        return path[t]
+    return path[-1] if stay else None
+
+class _Reservations:
+    def __init__(self, stay):
+        self.stay = stay
+        self.cells = set()  # (cell, t)
+        self.moves = set()  # (from, to, t)
+        self.latest = {}  # cell -> last t it is reserved at
+        self.parked = {}  # cell -> t from which a finished picker stays on it
+
+    def blocked(self, cell, t):
+        return (cell, t) in self.cells or self.parked.get(cell, INF) <= t
+
+    def crossing(self, a, b, t):
+        return (b, a, t) in self.moves
+
+    def can_stay(self, cell, t):
+        return not self.stay or self.latest.get(cell, -1) < t
+
+    def reserve(self, path):
+        for t, cell in enumerate(path):
+            self.cells.add((cell, t))
+            if self.latest.get(cell, -1) < t:
+                self.latest[cell] = t
+            if t + 1 < len(path):
+                self.moves.add((cell, path[t + 1], t))
+        if self.stay:
+            self.parked[path[-1]] = len(path) - 1
+
+def _cooperative(map, agents, stay, deadline):
+    order = sorted(agents, key=lambda agent: -agent.h(agent.start, 0))
+    best = None
+    for _ in range(len(agents)):
+        reservations = _Reservations(stay)
+        # Nobody may walk over a picker waiting on its start at t = 0
+        for agent in agents:
+            reservations.cells.add((agent.start, 0))
+        paths, failed = {}, []
+        # A picker walled in by parked ones would search until the deadline, so
+        # each one gets its share of the time left for the round
+        share = (deadline - time.monotonic()) / len(order)
+        for agent in order:
+            path = _search(map, agent, reservations.blocked, reservations.crossing, reservations.can_stay,
+                           _horizon(map, agent, len(agents)), min(deadline, time.monotonic() + share))
+            if path is None:
+                failed.append(agent)
+            else:
+                paths[agent.index] = path
+                reservations.reserve(path)
+        if best is None or len(paths) > len(best):
+            best = paths
+        if not failed or time.monotonic() > deadline:
+            break
+        order = failed + [agent for agent in order if agent not in failed]
+    return best
+
+class _Constraints:
+    def __init__(self, cells=frozenset(), moves=frozenset()):
+        self.cells = cells  # (cell, t)
+        self.moves = moves  # (from, to, t)
+        self.latest = {}
+        for cell, t in cells:
+            self.latest[cell] = max(t, self.latest.get(cell, -1))
+
+    def blocked(self, cell, t):
+        return (cell, t) in self.cells
+
+    def crossing(self, a, b, t):
+        return (a, b, t) in self.moves
+
+    def can_stay(self, cell, t):
+        return self.latest.get(cell, -1) < t
+
+def _first_conflict(paths, stay):
+    length = max(len(path) for path in paths.values())
+    agents = sorted(paths)
+    for t in range(length):
+        seen = {}
+        for i in agents:
+            cell = _at(paths[i], t, stay)
+            if cell is None:
+                continue
+            if cell in seen:
+                return ('cell', seen[cell], i, cell, t)
+            seen[cell] = i
+        for i, j in itertools.combinations(agents, 2):
+            a, b = _at(paths[i], t, stay), _at(paths[j], t, stay)
+            a2, b2 = _at(paths[i], t + 1, stay), _at(paths[j], t + 1, stay)
+            if None not in (a, b, a2, b2) and a != a2 and a == b2 and b == a2:
+                return ('move', i, j, (a, a2), t)
+    return None
+
+def _cbs(map, agents, stay, deadline):
+    by_index = {agent.index: agent for agent in agents}
+    counter = itertools.count()
+
+    def plan(agent, constraints):
+        return _search(map, agent, constraints.blocked, constraints.crossing,
+                       constraints.can_stay if stay else (lambda cell, t: True),
+                       _horizon(map, agent, len(agents)), deadline)
+
+    constraints = {agent.index: _Constraints() for agent in agents}
+    paths = {}
+    for agent in agents:
+        path = plan(agent, constraints[agent.index])
+        if path is None:
+            return None
+        paths[agent.index] = path
+    cost = lambda paths: sum(len(path) - 1 for path in paths.values())
+    heap = [(cost(paths), next(counter), constraints, paths)]
+    while heap and time.monotonic() < deadline:
+        _, _, constraints, paths = heapq.heappop(heap)
+        conflict = _first_conflict(paths, stay)
+        if conflict is None:
+            return paths
+        kind, i, j, where, t = conflict
+        for agent_index in (i, j):
+            old = constraints[agent_index]
+            if kind == 'cell':
+                new = _Constraints(old.cells | {(where, t)}, old.moves)
+            else:
+                a, b = where if agent_index == i else where[::-1]
+                new = _Constraints(old.cells, old.moves | {(a, b, t)})
+            path = plan(by_index[agent_index], new)
+            if path is None:
+                continue
+            child_constraints = dict(constraints)
+            child_constraints[agent_index] = new
+            child_paths = dict(paths)
+            child_paths[agent_index] = path
+            heapq.heappush(heap, (cost(child_paths), next(counter), child_constraints, child_paths))
+    return None
+
+# Plan conflict-free paths for pickers given as (start, targets, end) cells.
+# The visiting order of every picker is fixed first (route.solve_order), the
+# caller holds the map for reading. With stay the pickers stop on their end
+# for good, otherwise they leave the floor there (e.g. a shared dock).
+# mode is 'cooperative' or 'cbs' (teams up to CBS_MAX_AGENTS, falling back to
+# cooperative A* when CBS runs out of time). Returns (mode used, paths), paths
+# holding the (x, y) cells of every picker per time step, or None for a picker
+# that couldn't be planned in time. Raises route.Unreachable for a bad cell
+# and ValueError when two pickers share a start (or an end, with stay).
+def plan_team(map, pickers, mode='cooperative', time_budget=DEFAULT_TIME_BUDGET, stay=True):
+    starts = [start for start, _, _ in pickers]
+    if len(set(starts)) != len(starts):
+        raise ValueError("Two pickers can't start on the same cell")
+    if stay and len({end for _, _, end in pickers}) != len(pickers):
+        raise ValueError("Two pickers can't stay on the same end")
+    agents, distances = [], {}
+    for index, (start, targets, end) in enumerate(pickers):
+        route.check_targets(map, start, targets, end)
+        # The visiting order from the same backward searches as the heuristic
+        cells = [start] + list(targets) + [end]
+        locations = [map.cell_id(*cell) for cell in cells]
+        for cell in locations[1:]:
+            if cell not in distances:
+                distances[cell] = _Distance(map, cell)
+        dist = [[0 if a == b else distances[locations[b]](locations[a]) if b else distances[locations[a]](locations[0])
+                 for b in range(len(cells))] for a in range(len(cells))]
+        order = route.solve_order(dist, min(route.DEFAULT_TIME_BUDGET, time_budget / 4))
+        agent = Agent(index, locations[0], [locations[k] for k in order[1:]])
+        agent.distances = [distances[cell] for cell in agent.waypoints]
+        agent.tails = [0] * len(agent.waypoints)
+        for k in range(len(agent.waypoints) - 2, -1, -1):
+            agent.tails[k] = agent.tails[k + 1] + agent.distances[k + 1](agent.waypoints[k])
+        agents.append(agent)
+
+    deadline = time.monotonic() + time_budget
+    paths = None
+    if mode == 'cbs' and len(agents) <= CBS_MAX_AGENTS:
+        # Half the time for CBS, whatever is left for the fallback
+        paths = _cbs(map, agents, stay, time.monotonic() + (deadline - time.monotonic()) / 2)
+    if paths is None:
+        mode = 'cooperative'
+        paths = _cooperative(map, agents, stay, deadline)
+    cell_xy = map.cell_xy
+    return mode, [[cell_xy(cell) for cell in paths[index]] if index in paths else None
+                  for index in range(len(agents))]
@@ -0,0 +1,179 @@
+import itertools
+import time
+import distance_fields
+import route
+
+# Order fulfilment: an order is a list of (flower, color, quantity) lines and a
+# start/dock position. The planner picks the shelves to draw from when the
+# stock of a line is spread over several, so that the route start -> picks ->
+# dock is as short as possible, then reserves the quantities on the map.
+#
+# Shelves are picked from their access cell nearest to the start; shelves
+# sharing an access cell are one stop. For every line the nearest stops that
+# cover it, plus a few more, are candidates. A cheapest-insertion start is then
+# improved by dropping and swapping stops within the time budget, every set of
+# stops being priced with the pick-order solver of route.py.
+
+# Candidate shelves per line beyond the nearest ones that cover it
+EXTRA_CANDIDATES = 3
+# Plans retried when another order took the stock in the meantime
+RESERVE_ATTEMPTS = 3
+
+class OutOfStock(Exception):
+    def __init__(self, flower, color, missing):
+        super().__init__(f"Missing {missing} of {color} {flower} reachable from the start")
+        self.flower = flower
+        self.color = color
+        self.missing = missing
+
+class OrderPlan:
+    def __init__(self, picks, path):
+        self.picks = picks  # [((x, y) of the shelf, (x, y) of the stop, flower, color, quantity)]
+        self.path = path
+
+    def takes(self):
+        return [(shelf, quantity) for shelf, _, _, _, quantity in self.picks]
+
+def _merge_lines(lines):
+    demand = {}
+    for flower, color, quantity in lines:
+        if not flower or not color:
+            raise ValueError("Every order line needs a flower and a color")
+        if quantity > 0:
+            demand[(flower, color)] = demand.get((flower, color), 0) + quantity
+    return demand
+
+# Candidate stops: {(x, y) of the stop: [(x, y) of its shelves]}, and the stock
+# of the candidate shelves
+def _candidates(map, start, demand):
+    stops, stock = {}, {}
+    for (flower, color), quantity in demand.items():
+        covered, extra = 0, 0
+        for _, shelf, path in distance_fields.iter_nearest_shelves(map, start, map.find_stock(flower, color)):
+            stops.setdefault(path[-1], []).append(shelf)
+            stock[shelf] = map.shelves[shelf]['quantity']
+            if covered >= quantity:
+                extra += 1
+                if extra >= EXTRA_CANDIDATES:
+                    break
+            covered += stock[shelf]
+        if covered < quantity:
+            raise OutOfStock(flower, color, quantity - covered)
+    return stops, stock
+
+class _Selection:
+    def __init__(self, map, start, end, demand, stops, stock, time_budget):
+        self.demand = demand
+        self.stops = list(stops)
+        self.shelves = [stops[stop] for stop in self.stops]  # shelves of stop k at k - 1
+        self.stock = stock
+        self.product = {shelf: (map.shelves[shelf]['flower'], map.shelves[shelf]['color']) for shelf in stock}
+        locations = [start] + self.stops + [end]
+        self.dist, _ = route.distance_matrix(map, [map.cell_id(*cell) for cell in locations])
+        self.end = len(locations) - 1
+        self.deadline = time.monotonic() + time_budget
+        self._costs = {}
+
+    # Stock of every line at the chosen stops (indexes in the matrix)
+    def _have(self, chosen):
+        have = dict.fromkeys(self.demand, 0)
+        for shelf in {shelf for k in chosen for shelf in self.shelves[k - 1]}:
+            have[self.product[shelf]] += self.stock[shelf]
+        return have
+
+    def covered(self, chosen):
+        have = self._have(chosen)
+        return all(have[product] >= quantity for product, quantity in self.demand.items())
+
+    # Length of the best route through the chosen stops found in the time left
+    def cost(self, chosen):
+        key = frozenset(chosen)
+        if key not in self._costs:
+            nodes = [0] + sorted(key) + [self.end]
+            dist = [[self.dist[a][b] for b in nodes] for a in nodes]
+            budget = max(0.0, min(0.01, self.deadline - time.monotonic()))
+            self._costs[key] = route.route_length(route.solve_order(dist, budget), dist)
+        return self._costs[key]
+
+    # Cheapest insertion of stops holding stock of the lines still missing
+    def greedy(self):
+        chosen, order = [], [0, self.end]
+        dist = self.dist
+        insertion = lambda k, j: dist[order[j]][k] + dist[k][order[j + 1]] - dist[order[j]][order[j + 1]]
+        while True:
+            have = self._have(chosen)
+            missing = {product for product, quantity in self.demand.items() if have[product] < quantity}
+            if not missing:
+                return chosen
+            taken = {shelf for k in chosen for shelf in self.shelves[k - 1]}
+            helpful = [k for k in range(1, self.end) if k not in chosen and
+                       any(self.product[shelf] in missing and shelf not in taken for shelf in self.shelves[k - 1])]
+            best = min(helpful, key=lambda k: min(insertion(k, j) for j in range(len(order) - 1)))
+            order.insert(min(range(len(order) - 1), key=lambda j: insertion(best, j)) + 1, best)
+            chosen.append(best)
+
+    # Drop and swap stops while that shortens the route and time is left
+    def improve(self, chosen):
+        chosen = set(chosen)
+        best = self.cost(chosen)
+        improved = True
+        while improved and time.monotonic() < self.deadline:
+            improved = False
+            for k in sorted(chosen):
+                if self.covered(chosen - {k}) and self.cost(chosen - {k}) < best:
+                    chosen.discard(k)
+                    best = self.cost(chosen)
+                    improved = True
+            for k, other in itertools.product(sorted(chosen), range(1, self.end)):
+                if time.monotonic() >= self.deadline:
+                    break
+                if other in chosen or k not in chosen:
+                    continue
+                candidate = (chosen - {k}) | {other}
+                if self.covered(candidate) and self.cost(candidate) < best:
+                    chosen = candidate
+                    best = self.cost(chosen)
+                    improved = True
+        return sorted(chosen)
+
+# Plan an order: the shelves to draw from and the route start -> stops -> end
+# (the start when no end is given). Nothing is reserved; the caller holds the
+# map for reading. Raises OutOfStock for a line the reachable shelves can't
+# cover, route.Unreachable for a bad start or end and ValueError for a line
+# without a flower or a color.
+def plan_order(map, start, lines, end=None, time_budget=route.DEFAULT_TIME_BUDGET):
+    end = start if end is None else end
+    route.check_targets(map, start, [], end)
+    demand = _merge_lines(lines)
+    if not demand:
+        return OrderPlan([], route.plan_route(map, start, [], end, time_budget))
+    stops, stock = _candidates(map, start, demand)
+    selection = _Selection(map, start, end, demand, stops, stock, time_budget)
+    chosen = selection.improve(selection.greedy())
+
+    # Draw from the chosen stops, in route order, until every line is complete
+    path = route.plan_route(map, start, [selection.stops[k - 1] for k in chosen], end, time_budget)
+    order = {cell: step for step, cell in reversed(list(enumerate(path)))}
+    remaining = dict(demand)
+    picks, taken = [], set()
+    for k in sorted(chosen, key=lambda k: order[selection.stops[k - 1]]):
+        for shelf in selection.shelves[k - 1]:
+            flower, color = selection.product[shelf]
+            need = remaining[(flower, color)]
+            if need and shelf not in taken:
+                quantity = min(need, stock[shelf])
+                remaining[(flower, color)] = need - quantity
+                taken.add(shelf)
+                picks.append((shelf, selection.stops[k - 1], flower, color, quantity))
+    return OrderPlan(picks, path)
+
+# Plan the order and reserve its quantities with Map.take_flowers. Returns the
+# OrderPlan, or None when the stock kept changing under the planner (or could
+# not be stored).
+def fulfil_order(map, start, lines, end=None, time_budget=route.DEFAULT_TIME_BUDGET):
+    for _ in range(RESERVE_ATTEMPTS):
+        with map.lock.reading():
+            plan = plan_order(map, start, lines, end, time_budget)
+        if map.take_flowers(plan.takes()):
+            return plan
+    return None
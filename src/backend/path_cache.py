@@ -0,0 +1,137 @@
+import os
+import threading
+from array import array
+from collections import OrderedDict
+
+# LRU cache of shortest paths between two cells of a map. An entry remembers
+# the map version it was last known to be valid for; when the map has changed
+# since, the walkability edits in between are replayed against it:
+#  - a cell that became blocked invalidates the entry only if it is on the path
+#  - a cell that became free invalidates it only if a path through that cell
+#    could be shorter, i.e. |start - cell| + |cell - goal| < path length
+# Paths are only cached for optimal searches (A*, JPS, breadth-first), which
+# is what makes these checks sound.
+
+DEFAULT_MAX_BYTES = int(os.environ.get('PATH_CACHE_MB', 64)) * 1024 * 1024
+ENTRY_OVERHEAD = 200  # rough bytes per entry besides the path itself
+
+class CacheEntry:
+    __slots__ = ('version', 'path', 'size')
+
+    def __init__(self, version, path):
+        self.version = version
+        self.path = path  # array of cell ids from the smaller id to the larger one, or None
+        self.size = ENTRY_OVERHEAD + (4 * len(path) if path is not None else 0)
+
+# Searches may leave from a blocked start but never enter a blocked goal, so
+# only paths between free cells are symmetric and cached
+def cacheable(map, start, goal):
+    return not map.cells[start] and not map.cells[goal]
+
+class PathCache:
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0, 'revalidations': 0}
+
+    def _key(self, map, start, goal):
+        # A path and its reverse share one entry
+        if start <= goal:
+            return (map.id, map.uid, start, goal), False
+        return (map.id, map.uid, goal, start), True
+
+    def _still_valid(self, map, entry, start, goal):
+        edits = map.edits_since(entry.version)
+        if edits is None:
+            return False
+        path = entry.path
+        on_path = None
+        stride = map.stride
+        sx, sy = divmod(start, stride)
+        gx, gy = divmod(goal, stride)
+        length = len(path) - 1 if path is not None else None
+        for _, cell, blocked in edits:
+            if blocked:
+                if path is None:
+                    continue
+                if on_path is None:
+                    on_path = set(path)
+                if cell in on_path:
+                    return False
+            else:
+                if path is None:
+                    return False
+                x, y = divmod(cell, stride)
+                if abs(sx - x) + abs(sy - y) + abs(gx - x) + abs(gy - y) < length:
+                    return False
+        return True
+
+    # Returns (True, path) on a hit, path being a list of cell ids or None when
+    # the goal is known to be unreachable, and (False, None) on a miss
+    def get(self, map, start, goal):
+        key, reverse = self._key(map, start, goal)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.version != map.version:
+                if self._still_valid(map, entry, key[2], key[3]):
+                    entry.version = map.version
+                    self._stats['revalidations'] += 1
+                else:
+                    del self._entries[key]
+                    self.bytes -= entry.size
+                    self._stats['invalidations'] += 1
+                    entry = None
+            if entry is None:
+                self._stats['misses'] += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            path = entry.path
+        if path is None:
+            return True, None
+        return True, path[::-1].tolist() if reverse else path.tolist()
+
+    def put(self, map, start, goal, path):
+        key, reverse = self._key(map, start, goal)
+        if path is not None:
+            path = array('i', reversed(path) if reverse else path)
+        entry = CacheEntry(map.version, path)
+        if entry.size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old.size
+            self._entries[key] = entry
+            self.bytes += entry.size
+            while self.bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= evicted.size
+                self._stats['evictions'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def resize(self, max_bytes):
+        with self._lock:
+            self.max_bytes = max_bytes
+            while self.bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= evicted.size
+                self._stats['evictions'] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = self.bytes
+            stats['max_bytes'] = self.max_bytes
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+cache = PathCache()
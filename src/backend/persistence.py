@@ -0,0 +1,204 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+import server
+
+log = logging.getLogger(__name__)
+
+# Write-behind persistence of map edits. In this mode a Map mutation only
+# updates memory and records the change here; a background thread writes the
+# changes to PostgreSQL in batches, one transaction per map, every `interval`
+# seconds or as soon as `batch_size` cells are pending.
+#
+# Changes are coalesced per cell: only the state before the first pending
+# change and the latest state are kept, so a cell added and removed again
+# between two flushes costs nothing. Every change is appended to a local
+# journal before it is acknowledged; the journal is replayed at start-up, so
+# edits acknowledged before a crash still reach the database.
+#
+# A cell state is None (free), 'obstacle' or ('shelf', flower, color, quantity).
+
+DEFAULT_INTERVAL = float(os.environ.get('WRITE_BEHIND_INTERVAL', 0.5))
+DEFAULT_BATCH_SIZE = int(os.environ.get('WRITE_BEHIND_BATCH', 5000))
+DEFAULT_JOURNAL = os.environ.get('WRITE_BEHIND_JOURNAL', 'write_behind.journal')
+
+def _state(value):
+    return tuple(value) if isinstance(value, list) else value
+
+class WriteBehind:
+    def __init__(self, journal=DEFAULT_JOURNAL, interval=DEFAULT_INTERVAL,
+                 batch_size=DEFAULT_BATCH_SIZE, fsync=True):
+        self.journal = journal
+        self.interval = interval
+        self.batch_size = batch_size
+        self.fsync = fsync
+        self._pending = {}  # (map id, (x, y)) -> [state in the database, latest state]
+        self._lock = threading.Condition(threading.Lock())
+        self._flush_lock = threading.Lock()  # one flush at a time
+        self._closed = False
+        self._stats = {'recorded': 0, 'coalesced': 0, 'flushes': 0, 'flushed_cells': 0,
+                       'failed_flushes': 0, 'flush_time': 0.0, 'last_flush_time': 0.0,
+                       'max_flush_time': 0.0}
+        self._replay()
+        self._file = open(self.journal, 'a')
+        self._worker = threading.Thread(target=self._run, name='write-behind', daemon=True)
+        self._worker.start()
+
+    def _replay(self):
+        for path in (self.journal + '.flushing', self.journal):
+            if not os.path.exists(path):
+                continue
+            with open(path) as file:
+                for line in file:
+                    try:
+                        map_id, x, y, before, after = json.loads(line)
+                    except ValueError:
+                        break  # torn last line of a crash, nothing after it was acknowledged
+                    self._merge(map_id, (x, y), _state(before), _state(after))
+        if self._pending:
+            log.warning("Replaying %s unsaved map changes from %s", len(self._pending), self.journal)
+            self._rewrite()
+        flushing = self.journal + '.flushing'
+        if os.path.exists(flushing):
+            os.remove(flushing)
+
+    def _merge(self, map_id, cell, before, after):
+        key = (map_id, cell)
+        entry = self._pending.get(key)
+        if entry is None:
+            if before != after:
+                self._pending[key] = [before, after]
+        elif entry[0] == after:
+            del self._pending[key]  # back to what the database has
+            self._stats['coalesced'] += 1
+        else:
+            entry[1] = after
+
+    # Journal the pending changes alone, replacing the current journal
+    def _rewrite(self):
+        temp = self.journal + '.tmp'
+        with open(temp, 'w') as file:
+            for (map_id, (x, y)), (before, after) in self._pending.items():
+                file.write(json.dumps([map_id, x, y, before, after]) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp, self.journal)
+
+    # changes: [((x, y), state before, state after)] of one map, in order
+    def record(self, map_id, changes):
+        lines = ''.join(json.dumps([map_id, x, y, before, after]) + '\n'
+                        for (x, y), before, after in changes if before != after)
+        with self._lock:
+            if lines:
+                self._file.write(lines)
+                self._file.flush()
+                if self.fsync:
+                    os.fsync(self._file.fileno())
+            for cell, before, after in changes:
+                self._merge(map_id, cell, before, after)
+            self._stats['recorded'] += len(changes)
+            if len(self._pending) >= self.batch_size:
+                self._lock.notify()
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._closed and len(self._pending) < self.batch_size:
+                    self._lock.wait(self.interval)
+                if self._closed:
+                    return
+            self.flush()
+
+    # Write every change recorded so far to the database. Returns True once
+    # nothing is pending, False if some map could not be written (its changes
+    # stay pending and are retried).
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+                if not batch:
+                    return True
+                # New records go to a fresh journal while this batch is written
+                self._file.close()
+                os.replace(self.journal, self.journal + '.flushing')
+                self._file = open(self.journal, 'a')
+            began = time.perf_counter()
+            per_map = {}
+            for (map_id, cell), (_, after) in batch.items():
+                per_map.setdefault(map_id, []).append((cell, after))
+            failed = {map_id for map_id, changes in per_map.items()
+                      if not server.apply_changes(map_id, changes)}
+            elapsed = time.perf_counter() - began
+            with self._lock:
+                if failed:
+                    # Older changes first, then whatever was recorded meanwhile
+                    newer, self._pending = self._pending, {}
+                    for (map_id, cell), (before, after) in batch.items():
+                        if map_id in failed:
+                            self._pending[(map_id, cell)] = [before, after]
+                    for (map_id, cell), (before, after) in newer.items():
+                        self._merge(map_id, cell, before, after)
+                    self._file.close()
+                    self._rewrite()
+                    self._file = open(self.journal, 'a')
+                    self._stats['failed_flushes'] += 1
+                os.remove(self.journal + '.flushing')
+                stats = self._stats
+                stats['flushes'] += 1
+                stats['flushed_cells'] += sum(len(changes) for map_id, changes in per_map.items()
+                                              if map_id not in failed)
+                stats['flush_time'] += elapsed
+                stats['last_flush_time'] = elapsed
+                stats['max_flush_time'] = max(stats['max_flush_time'], elapsed)
+                return not failed and not self._pending
+
+    # Drop the pending changes of a map, e.g. before it is reset
+    def discard(self, map_id):
+        with self._lock:
+            for key in [key for key in self._pending if key[0] == map_id]:
+                del self._pending[key]
+            self._file.close()
+            self._rewrite()
+            self._file = open(self.journal, 'a')
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._lock.notify()
+        self._worker.join()
+        self.flush()
+        with self._lock:
+            self._file.close()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['queue_depth'] = len(self._pending)
+            stats['journal_bytes'] = self._file.tell() if not self._file.closed else 0
+        stats['avg_flush_time'] = stats['flush_time'] / stats['flushes'] if stats['flushes'] else 0.0
+        return stats
+
+# The write-behind queue when enabled, None while edits are written through
+writer = None
+
+def enable(journal=DEFAULT_JOURNAL, interval=DEFAULT_INTERVAL, batch_size=DEFAULT_BATCH_SIZE, fsync=True):
+    global writer
+    if writer is None:
+        writer = WriteBehind(journal, interval, batch_size, fsync)
+        atexit.register(writer.close)
+    return writer
+
+# Barrier: returns once every edit acknowledged so far is in the database (or
+# the database refused it). Does nothing in write-through mode.
+def flush():
+    return writer.flush() if writer is not None else True
+
+def stats():
+    return writer.stats() if writer is not None else None
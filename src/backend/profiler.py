@@ -0,0 +1,87 @@
+import collections
+import itertools
+import sys
+import threading
+import time
+
+# Sampling profiler for single requests. While a request is profiled a thread
+# takes the stack of the request's thread every `interval` seconds and counts
+# the stacks seen; the result reads as collapsed stacks, one
+# "outer;inner;innermost count" line per stack, the input of flame graph tools.
+# Profiles of the last requests are kept in `profiles`.
+
+# Seconds between samples; the sampling thread also waits for the GIL, so the
+# interpreter's switch interval (sys.getswitchinterval) is the real minimum
+DEFAULT_INTERVAL = 0.001
+# Profiles kept for /profiles
+KEEP = 20
+
+_ids = itertools.count(1)
+profiles = collections.deque(maxlen=KEEP)
+_profiles_lock = threading.Lock()
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{code.co_firstlineno})"
+
+class Profile:
+    def __init__(self, name, thread_id=None, interval=DEFAULT_INTERVAL):
+        self.id = next(_ids)
+        self.name = name
+        self.thread_id = threading.get_ident() if thread_id is None else thread_id
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.began = None
+        self.duration = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        thread_id, stacks = self.thread_id, self.stacks
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            if frame is None or self._stop.is_set():
+                break  # the thread is gone or already in stop()
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def start(self):
+        self.began = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.perf_counter() - self.began
+        with _profiles_lock:
+            profiles.append(self)
+        return self
+
+    def collapsed(self):
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    # Functions by the share of samples they were on top of the stack
+    def top(self, n=10):
+        own = collections.Counter()
+        for stack, count in self.stacks.items():
+            own[stack.rsplit(';', 1)[-1]] += count
+        return [{'function': name, 'samples': count, 'share': count / self.samples}
+                for name, count in own.most_common(n)]
+
+    def summary(self):
+        return {'id': self.id, 'name': self.name, 'duration': self.duration, 'samples': self.samples,
+                'top': self.top()}
+
+def find(profile_id):
+    with _profiles_lock:
+        return next((profile for profile in profiles if profile.id == profile_id), None)
+
+def recent():
+    with _profiles_lock:
+        return [profile.summary() for profile in profiles]
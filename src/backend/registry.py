@@ -0,0 +1,127 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+from map import Map
+import persistence
+import server
+import snapshot
+
+log = logging.getLogger(__name__)
+
+# Maps of every warehouse served by the backend. A map is loaded from the
+# database (or its snapshot, see snapshot.py) the first time it is asked for, by
+# label or by map id, and kept in memory while it is used; when the maps loaded
+# take more than the memory budget, the least recently used ones are dropped
+# (and loaded again on their next request).
+
+DEFAULT_MAX_BYTES = int(os.environ.get('MAP_MEMORY_MB', 512)) * 1024 * 1024
+
+class MapRegistry:
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._maps = OrderedDict()  # map id -> Map, least recently used first
+        self._ids = {}  # label -> map id
+        self._lock = threading.Lock()
+        self._loading = {}  # map id (label of a missing map) -> lock held while it loads
+        # Callables notified with the Map when it is dropped
+        self.evict_listeners = []
+        self._stats = {'hits': 0, 'loads': 0, 'evictions': 0, 'created': 0}
+
+    def _cached(self, key):
+        map_id = key if isinstance(key, int) else self._ids.get(key)
+        map_instance = self._maps.get(map_id)
+        if map_instance is not None:
+            self._maps.move_to_end(map_id)
+        return map_instance
+
+    # The map with the given label (str) or map id (int), or None. A missing
+    # map is created with the given (width, height) when create is set.
+    def get(self, key, create=None):
+        with self._lock:
+            map_instance = self._cached(key)
+            if map_instance is not None:
+                self._stats['hits'] += 1
+        if map_instance is not None:
+            self.trim()  # its indexes may have grown since the last request
+            return map_instance
+        if not isinstance(key, int):
+            # Loads are keyed on the map id, so a map asked for by label and by
+            # map id at once is loaded only once. Only a missing map stays keyed
+            # on its label, for its creation.
+            found = server.map_revision(key)
+            if found is not None:
+                key = found[0]
+        with self._lock:
+            loading = self._loading.setdefault(key, threading.Lock())
+        # One load per map, other requests for it wait for that load
+        with loading:
+            with self._lock:
+                map_instance = self._cached(key)
+            if map_instance is None:
+                persistence.flush()  # queued edits of a dropped map must be in the database first
+                if isinstance(key, int):
+                    map_instance = snapshot.load_map(map_id=key)
+                else:
+                    map_instance = snapshot.load_map(key)
+                if map_instance is not None:
+                    self._stats['loads'] += 1
+                elif create is not None and not isinstance(key, int):
+                    log.info("Map '%s' does not exist. Creating a new map.", key)
+                    map_instance = Map(*create)
+                    if map_instance.assign_id(key):
+                        self._stats['created'] += 1
+                    else:
+                        map_instance = None
+                if map_instance is not None:
+                    self.add(map_instance)
+        with self._lock:
+            self._loading.pop(key, None)
+        return map_instance
+
+    # Keep a map built in this process (e.g. by the benchmarks) like a loaded one
+    def add(self, map_instance):
+        with self._lock:
+            self._maps[map_instance.id] = map_instance
+            if map_instance.label is not None:
+                self._ids[map_instance.label] = map_instance.id
+        self.trim()
+
+    # Drop least recently used maps until the loaded ones fit in the budget,
+    # the most recent map always stays
+    def trim(self):
+        evicted = []
+        with self._lock:
+            total = sum(map_instance.memory_bytes() for map_instance in self._maps.values())
+            while total > self.max_bytes and len(self._maps) > 1:
+                _, map_instance = self._maps.popitem(last=False)
+                if self._ids.get(map_instance.label) == map_instance.id:
+                    del self._ids[map_instance.label]
+                total -= map_instance.memory_bytes()
+                evicted.append(map_instance)
+                self._stats['evictions'] += 1
+        for map_instance in evicted:
+            log.info("Map '%s' dropped from memory", map_instance.label)
+            for listener in self.evict_listeners:
+                listener(map_instance)
+            map_instance.close()
+
+    def resize(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.trim()
+
+    def loaded(self):
+        with self._lock:
+            return [{'label': map_instance.label, 'map_id': map_instance.id, 'width': map_instance.width,
+                     'height': map_instance.height, 'bytes': map_instance.memory_bytes()}
+                    for map_instance in self._maps.values()]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['maps'] = len(self._maps)
+            stats['bytes'] = sum(map_instance.memory_bytes() for map_instance in self._maps.values())
+            stats['max_bytes'] = self.max_bytes
+        return stats
+
+maps = MapRegistry()
@@ -0,0 +1,199 @@
+import heapq
+import threading
+import time
+import route
+import search
+
+# Incremental replanning (D* Lite, Koenig & Likhachev) for a route that stays
+# active while the map is edited. Each leg keeps its search state; the search
+# runs from the leg goal back to the picker, so when the picker moves or cells
+# change only the g-values the change reaches are repaired, the rest of the
+# search tree is reused.
+
+INF = float('inf')
+
+class DStarLite:
+    def __init__(self, map, start, goal):
+        self.map = map
+        self.start = start  # flat cell ids
+        self.goal = goal
+        self._last = start
+        self._km = 0
+        self._g = {}
+        self._rhs = {goal: 0}
+        self._open = {}  # cell -> key of its live heap entry
+        self._heap = []
+        self._pending = []  # cells whose walkability changed since the last repair
+        self.expanded = 0
+        self._push(goal)
+
+    def _h(self, a, b):
+        stride = self.map.stride
+        ax, ay = divmod(a, stride)
+        bx, by = divmod(b, stride)
+        return abs(ax - bx) + abs(ay - by)
+
+    def _key(self, cell):
+        m = min(self._g.get(cell, INF), self._rhs.get(cell, INF))
+        return (m + self._h(self.start, cell) + self._km, m)
+
+    def _push(self, cell):
+        key = self._key(cell)
+        self._open[cell] = key
+        heapq.heappush(self._heap, (key, cell))
+
+    # A blocked cell is never entered; the picker may still leave a blocked start
+    def _blocked(self, cell):
+        return self.map.cells[cell] and cell != self.start
+
+    def _update(self, cell):
+        if cell != self.goal:
+            if self._blocked(cell):
+                rhs = INF
+            else:
+                g, cells = self._g, self.map.cells
+                rhs = INF
+                for offset in self.map.offsets:
+                    neighbor = cell + offset
+                    if not cells[neighbor]:
+                        rhs = min(rhs, g.get(neighbor, INF) + 1)
+            self._rhs[cell] = rhs
+        self._open.pop(cell, None)
+        if self._g.get(cell, INF) != self._rhs.get(cell, INF):
+            self._push(cell)
+
+    def _compute(self):
+        heap, open_, g, rhs = self._heap, self._open, self._g, self._rhs
+        offsets = self.map.offsets
+        start = self.start
+        while heap:
+            key, cell = heap[0]
+            if open_.get(cell) != key:
+                heapq.heappop(heap)  # superseded entry
+                continue
+            if key >= self._key(start) and rhs.get(start, INF) == g.get(start, INF):
+                break
+            heapq.heappop(heap)
+            del open_[cell]
+            self.expanded += 1
+            new_key = self._key(cell)
+            if key < new_key:
+                self._push(cell)
+            elif g.get(cell, INF) > rhs.get(cell, INF):
+                g[cell] = rhs[cell]
+                for offset in offsets:
+                    self._update(cell + offset)
+            else:
+                g[cell] = INF
+                self._update(cell)
+                for offset in offsets:
+                    self._update(cell + offset)
+
+    def cell_changed(self, i):
+        self._pending.append(i)
+
+    def move_to(self, cell):
+        if cell != self.start:
+            old = self.start
+            self.start = cell
+            if self.map.cells[old]:
+                self._pending.append(old)  # no longer the start, so no longer leavable
+            if self.map.cells[cell]:
+                self._pending.append(cell)
+
+    # Shortest path from the current start to the goal as flat cell ids, or None
+    def path(self):
+        map = self.map
+        if self.start != self.goal and not search.reachable(map, self.start, self.goal):
+            return None
+        if self._pending or self._last != self.start:
+            self._km += self._h(self._last, self.start)
+            self._last = self.start
+            changed = set()
+            for cell in self._pending:
+                changed.add(cell)
+                changed.update(cell + offset for offset in map.offsets)
+            self._pending = []
+            for cell in changed:
+                self._update(cell)
+        self._compute()
+        g, cells, offsets = self._g, map.cells, map.offsets
+        current = self.start
+        if g.get(current, INF) == INF and current != self.goal:
+            return None
+        path = [current]
+        while current != self.goal:
+            best, best_g = None, INF
+            for offset in offsets:
+                neighbor = current + offset
+                if not cells[neighbor] and g.get(neighbor, INF) < best_g:
+                    best, best_g = neighbor, g[neighbor]
+            if best is None or len(path) > len(cells):
+                return None
+            current = best
+            path.append(current)
+        return path
+
+# A picker's route through its remaining waypoints, one D* Lite per leg. The
+# visiting order is fixed when the session starts, solved here unless the
+# caller already has it (waypoints: the targets in visiting order, then the
+# end); edits and moves only repair the legs.
+class RouteSession:
+    def __init__(self, map, start, targets, end, time_budget=route.DEFAULT_TIME_BUDGET, waypoints=None):
+        self.map = map
+        if waypoints is None:
+            with map.lock.reading():
+                waypoints = route.visit_order(map, start, targets, end, time_budget)[1:]
+        self.position = start
+        self.waypoints = list(waypoints)
+        self.used = time.monotonic()  # last move or path asked for
+        self._legs = []
+        self._lock = threading.Lock()
+        with map.lock.writing():
+            map.listeners.append(self.cell_changed)
+
+    def cell_changed(self, i):
+        with self._lock:
+            for leg in self._legs:
+                leg.cell_changed(i)
+
+    def _leg(self, k):
+        # Legs are planned on first use: leg 0 leaves from the picker, leg k from waypoint k-1
+        legs = self._legs
+        while len(legs) <= k:
+            n = len(legs)
+            start = self.position if n == 0 else self.waypoints[n - 1]
+            legs.append(DStarLite(self.map, self.map.cell_id(*start), self.map.cell_id(*self.waypoints[n])))
+        return legs[k]
+
+    # The picker moved to (x, y); reached waypoints are dropped
+    def move_to(self, position):
+        with self._lock:
+            self.used = time.monotonic()
+            self.position = position
+            while self.waypoints and position == self.waypoints[0]:
+                self.waypoints.pop(0)
+                if self._legs:
+                    self._legs.pop(0)
+            if self._legs:
+                self._legs[0].move_to(self.map.cell_id(*position))
+
+    # Remaining route from the picker's position, cell by cell, or None when a
+    # waypoint can't be reached any more
+    def path(self):
+        # The map lock is taken first: edits call cell_changed under it
+        with self.map.lock.reading(), self._lock:
+            self.used = time.monotonic()
+            path = [self.map.cell_id(*self.position)]
+            for k in range(len(self.waypoints)):
+                leg = self._leg(k).path()
+                if leg is None:
+                    return None
+                path.extend(leg[1:])
+        cell_xy = self.map.cell_xy
+        return [cell_xy(i) for i in path]
+
+    def close(self):
+        with self.map.lock.writing():
+            if self.cell_changed in self.map.listeners:
+                self.map.listeners.remove(self.cell_changed)
@@ -0,0 +1,228 @@
+import time
+from array import array
+import metrics
+import path_cache
+import search
+
+# Pick-order optimization for a route start -> every target -> end, using true
+# walking distances. One breadth-first search per location gives its row of the
+# distance matrix (and the legs to the locations after it), the visiting order
+# is solved exactly with Held-Karp for short pick lists and with nearest
+# neighbor + 2-opt/Or-opt within a time budget for long ones.
+
+# Pick lists up to this many targets are solved exactly
+HELD_KARP_MAX = 10
+# Seconds the local search may spend improving a long pick list
+DEFAULT_TIME_BUDGET = 0.5
+
+# reason is 'out of bounds', 'blocked' (an obstacle or a shelf without the
+# robot being next to it) or 'unreachable' (walled off from the start)
+class Unreachable(Exception):
+    def __init__(self, cell, reason='unreachable'):
+        messages = {'out of bounds': f"Location {cell} is outside the map",
+                    'blocked': f"Location {cell} is blocked",
+                    'unreachable': f"Location {cell} can't be reached"}
+        super().__init__(messages.get(reason, f"Location {cell} can't be reached"))
+        self.cell = cell
+        self.reason = reason
+
+# Raises Unreachable for the first location the route can't get to, from the
+# component labels, so an impossible pick list is refused without any search
+def check_targets(map, start, targets, end):
+    start_id = map.cell_id_or_none(*start)
+    if start_id is None:
+        raise Unreachable(start, 'out of bounds')
+    for cell in list(targets) + [end]:
+        i = map.cell_id_or_none(*cell)
+        if i is None:
+            raise Unreachable(cell, 'out of bounds')
+        if i == start_id:
+            continue
+        if map.cells[i]:
+            raise Unreachable(cell, 'blocked')
+        if not search.reachable(map, start_id, i):
+            raise Unreachable(cell, 'unreachable')
+
+# Distance matrix between the given flat cell ids and the legs between them:
+# legs[(i, j)] with i < j is the path from locations[i] to locations[j]. Legs
+# found in the path cache are not searched again.
+def distance_matrix(map, locations):
+    n = len(locations)
+    dist = [[0] * n for _ in range(n)]
+    legs = {}
+    engine = search.engine_for(map)
+    cache = path_cache.cache
+    for i in range(n - 1):
+        source = locations[i]
+        missing = []
+        for j in range(i + 1, n):
+            use_cache = path_cache.cacheable(map, source, locations[j])
+            hit, path = cache.get(map, source, locations[j]) if use_cache else (False, None)
+            if not hit:
+                missing.append(j)
+            elif path is None:
+                raise Unreachable(map.cell_xy(locations[j]))
+            else:
+                legs[(i, j)] = array('i', path)
+        if missing:
+            found = engine.breadth_first(map, source, [locations[j] for j in missing])
+            metrics.SEARCHES.inc('bfs')
+            metrics.SEARCH_EXPANDED.inc('bfs', amount=engine.expanded)
+            for j in missing:
+                target = locations[j]
+                use_cache = path_cache.cacheable(map, source, target)
+                if target not in found:
+                    if use_cache:
+                        cache.put(map, source, target, None)
+                    raise Unreachable(map.cell_xy(target))
+                legs[(i, j)] = array('i', engine.path_to(target))
+                if use_cache:
+                    cache.put(map, source, target, legs[(i, j)])
+        for j in range(i + 1, n):
+            dist[i][j] = dist[j][i] = len(legs[(i, j)]) - 1
+    return dist, legs
+
+def route_length(order, dist):
+    return sum(dist[a][b] for a, b in zip(order, order[1:]))
+
+# Exact order of the open path 0 -> (1 .. n-2 in any order) -> n-1
+def held_karp(dist):
+    n = len(dist)
+    m = n - 2
+    if m <= 0:
+        return list(range(n))
+    full = (1 << m) - 1
+    inf = float('inf')
+    # cost[mask][k]: shortest path from 0 through the targets in mask ending at target k
+    cost = [[inf] * m for _ in range(1 << m)]
+    back = [[-1] * m for _ in range(1 << m)]
+    for k in range(m):
+        cost[1 << k][k] = dist[0][k + 1]
+    for mask in range(1, full + 1):
+        row = cost[mask]
+        for k in range(m):
+            base = row[k]
+            if base == inf or not mask & (1 << k):
+                continue
+            dk = dist[k + 1]
+            for nxt in range(m):
+                bit = 1 << nxt
+                if mask & bit:
+                    continue
+                new_cost = base + dk[nxt + 1]
+                if new_cost < cost[mask | bit][nxt]:
+                    cost[mask | bit][nxt] = new_cost
+                    back[mask | bit][nxt] = k
+    last = min(range(m), key=lambda k: cost[full][k] + dist[k + 1][n - 1])
+    order = []
+    mask = full
+    while last != -1:
+        order.append(last + 1)
+        last, mask = back[mask][last], mask & ~(1 << last)
+    order.reverse()
+    return [0] + order + [n - 1]
+
+def nearest_neighbor(dist):
+    n = len(dist)
+    order = [0]
+    remaining = set(range(1, n - 1))
+    while remaining:
+        row = dist[order[-1]]
+        nxt = min(remaining, key=lambda i: (row[i], i))
+        order.append(nxt)
+        remaining.remove(nxt)
+    order.append(n - 1)
+    return order
+
+# 2-opt and Or-opt moves on the inner part of the order (the ends stay fixed)
+# until no move improves it or the deadline passes
+def improve(order, dist, deadline):
+    order = list(order)
+    n = len(order)
+    improved = True
+    while improved and time.monotonic() < deadline:
+        improved = False
+        # 2-opt: reverse order[i..k]
+        for i in range(1, n - 2):
+            a, b = order[i - 1], order[i]
+            for k in range(i + 1, n - 1):
+                c, d = order[k], order[k + 1]
+                if dist[a][c] + dist[b][d] < dist[a][b] + dist[c][d]:
+                    order[i:k + 1] = reversed(order[i:k + 1])
+                    b = order[i]
+                    improved = True
+            if time.monotonic() >= deadline:
+                return order
+        # Or-opt: move a run of 1 to 3 targets elsewhere, possibly reversed
+        for length in (1, 2, 3):
+            i = 1
+            while i + length < n:
+                seg = order[i:i + length]
+                prev, nxt = order[i - 1], order[i + length]
+                removed = dist[prev][seg[0]] + dist[seg[-1]][nxt] - dist[prev][nxt]
+                rest = order[:i] + order[i + length:]
+                best, best_gain = None, 0
+                for j in range(len(rest) - 1):
+                    p, q = rest[j], rest[j + 1]
+                    for cand in (seg, seg[::-1]):
+                        gain = removed - (dist[p][cand[0]] + dist[cand[-1]][q] - dist[p][q])
+                        if gain > best_gain:
+                            best, best_gain = (j, cand), gain
+                if best is not None:
+                    j, cand = best
+                    order = rest[:j + 1] + cand + rest[j + 1:]
+                    improved = True
+                i += 1
+            if time.monotonic() >= deadline:
+                return order
+    return order
+
+# Visiting order (indices into dist) of the open path from the first location
+# to the last one
+def solve_order(dist, time_budget=DEFAULT_TIME_BUDGET):
+    if len(dist) - 2 <= HELD_KARP_MAX:
+        return held_karp(dist)
+    deadline = time.monotonic() + time_budget
+    return improve(nearest_neighbor(dist), dist, deadline)
+
+# start, the targets and end in visiting order
+def visit_order(map, start, targets, end, time_budget=DEFAULT_TIME_BUDGET):
+    check_targets(map, start, targets, end)
+    cells = [start] + [cell for cell in targets if cell != start] + [end]
+    dist, _ = distance_matrix(map, [map.cell_id(*cell) for cell in cells])
+    return [cells[k] for k in solve_order(dist, time_budget)]
+
+# Visiting order of a route planned by plan_route: the targets in the order
+# the path first reaches them, then the end
+def order_along(path, targets, end):
+    first = {}
+    for k, cell in enumerate(path):
+        first.setdefault(cell, k)
+    return sorted(targets, key=first.__getitem__) + [end]
+
+# Shortest tour from start through every target to end, cell by cell. Legs are
+# taken from the breadth-first trees, or searched again with `algorithm` when
+# one is given. Raises Unreachable for a location that can't be reached.
+def plan_route(map, start, targets, end, time_budget=DEFAULT_TIME_BUDGET, algorithm=None):
+    check_targets(map, start, targets, end)
+    # A target on the start is visited before leaving, even a blocked start
+    # that the route couldn't come back to
+    cells = [start] + [cell for cell in targets if cell != start] + [end]
+    locations = [map.cell_id(*cell) for cell in cells]
+    dist, legs = distance_matrix(map, locations)
+    order = solve_order(dist, time_budget)
+
+    path = [locations[order[0]]]
+    for a, b in zip(order, order[1:]):
+        if algorithm is not None:
+            leg = search.find_path(map, cells[a], cells[b], algorithm=algorithm)
+            if leg is None:
+                raise Unreachable(cells[b])
+            path.extend(map.cell_id(*cell) for cell in leg[1:])
+        elif a < b:
+            path.extend(legs[(a, b)][1:])
+        else:
+            leg = legs[(b, a)]
+            path.extend(leg[i] for i in range(len(leg) - 2, -1, -1))
+    cell_xy = map.cell_xy
+    return [cell_xy(i) for i in path]
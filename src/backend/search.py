@@ -0,0 +1,312 @@
+import heapq
+import threading
+import weakref
+from array import array
+from collections import deque
+import components
+import hpa
+import metrics
+import path_cache
+
+# A* on the flat cell ids of a Map occupancy grid. The parent/g-score arrays are
+# allocated once per map and thread and reused across searches: every search
+# gets a new generation number and an entry is only valid if its stamp matches,
+# so nothing has to be cleared between searches.
+
+MAX_GENERATION = 0xFFFFFFFF
+
+class SearchEngine:
+    def __init__(self, size):
+        self.size = size
+        self.parent = array('i', [0]) * self.size
+        self.g = array('i', [0]) * self.size
+        self.seen = array('I', [0]) * self.size  # generation of the g/parent entry
+        self.closed = array('I', [0]) * self.size  # generation the cell was expanded in
+        self.generation = 0
+        # Counters of the last search
+        self.expanded = 0
+        self.pushes = 0
+
+    def _next_generation(self):
+        self.generation += 1
+        if self.generation > MAX_GENERATION:
+            self.seen = array('I', [0]) * self.size
+            self.closed = array('I', [0]) * self.size
+            self.generation = 1
+        return self.generation
+
+    def path_to(self, cell):
+        path = []
+        parent = self.parent
+        while cell != -1:
+            path.append(cell)
+            cell = parent[cell]
+        path.reverse()
+        return path
+
+    # Shortest path between two flat cell ids, as a list of ids, or None.
+    # By default ties go to the smallest cell id, like the original astar, and
+    # the returned path is cell-for-cell the same. With tie_break_toward_goal,
+    # entries with the same f are expanded deepest first (smallest h), which
+    # avoids exploring whole plateaus on open floors; the path has the same
+    # length but may take other cells.
+    def search(self, map, start, goal, tie_break_toward_goal=False):
+        self.expanded = 0
+        self.pushes = 0
+        gen = self._next_generation()
+        cells = map.cells
+        stride = map.stride
+        offsets = map.offsets
+        parent, g, seen, closed = self.parent, self.g, self.seen, self.closed
+        n = self.size
+        # Heap keys pack (f, h, id) or (f, id) into one int so no tuples are built
+        h_mul = n if tie_break_toward_goal else 0
+        f_mul = (map.width + map.height + 4) * n if tie_break_toward_goal else n
+
+        goal_x, goal_y = divmod(goal, stride)
+        start_x, start_y = divmod(start, stride)
+        h = abs(goal_x - start_x) + abs(goal_y - start_y)
+        seen[start] = gen
+        g[start] = 0
+        parent[start] = -1
+        heap = [h * f_mul + h * h_mul + start]
+        heappush, heappop = heapq.heappush, heapq.heappop
+        expanded = pushes = 0
+
+        while heap:
+            current = heappop(heap) % n
+            if closed[current] == gen:
+                continue
+            closed[current] = gen
+            expanded += 1
+            if current == goal:
+                self.expanded, self.pushes = expanded, pushes + 1
+                return self.path_to(current)
+
+            new_cost = g[current] + 1
+            x, y = divmod(current, stride)
+            h = abs(goal_x - x) + abs(goal_y - y)
+            # h of each neighbor, in the order of map.offsets (y+1, x+1, y-1, x-1)
+            hs = (h - 1 if y < goal_y else h + 1,
+                  h - 1 if x < goal_x else h + 1,
+                  h - 1 if y > goal_y else h + 1,
+                  h - 1 if x > goal_x else h + 1)
+            for offset, nh in zip(offsets, hs):
+                neighbor = current + offset
+                if cells[neighbor] or closed[neighbor] == gen:
+                    continue
+                if seen[neighbor] != gen or new_cost < g[neighbor]:
+                    seen[neighbor] = gen
+                    g[neighbor] = new_cost
+                    parent[neighbor] = current
+                    heappush(heap, (new_cost + nh) * f_mul + nh * h_mul + neighbor)
+                    pushes += 1
+
+        self.expanded, self.pushes = expanded, pushes + 1
+        return None
+
+    # Breadth-first search from source until every cell id in targets has been
+    # reached or the whole component is explored. Returns {target: distance}
+    # for the targets reached; path_to(target) gives their path until the next
+    # search on this engine.
+    def breadth_first(self, map, source, targets):
+        self.expanded = 0
+        self.pushes = 0
+        gen = self._next_generation()
+        cells = map.cells
+        offsets = map.offsets
+        parent, g, seen = self.parent, self.g, self.seen
+        remaining = set(targets)
+        found = {}
+        seen[source] = gen
+        g[source] = 0
+        parent[source] = -1
+        queue = deque([source])
+        expanded = 0
+        while queue and remaining:
+            current = queue.popleft()
+            expanded += 1
+            if current in remaining:
+                remaining.discard(current)
+                found[current] = g[current]
+            new_cost = g[current] + 1
+            for offset in offsets:
+                neighbor = current + offset
+                if cells[neighbor] or seen[neighbor] == gen:
+                    continue
+                seen[neighbor] = gen
+                g[neighbor] = new_cost
+                parent[neighbor] = current
+                queue.append(neighbor)
+        self.expanded = expanded
+        return found
+
+    # Jump Point Search for 4-connected uniform-cost grids. Rows are scanned
+    # along y (offset +-1) and stop at forced neighbors, every step of a scan
+    # along x (offset +-stride) also scans the row both ways. Only jump points
+    # are pushed on the heap, the returned path is expanded cell by cell.
+    def jump_point_search(self, map, start, goal, tie_break_toward_goal=False):
+        self.expanded = 0
+        self.pushes = 0
+        gen = self._next_generation()
+        cells = map.cells
+        stride = map.stride
+        parent, g, seen, closed = self.parent, self.g, self.seen, self.closed
+        n = self.size
+        h_mul = n if tie_break_toward_goal else 0
+        f_mul = (map.width + map.height + 4) * n if tie_break_toward_goal else n
+
+        goal_x, goal_y = divmod(goal, stride)
+
+        def estimate(cell):
+            x, y = divmod(cell, stride)
+            return abs(goal_x - x) + abs(goal_y - y)
+
+        def jump_y(cell, d):
+            while True:
+                cell += d
+                if cells[cell]:
+                    return -1
+                if cell == goal:
+                    return cell
+                if ((not cells[cell + stride] and cells[cell + stride - d])
+                        or (not cells[cell - stride] and cells[cell - stride - d])):
+                    return cell
+
+        def jump_x(cell, d):
+            while True:
+                cell += d
+                if cells[cell]:
+                    return -1
+                if cell == goal or jump_y(cell, 1) != -1 or jump_y(cell, -1) != -1:
+                    return cell
+
+        h = estimate(start)
+        seen[start] = gen
+        g[start] = 0
+        parent[start] = -1
+        heap = [h * f_mul + h * h_mul + start]
+        heappush, heappop = heapq.heappush, heapq.heappop
+        expanded = pushes = 0
+
+        while heap:
+            current = heappop(heap) % n
+            if closed[current] == gen:
+                continue
+            closed[current] = gen
+            expanded += 1
+            if current == goal:
+                self.expanded, self.pushes = expanded, pushes + 1
+                return self._expand_jumps(self.path_to(current), stride)
+
+            came_from = parent[current]
+            if came_from == -1:
+                successors = (jump_y(current, 1), jump_y(current, -1),
+                              jump_x(current, stride), jump_x(current, -stride))
+            elif abs(current - came_from) < stride:
+                d = 1 if current > came_from else -1
+                successors = [jump_y(current, d)]
+                for e in (stride, -stride):
+                    if not cells[current + e] and cells[current + e - d]:
+                        successors.append(jump_x(current, e))
+            else:
+                d = stride if current > came_from else -stride
+                successors = (jump_x(current, d), jump_y(current, 1), jump_y(current, -1))
+
+            for jump in successors:
+                if jump == -1 or closed[jump] == gen:
+                    continue
+                diff = abs(jump - current)
+                new_cost = g[current] + (diff if diff < stride else diff // stride)
+                if seen[jump] != gen or new_cost < g[jump]:
+                    seen[jump] = gen
+                    g[jump] = new_cost
+                    parent[jump] = current
+                    h = estimate(jump)
+                    heappush(heap, (new_cost + h) * f_mul + h * h_mul + jump)
+                    pushes += 1
+
+        self.expanded, self.pushes = expanded, pushes + 1
+        return None
+
+    # Fill in the straight segments between consecutive jump points
+    def _expand_jumps(self, jumps, stride):
+        path = [jumps[0]]
+        for a, b in zip(jumps, jumps[1:]):
+            if abs(b - a) < stride:
+                step = 1 if b > a else -1
+            else:
+                step = stride if b > a else -stride
+            path.extend(range(a + step, b + step, step))
+        return path
+
+_local = threading.local()
+
+# Search engine of the calling thread for the given map, buffers are rebuilt
+# only when the map grid changes size
+def engine_for(map):
+    engines = getattr(_local, 'engines', None)
+    if engines is None:
+        engines = _local.engines = weakref.WeakKeyDictionary()
+    engine = engines.get(map)
+    if engine is None or engine.size != len(map.cells):
+        engine = engines[map] = SearchEngine(len(map.cells))
+    return engine
+
+# Whether goal can be reached from start (flat cell ids), answered from the
+# component labels without searching. A blocked goal is never entered, a
+# blocked start may still leave to any free neighbor.
+def reachable(map, start, goal):
+    if map.cells[goal]:
+        return False
+    index = components.components_for(map)
+    if not map.cells[start]:
+        return index.connected(start, goal)
+    return any(index.connected(start + offset, goal) for offset in map.offsets)
+
+ALGORITHMS = ('astar', 'jps', 'hpa')
+
+# Shortest path between two (x, y) cells of the map, or None. algorithm is
+# 'astar' or 'jps', both return the path cell by cell with the same length, or
+# 'hpa' for a near-optimal path from the map hierarchy (see hpa.py). Optimal
+# paths go through the shared path cache unless use_cache is False. Goals in
+# another component return None at once instead of flooding the map. Ties are
+# broken like the original astar unless tie_break_toward_goal is set; those
+# paths bypass the cache so it only holds the default ones.
+def find_path(map, start, goal, tie_break_toward_goal=False, algorithm='astar', use_cache=True):
+    if algorithm not in ALGORITHMS:
+        raise ValueError(f"Unknown algorithm '{algorithm}', expected one of {ALGORITHMS}")
+    start_id = map.cell_id_or_none(*start)
+    goal_id = map.cell_id_or_none(*goal)
+    if start_id is None or goal_id is None:
+        return None
+    if start_id != goal_id and not reachable(map, start_id, goal_id):
+        return None
+    if algorithm == 'hpa':
+        metrics.SEARCHES.inc(algorithm)
+        with metrics.SEARCH_SECONDS.time(algorithm):
+            path = hpa.hierarchy_for(map).find_path(start, goal)
+        if path is not None:
+            metrics.PATH_CELLS.observe(len(path), 'path')
+        return path
+    hit = False
+    use_cache = use_cache and not tie_break_toward_goal and path_cache.cacheable(map, start_id, goal_id)
+    if use_cache:
+        hit, path = path_cache.cache.get(map, start_id, goal_id)
+    if not hit:
+        engine = engine_for(map)
+        with metrics.SEARCH_SECONDS.time(algorithm):
+            if algorithm == 'jps':
+                path = engine.jump_point_search(map, start_id, goal_id, tie_break_toward_goal)
+            else:
+                path = engine.search(map, start_id, goal_id, tie_break_toward_goal)
+        metrics.SEARCHES.inc(algorithm)
+        metrics.SEARCH_EXPANDED.inc(algorithm, amount=engine.expanded)
+        metrics.SEARCH_PUSHES.inc(algorithm, amount=engine.pushes)
+        if use_cache:
+            path_cache.cache.put(map, start_id, goal_id, path)
+    if path is None:
+        return None
+    metrics.PATH_CELLS.observe(len(path), 'path')
+    cell_xy = map.cell_xy
+    return [cell_xy(i) for i in path]
@@ -1,295 +1,280 @@
-import psycopg2
-import map
-
-# Function to load database credentials from a file
-def load_db_credentials(file_path):
-    with open(file_path, 'r') as file:
-        line = file.readline().strip()
-        credentials = line.split(',')
-        return {
-            'dbname': credentials[0],
-            'user': credentials[1],
-            'password': credentials[2],
-            'host': credentials[3],
-            'port': credentials[4]
-        }
-
-# Load credentials from db_credentials.txt
-conn_params = load_db_credentials('db_credentials.txt')
-
-def create_tables():
-    conn_params = load_db_credentials('db_credentials.txt')
-    # Connect to your PostgreSQL database
-    conn = psycopg2.connect(**conn_params)
-    cur = conn.cursor()
-    # Check if the "maps" table exists
-    cur.execute("""
-        SELECT EXISTS (
-            SELECT FROM information_schema.tables 
-            WHERE table_name = 'maps'
-        );
-    """)
-    maps_exists = cur.fetchone()[0]
-    # Check if the "obstacles" table exists
-    cur.execute("""
-        SELECT EXISTS (
-            SELECT FROM information_schema.tables 
-            WHERE table_name = 'obstacles'
-        );
-    """)
-    obstacles_exists = cur.fetchone()[0]
-    # Check if the "shelves" table exists
-    cur.execute("""
-        SELECT EXISTS (
-            SELECT FROM information_schema.tables 
-            WHERE table_name = 'shelves'
-        );
-    """)
-    shelves_exists = cur.fetchone()[0]
-    # Create the "maps" table if it doesn't exist
-    if not maps_exists:
-        cur.execute("""
-            CREATE TABLE maps (
-                map_id SERIAL PRIMARY KEY,
-                width INT NOT NULL,
-                height INT NOT NULL,
-                label VARCHAR(255)
-            );
-        """)
-        print("Table 'maps' created successfully.")
-    # Create the "obstacles" table if it doesn't exist
-    if not obstacles_exists:
-        cur.execute("""
-            CREATE TABLE obstacles (
-                obstacle_id SERIAL PRIMARY KEY,
-                map_id INT REFERENCES maps(map_id) ON DELETE CASCADE,
-                x INT NOT NULL,
-                y INT NOT NULL,
-                UNIQUE(map_id, x, y)
-            );
-        """)
-        print("Table 'obstacles' created successfully.")
-    # Create the "shelves" table if it doesn't exist
-    if not shelves_exists:
-        cur.execute("""
-            CREATE TABLE shelves (
-                shelf_id SERIAL PRIMARY KEY,
-                map_id INT REFERENCES maps(map_id) ON DELETE CASCADE,
-                x INT NOT NULL,
-                y INT NOT NULL,
-                flower VARCHAR(100),
-                color VARCHAR(50),
-                quantity INT NOT NULL,
-                UNIQUE(map_id, x, y),
-                CONSTRAINT fk_obstacle FOREIGN KEY (map_id, x, y)
-                REFERENCES obstacles(map_id, x, y) ON DELETE CASCADE
-            );
-        """)
-        print("Table 'shelves' created successfully.")
-
-    # Commit the transaction and close the connection
-    conn.commit()
-    cur.close()
-    conn.close()
-
-# Function to create a new map
-def create_map(width, height, label=None):
-    try:
-        conn = psycopg2.connect(**conn_params)
-        cur = conn.cursor()
-        cur.execute(
-            "INSERT INTO maps (width, height, label) VALUES (%s, %s, %s) RETURNING map_id",
-            (width, height, label)
-        )
-        map_id = cur.fetchone()[0]
-        conn.commit()
-        print(f"Map created with ID: {map_id}")
-        return map_id
-    except Exception as e:
-        print(f"An error occurred: {e}")
-    finally:
-        cur.close()
-        conn.close()
-
-# Function to delete a map
-def delete_map(map_id):
-    try:
-        conn = psycopg2.connect(**conn_params)
-        cur = conn.cursor()
-        cur.execute("DELETE FROM maps WHERE map_id = %s", (map_id,))
-        conn.commit()
-        print(f"Map with ID {map_id} deleted")
-    except Exception as e:
-        print(f"An error occurred: {e}")
-    finally:
-        cur.close()
-        conn.close()
-
-# Function to add an obstacle
-def add_obstacle(map_id, x, y):
-    try:
-        conn = psycopg2.connect(**conn_params)
-        cur = conn.cursor()
-        cur.execute(
-            "INSERT INTO obstacles (map_id, x, y) VALUES (%s, %s, %s) ON CONFLICT DO NOTHING",
-            (map_id, x, y)
-        )
-        conn.commit()
-        print(f"Obstacle added at ({x}, {y}) on map {map_id}")
-    except Exception as e:
-        print(f"An error occurred: {e}")
-    finally:
-        cur.close()
-        conn.close()
-
-# Function to remove an obstacle
-def remove_obstacle(map_id, x, y):
-    try:
-        conn = psycopg2.connect(**conn_params)
-        cur = conn.cursor()
-        cur.execute(
-            "DELETE FROM obstacles WHERE map_id = %s AND x = %s AND y = %s",
-            (map_id, x, y)
-        )
-        conn.commit()
-        print(f"Obstacle removed from ({x}, {y}) on map {map_id}")
-    except Exception as e:
-        print(f"An error occurred: {e}")
-    finally:
-        cur.close()
-        conn.close()
-
-# Function to add a shelf
-def add_shelf(map_id, x, y, flower, color, quantity):
-    try:
-        conn = psycopg2.connect(**conn_params)
-        cur = conn.cursor()
-        # Add obstacle first
-        cur.execute(
-            "INSERT INTO obstacles (map_id, x, y) VALUES (%s, %s, %s) ON CONFLICT DO NOTHING",
-            (map_id, x, y)
-        )
-        # Add shelf
-        cur.execute(
-            '''
-            INSERT INTO shelves (map_id, x, y, flower, color, quantity)
-            VALUES (%s, %s, %s, %s, %s, %s)
-            ''',
-            (map_id, x, y, flower, color, quantity)
-        )
-        conn.commit()
-        print(f"Shelf added at ({x}, {y}) on map {map_id}")
-    except Exception as e:
-        print(f"An error occurred: {e}")
-    finally:
-        cur.close()
-        conn.close()
-
-# Function to remove a shelf
-def remove_shelf(map_id, x, y):
-    try:
-        conn = psycopg2.connect(**conn_params)
-        cur = conn.cursor()
-        cur.execute(
-            "DELETE FROM shelves WHERE map_id = %s AND x = %s AND y = %s",
-            (map_id, x, y)
-        )
-        # Also remove the obstacle
-        cur.execute(
-            "DELETE FROM obstacles WHERE map_id = %s AND x = %s AND y = %s",
-            (map_id, x, y)
-        )
-        conn.commit()
-        print(f"Shelf and obstacle removed from ({x}, {y}) on map {map_id}")
-    except Exception as e:
-        print(f"An error occurred: {e}")
-    finally:
-        cur.close()
-        conn.close()
-
-# Function to reset a map by deleting all obstacles and shelves
-def reset_map(map_id):
-    try:
-        conn = psycopg2.connect(**conn_params)
-        cur = conn.cursor()
-        
-        # Delete all shelves associated with the map
-        cur.execute("DELETE FROM shelves WHERE map_id = %s", (map_id,))
-        
-        # Delete all obstacles associated with the map
-        cur.execute("DELETE FROM obstacles WHERE map_id = %s", (map_id,))
-        
-        conn.commit()
-        print(f"Map with ID {map_id} has been reset (all obstacles and shelves deleted).")
-        
-    except Exception as e:
-        print(f"An error occurred: {e}")
-    finally:
-        cur.close()
-        conn.close()
-        
-# Function to query and verify operations
-def query_map(map_id):
-    try:
-        conn = psycopg2.connect(**conn_params)
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM maps WHERE map_id = %s", (map_id,))
-        map_data = cur.fetchone()
-        print(f"Map: {map_data}")
-    except Exception as e:
-        print(f"An error occurred: {e}")
-    finally:
-        cur.close()
-        conn.close()
-
-def query_obstacles(map_id):
-    try:
-        conn = psycopg2.connect(**conn_params)
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM obstacles WHERE map_id = %s", (map_id,))
-        obstacles = cur.fetchall()
-        print(f"Obstacles on map {map_id}: {obstacles}")
-    except Exception as e:
-        print(f"An error occurred: {e}")
-    finally:
-        cur.close()
-        conn.close()
-
-def query_shelves(map_id):
-    try:
-        conn = psycopg2.connect(**conn_params)
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM shelves WHERE map_id = %s", (map_id,))
-        shelves = cur.fetchall()
-        print(f"Shelves on map {map_id}: {shelves}")
-    except Exception as e:
-        print(f"An error occurred: {e}")
-    finally:
-        cur.close()
-        conn.close()
-
-# Example usage with verification
-if __name__ == "__main__":
-    create_tables()
-
-    # Create a new map
-    map_id = create_map(10, 15, 'Test Map')
-    query_map(map_id)
-
-    # Add obstacles
-    add_obstacle(map_id, 3, 4)
-    add_obstacle(map_id, 5, 6)
-    query_obstacles(map_id)
-
-    # Add a shelf
-    add_shelf(map_id, 7, 8, 'Rose', 'Red', 100)
-    query_shelves(map_id)
-
-    # Remove a shelf
-    remove_shelf(map_id, 7, 8)
-    query_shelves(map_id)
-    query_obstacles(map_id)
-
-    # Delete the map
-    delete_map(map_id)
-    query_map(map_id)
+import logging
+import os
+import threading
+from contextlib import contextmanager
+import map
+import metrics
+import storage
+
+log = logging.getLogger(__name__)
+
+# The storage backend (see storage.py), opened on first use: STORAGE_BACKEND
+# picks it, PostgreSQL by default
+_backend = None
+_backend_lock = threading.Lock()
+
+def backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = storage.open_storage(os.environ.get('STORAGE_BACKEND', 'postgres'))
+                log.info("Storage backend: %s", _backend.name)
+    return _backend
+
+# Function to switch to another backend, by name (options go to its
+# constructor) or as an opened Storage; the previous one is closed
+def use_storage(backend_or_name, **options):
+    global _backend
+    opened = backend_or_name
+    if isinstance(backend_or_name, str):
+        opened = storage.open_storage(backend_or_name, **options)
+    opened.create_tables()
+    with _backend_lock:
+        previous, _backend = _backend, opened
+    if previous is not None and previous is not opened:
+        previous.close()
+    log.info("Storage backend: %s", opened.name)
+    return opened
+
+# Function to change the connection pool at runtime (PostgreSQL only)
+def configure_pool(size=None, timeout=None, health_check_interval=None):
+    configure = getattr(backend(), 'configure_pool', None)
+    if configure is not None:
+        configure(size, timeout, health_check_interval)
+
+# Function to report the statistics of the backend (pool checkouts and wait
+# time for PostgreSQL, transactions and file size for SQLite), None until it
+# is opened
+def storage_stats():
+    return _backend.stats() if _backend is not None else None
+
+@metrics.db_call
+def create_tables():
+    for table in backend().create_tables() or ():
+        log.info("Table '%s' created successfully.", table)
+
+# Function to create a new map
+@metrics.db_call
+def create_map(width, height, label=None):
+    try:
+        map_id = backend().create_map(width, height, label)
+        log.info("Map created with ID: %s", map_id)
+        return map_id
+    except Exception as e:
+        metrics.DB_ERRORS.inc()
+        log.error("An error occurred: %s", e)
+
+# Function to delete a map
+@metrics.db_call
+def delete_map(map_id):
+    try:
+        backend().delete_map(map_id)
+        log.info("Map with ID %s deleted", map_id)
+    except Exception as e:
+        metrics.DB_ERRORS.inc()
+        log.error("An error occurred: %s", e)
+
+# Function to read the id and revision of a map by label or id, None if there is no such map.
+# Every write to the obstacles or shelves of a map bumps its revision in the
+# same transaction, so a map snapshot stamped with a revision (see snapshot.py)
+# is known to be current while the revision hasn't moved
+@metrics.db_call
+def map_revision(label=None, map_id=None):
+    try:
+        return backend().map_revision(label, map_id)
+    except Exception as e:
+        metrics.DB_ERRORS.inc()
+        log.error("An error occurred: %s", e)
+
+# Function to read a whole map: "with map_rows(label) as found:", found being
+# None or (map id, width, height, label, revision, rows) as for
+# Storage.map_rows. Errors are raised.
+@contextmanager
+def map_rows(label=None, map_id=None, batch_size=None):
+    try:
+        with backend().map_rows(label, map_id, batch_size) as found:
+            yield found
+    except Exception:
+        metrics.DB_ERRORS.inc()
+        raise
+
+# Function to add an obstacle
+@metrics.db_call
+def add_obstacle(map_id, x, y):
+    try:
+        backend().add_obstacle(map_id, x, y)
+        log.debug("Obstacle added at (%s, %s) on map %s", x, y, map_id)
+    except Exception as e:
+        metrics.DB_ERRORS.inc()
+        log.error("An error occurred: %s", e)
+
+# Function to remove an obstacle
+@metrics.db_call
+def remove_obstacle(map_id, x, y):
+    try:
+        backend().remove_obstacle(map_id, x, y)
+        log.debug("Obstacle removed from (%s, %s) on map %s", x, y, map_id)
+    except Exception as e:
+        metrics.DB_ERRORS.inc()
+        log.error("An error occurred: %s", e)
+
+# Function to add a shelf
+@metrics.db_call
+def add_shelf(map_id, x, y, flower, color, quantity):
+    try:
+        backend().add_shelf(map_id, x, y, flower, color, quantity)
+        log.debug("Shelf added at (%s, %s) on map %s", x, y, map_id)
+    except Exception as e:
+        metrics.DB_ERRORS.inc()
+        log.error("An error occurred: %s", e)
+
+# Function to remove a shelf
+@metrics.db_call
+def remove_shelf(map_id, x, y):
+    try:
+        backend().remove_shelf(map_id, x, y)
+        log.debug("Shelf and obstacle removed from (%s, %s) on map %s", x, y, map_id)
+    except Exception as e:
+        metrics.DB_ERRORS.inc()
+        log.error("An error occurred: %s", e)
+
+# Bulk versions of the functions above: every call writes all the cells in a
+# single transaction and is all-or-nothing. They return True on commit and
+# False if the whole batch was rolled back.
+
+# Function to add many obstacles, shelves on those cells become plain obstacles
+@metrics.db_call
+def add_obstacles_bulk(map_id, cells):
+    if not cells:
+        return True
+    try:
+        backend().add_obstacles_bulk(map_id, cells)
+        log.debug("%s obstacles added on map %s", len(cells), map_id)
+        return True
+    except Exception as e:
+        metrics.DB_ERRORS.inc()
+        log.error("An error occurred: %s", e)
+        return False
+
+# Function to remove many obstacles (shelves on those cells go with them)
+@metrics.db_call
+def remove_obstacles_bulk(map_id, cells):
+    if not cells:
+        return True
+    try:
+        backend().remove_obstacles_bulk(map_id, cells)
+        log.debug("%s obstacles removed from map %s", len(cells), map_id)
+        return True
+    except Exception as e:
+        metrics.DB_ERRORS.inc()
+        log.error("An error occurred: %s", e)
+        return False
+
+# Function to add many shelves, existing shelves on the same cells are overwritten
+@metrics.db_call
+def add_shelves_bulk(map_id, shelves):
+    if not shelves:
+        return True
+    try:
+        backend().add_shelves_bulk(map_id, shelves)
+        log.debug("%s shelves added on map %s", len(shelves), map_id)
+        return True
+    except Exception as e:
+        metrics.DB_ERRORS.inc()
+        log.error("An error occurred: %s", e)
+        return False
+
+# Function to remove many shelves together with their obstacles
+@metrics.db_call
+def remove_shelves_bulk(map_id, cells):
+    if not cells:
+        return True
+    try:
+        backend().remove_shelves_bulk(map_id, cells)
+        log.debug("%s shelves removed from map %s", len(cells), map_id)
+        return True
+    except Exception as e:
+        metrics.DB_ERRORS.inc()
+        log.error("An error occurred: %s", e)
+        return False
+
+# Apply the final state of many cells in one transaction, for the write-behind
+# queue. changes: [((x, y), state)] with state None (free), 'obstacle' or
+# ('shelf', flower, color, quantity)
+@metrics.db_call
+def apply_changes(map_id, changes):
+    try:
+        backend().apply_changes(map_id, changes)
+        log.debug("%s cell changes written on map %s", len(changes), map_id)
+        return True
+    except Exception as e:
+        metrics.DB_ERRORS.inc()
+        log.error("An error occurred: %s", e)
+        return False
+
+# Function to reset a map by deleting all obstacles and shelves
+@metrics.db_call
+def reset_map(map_id):
+    try:
+        backend().reset_map(map_id)
+        log.info("Map with ID %s has been reset (all obstacles and shelves deleted).", map_id)
+    except Exception as e:
+        metrics.DB_ERRORS.inc()
+        log.error("An error occurred: %s", e)
+
+# Function to query and verify operations
+@metrics.db_call
+def query_map(map_id):
+    try:
+        with backend().map_rows(map_id=map_id) as found:
+            log.info("Map: %s", found[:5] if found else None)
+    except Exception as e:
+        metrics.DB_ERRORS.inc()
+        log.error("An error occurred: %s", e)
+
+@metrics.db_call
+def query_obstacles(map_id):
+    try:
+        with backend().map_rows(map_id=map_id) as found:
+            obstacles = [row[:2] for row in found[5]] if found else []
+            log.info("Obstacles on map %s: %s", map_id, obstacles)
+    except Exception as e:
+        metrics.DB_ERRORS.inc()
+        log.error("An error occurred: %s", e)
+
+@metrics.db_call
+def query_shelves(map_id):
+    try:
+        with backend().map_rows(map_id=map_id) as found:
+            shelves = [row for row in found[5] if row[2] is not None] if found else []
+            log.info("Shelves on map %s: %s", map_id, shelves)
+    except Exception as e:
+        metrics.DB_ERRORS.inc()
+        log.error("An error occurred: %s", e)
+
+# Example usage with verification
+if __name__ == "__main__":
+    create_tables()
+
+    # Create a new map
+    map_id = create_map(10, 15, 'Test Map')
+    query_map(map_id)
+
+    # Add obstacles
+    add_obstacle(map_id, 3, 4)
+    add_obstacle(map_id, 5, 6)
+    query_obstacles(map_id)
+
+    # Add a shelf
+    add_shelf(map_id, 7, 8, 'Rose', 'Red', 100)
+    query_shelves(map_id)
+
+    # Remove a shelf
+    remove_shelf(map_id, 7, 8)
+    query_shelves(map_id)
+    query_obstacles(map_id)
+
+    # Delete the map
+    delete_map(map_id)
+    query_map(map_id)
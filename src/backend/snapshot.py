@@ -0,0 +1,234 @@
+import argparse
+import logging
+import mmap
+import os
+import struct
+import sys
+import time
+import zlib
+from map import Map, OBSTACLE, SHELF, get_map_data
+import persistence
+import server
+
+log = logging.getLogger(__name__)
+
+# Binary map snapshots for fast start-up. A snapshot file is laid out as
+#
+#   header     magic, format version, map id, database revision, width,
+#              height and the sizes of the sections below
+#   label      UTF-8
+#   strings    string pool of the flower and color names, each one a u16
+#              length and its UTF-8 bytes
+#   shelves    one (x, y, flower, color, quantity) record per shelf, the names
+#              as indexes in the string pool (NO_STRING for a missing name)
+#   bitmap     one bit per cell, set for obstacles and shelves, cell (x, y)
+#              being bit x * height + y, least significant bit first
+#   crc32      of everything before it
+#
+# all little-endian. The file is memory-mapped and decoded straight into the
+# grid. A snapshot is stamped with the database revision of the map and is
+# only used while the database still has that revision (see load_map).
+# Usage: python snapshot.py export <label> <file> [--map-id N]
+#        python snapshot.py import <file> [--label LABEL]
+
+MAGIC = b'WHMAPSNP'
+FORMAT_VERSION = 1
+NO_STRING = 0xFFFFFFFF
+HEADER = struct.Struct('<8sHHqqIIIII')  # magic, format, unused, map id, revision, width, height, label bytes, strings, shelves
+SHELF_RECORD = struct.Struct('<IIIIi')
+STRING_LENGTH = struct.Struct('<H')
+CRC = struct.Struct('<I')
+
+# Snapshots kept by load_map, one file per map id; off when not set
+SNAPSHOT_DIR = os.environ.get('MAP_SNAPSHOT_DIR')
+
+class SnapshotError(Exception):
+    pass
+
+# 8 cells of a row of 0/1 bytes <-> one bitmap byte
+_UNPACK = [bytes((value >> bit) & 1 for bit in range(8)) for value in range(256)]
+_PACK = {cells: value for value, cells in enumerate(_UNPACK)}
+_BLOCKED = bytes([0, 1, 1, 1]) + bytes(252)  # cell flag -> bit, walls never get there
+
+def _encode(map_instance):
+    width, height, stride, cells = map_instance.width, map_instance.height, map_instance.stride, map_instance.cells
+    bits = b''.join(cells[(x + 1) * stride + 1:(x + 1) * stride + 1 + height] for x in range(width)).translate(_BLOCKED)
+    bits += bytes(-len(bits) % 8)
+    bitmap = bytes(_PACK[bits[k:k + 8]] for k in range(0, len(bits), 8))
+    strings, index = [], {}
+    def string_id(name):
+        if name is None:
+            return NO_STRING
+        if name not in index:
+            index[name] = len(strings)
+            strings.append(name.encode('utf-8'))
+        return index[name]
+    shelves = b''.join(SHELF_RECORD.pack(x, y, string_id(info['flower']), string_id(info['color']), info['quantity'])
+                       for (x, y), info in map_instance.shelves.items())
+    pool = b''.join(STRING_LENGTH.pack(len(name)) + name for name in strings)
+    label = (map_instance.label or '').encode('utf-8')
+    data = b''.join([HEADER.pack(MAGIC, FORMAT_VERSION, 0, map_instance.id, map_instance.revision, width, height,
+                                 len(label), len(strings), len(map_instance.shelves)),
+                     label, pool, shelves, bitmap])
+    return data + CRC.pack(zlib.crc32(data))
+
+def _header(data):
+    if len(data) < HEADER.size:
+        raise SnapshotError("Snapshot is truncated")
+    magic, version, _, map_id, revision, width, height, label_size, string_count, shelf_count = HEADER.unpack_from(data)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise SnapshotError("Not a map snapshot of this version")
+    return map_id, revision, width, height, label_size, string_count, shelf_count
+
+def _decode(data):
+    map_id, revision, width, height, label_size, string_count, shelf_count = _header(data)
+    if len(data) < HEADER.size + CRC.size or zlib.crc32(data[:-CRC.size]) != CRC.unpack_from(data, len(data) - CRC.size)[0]:
+        raise SnapshotError("Snapshot is corrupted")
+    offset = HEADER.size
+    label = str(data[offset:offset + label_size], 'utf-8') or None
+    offset += label_size
+    strings = []
+    for _ in range(string_count):
+        size, = STRING_LENGTH.unpack_from(data, offset)
+        strings.append(str(data[offset + 2:offset + 2 + size], 'utf-8'))
+        offset += 2 + size
+    shelves_end = offset + shelf_count * SHELF_RECORD.size
+    shelf_records = SHELF_RECORD.iter_unpack(data[offset:shelves_end])
+    bitmap_size = (width * height + 7) // 8
+    if shelves_end + bitmap_size + CRC.size != len(data):
+        raise SnapshotError("Snapshot sections don't match its header")
+
+    map_instance = Map(width, height)
+    map_instance.id = map_id
+    map_instance.label = label
+    map_instance.revision = revision
+    bits = b''.join([_UNPACK[value] for value in data[shelves_end:shelves_end + bitmap_size]])
+    cells, stride = map_instance.cells, map_instance.stride
+    for x in range(width):
+        cells[(x + 1) * stride + 1:(x + 1) * stride + 1 + height] = bits[x * height:(x + 1) * height]
+    map_instance.blocked_count = bits.count(OBSTACLE, 0, width * height)
+    shelf_info, stock = map_instance._shelf_info, map_instance._stock
+    for x, y, flower, color, quantity in shelf_records:
+        cells[map_instance.cell_id(x, y)] = SHELF
+        info = shelf_info[(x, y)] = {'flower': None if flower == NO_STRING else strings[flower],
+                                     'color': None if color == NO_STRING else strings[color],
+                                     'quantity': quantity}
+        stock.add((x, y), info)
+    return map_instance
+
+# Write the map to a snapshot file, atomically. The stamp has to match the
+# content, so a map edited since it was loaded is read again from the database
+# (after the write-behind queue is flushed) and that copy is written.
+def save_snapshot(map_instance, path):
+    with map_instance.lock.reading():
+        data = _encode(map_instance) if map_instance.revision is not None and map_instance.version == 0 else None
+    if data is None:
+        persistence.flush()
+        fresh = Map.load(map_id=map_instance.id)
+        if fresh is None:
+            log.warning("Map %s is not in the database, no snapshot written", map_instance.id)
+            return False
+        data = _encode(fresh)
+    temp = path + '.tmp'
+    with open(temp, 'wb') as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp, path)
+    return True
+
+# Read a map from a snapshot file, without asking the database. Raises
+# SnapshotError if the file is not a valid snapshot.
+def load_snapshot(path):
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            raise SnapshotError("Snapshot is empty")
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            view = memoryview(data)
+            try:
+                return _decode(view)
+            finally:
+                view.release()
+
+# The (map id, revision) stamp of a snapshot, read from its header only
+def snapshot_stamp(path):
+    with open(path, 'rb') as file:
+        return _header(file.read(HEADER.size))[:2]
+
+def snapshot_path(map_id, directory=SNAPSHOT_DIR):
+    return os.path.join(directory, f"map_{map_id}.snap")
+
+# Load a map by label or id like get_map_data, from its snapshot when the
+# snapshot is current: the database is only asked for the map's revision. A
+# stale, missing or broken snapshot falls back to PostgreSQL and is rewritten.
+def load_map(label=None, map_id=None, directory=SNAPSHOT_DIR):
+    if directory is None:
+        return get_map_data(label, map_id=map_id)
+    began = time.perf_counter()
+    stamp = server.map_revision(label, map_id)
+    if stamp is None:
+        return get_map_data(label, map_id=map_id)
+    path = snapshot_path(stamp[0], directory)
+    try:
+        if os.path.exists(path) and snapshot_stamp(path) == tuple(stamp):
+            map_instance = load_snapshot(path)
+            map_instance.load_time = time.perf_counter() - began
+            log.info("Map %s loaded from %s in %.3fs", map_instance.id, path, map_instance.load_time)
+            return map_instance
+    except (OSError, SnapshotError) as e:
+        log.warning("Snapshot %s not used: %s", path, e)
+    map_instance = get_map_data(label, map_id=map_id)
+    if map_instance is not None:
+        try:
+            os.makedirs(directory, exist_ok=True)
+            save_snapshot(map_instance, path)
+        except OSError as e:
+            log.warning("Snapshot %s not written: %s", path, e)
+    return map_instance
+
+# Create a new map in the database from a snapshot file, in one transaction
+# for the cells. Returns the new map id, or None.
+def import_snapshot(path, label=None):
+    map_instance = load_snapshot(path)
+    label = label or map_instance.label
+    map_id = server.create_map(map_instance.width, map_instance.height, label)
+    if map_id is None:
+        return None
+    changes = [(cell, map_instance._cell_state(cell)) for cell in map_instance.obstacles]
+    if changes and not server.apply_changes(map_id, changes):
+        server.delete_map(map_id)
+        return None
+    return map_id
+
+def main():
+    parser = argparse.ArgumentParser(description="Export maps to snapshot files or import them")
+    commands = parser.add_subparsers(dest='command', required=True)
+    export = commands.add_parser('export')
+    export.add_argument('label', nargs='?')
+    export.add_argument('file')
+    export.add_argument('--map-id', type=int)
+    load = commands.add_parser('import')
+    load.add_argument('file')
+    load.add_argument('--label')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    if args.command == 'export':
+        if args.label is None and args.map_id is None:
+            parser.error("export needs a map label or --map-id")
+        map_instance = get_map_data(args.label, map_id=args.map_id)
+        if map_instance is None or not save_snapshot(map_instance, args.file):
+            sys.exit(1)
+        print(f"Map {map_instance.id} written to {args.file} ({os.path.getsize(args.file)} bytes)")
+    else:
+        try:
+            map_id = import_snapshot(args.file, args.label)
+        except (OSError, SnapshotError) as e:
+            print(f"An error occurred: {e}")
+            sys.exit(1)
+        if map_id is None:
+            sys.exit(1)
+        print(f"Map imported with ID {map_id}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+import abc
+import importlib
+import itertools
+import threading
+from contextlib import contextmanager
+
+# Storage backends for the maps, their obstacles and their shelves. server.py
+# calls the backend chosen with STORAGE_BACKEND:
+#
+#   postgres  PostgreSQL through a connection pool (storage_postgres.py), the
+#             credentials are read from db_credentials.txt when it is opened
+#   sqlite    an embedded SQLite file in WAL mode (storage_sqlite.py), for
+#             small on-site installations
+#   memory    the dicts below, gone with the process, for tests and benchmarks
+#
+# A backend subclasses Storage. Its methods raise on failure (server.py turns
+# that into the False/None answers and the log line) and every write is one
+# transaction that also bumps the revision of the map, which is what the
+# snapshot stamps compare (see snapshot.py). A cell state is None (free),
+# 'obstacle' or ('shelf', flower, color, quantity) as for apply_changes.
+
+# name -> (module, class), imported when the backend is opened
+BACKENDS = {
+    'postgres': ('storage_postgres', 'PostgresStorage'),
+    'sqlite': ('storage_sqlite', 'SQLiteStorage'),
+    'memory': ('storage', 'MemoryStorage'),
+}
+
+class Storage(abc.ABC):
+    name = None
+
+    def create_tables(self):
+        pass
+
+    # Returns the new map id
+    @abc.abstractmethod
+    def create_map(self, width, height, label=None):
+        pass
+
+    @abc.abstractmethod
+    def delete_map(self, map_id):
+        pass
+
+    # (map id, revision) of the map with the label (the oldest one) or map id, or None
+    @abc.abstractmethod
+    def map_revision(self, label=None, map_id=None):
+        pass
+
+    # Write the final state of many cells: [((x, y), state)]
+    @abc.abstractmethod
+    def apply_changes(self, map_id, changes):
+        pass
+
+    # Only the cells holding a shelf are freed
+    @abc.abstractmethod
+    def remove_shelves_bulk(self, map_id, cells):
+        pass
+
+    @abc.abstractmethod
+    def reset_map(self, map_id):
+        pass
+
+    # Context manager yielding None, or (map id, width, height, label,
+    # revision, rows) with the (x, y, flower, color, quantity) rows of the
+    # map's obstacles, the shelf fields being None for plain obstacles; rows
+    # are read while the context is open
+    @abc.abstractmethod
+    def map_rows(self, label=None, map_id=None, batch_size=None):
+        pass
+
+    # Shelves on the cells become plain obstacles
+    def add_obstacles_bulk(self, map_id, cells):
+        self.apply_changes(map_id, [(cell, 'obstacle') for cell in cells])
+
+    # Shelves on the cells go with them
+    def remove_obstacles_bulk(self, map_id, cells):
+        self.apply_changes(map_id, [(cell, None) for cell in cells])
+
+    # shelves: (x, y, flower, color, quantity), existing shelves are overwritten
+    def add_shelves_bulk(self, map_id, shelves):
+        self.apply_changes(map_id, [((x, y), ('shelf', flower, color, quantity))
+                                    for x, y, flower, color, quantity in shelves])
+
+    def add_obstacle(self, map_id, x, y):
+        self.add_obstacles_bulk(map_id, [(x, y)])
+
+    def remove_obstacle(self, map_id, x, y):
+        self.remove_obstacles_bulk(map_id, [(x, y)])
+
+    def add_shelf(self, map_id, x, y, flower, color, quantity):
+        self.add_shelves_bulk(map_id, [(x, y, flower, color, quantity)])
+
+    def remove_shelf(self, map_id, x, y):
+        self.remove_shelves_bulk(map_id, [(x, y)])
+
+    # Counters of the backend for /stats and /metrics
+    def stats(self):
+        return {}
+
+    def close(self):
+        pass
+
+def _cell(cell):
+    x, y = cell
+    if not isinstance(x, int) or not isinstance(y, int):
+        raise ValueError(f"Bad cell {cell!r}")
+    return (x, y)
+
+def _state(state):
+    if state is None or state == 'obstacle':
+        return state
+    if not isinstance(state, tuple) or len(state) != 4 or state[0] != 'shelf':
+        raise ValueError(f"Bad cell state {state!r}")
+    return state
+
+# Checked cells of a bulk write, a bad one raises ValueError before anything
+# is written
+def checked_cells(cells):
+    return [_cell(cell) for cell in cells]
+
+# Final state of every cell of a list of changes, a cell changed twice in one
+# call keeping its last state; raises ValueError for a bad cell or state
+# before anything is written
+def final_states(changes):
+    final = {}
+    for cell, state in changes:
+        final[_cell(cell)] = _state(state)
+    return list(final.items())
+
+class MemoryStorage(Storage):
+    name = 'memory'
+
+    def __init__(self):
+        self._maps = {}  # map id -> {'width', 'height', 'label', 'revision', 'cells': {(x, y): state}}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._stats = {'writes': 0}
+
+    def _stored(self, map_id):
+        stored = self._maps.get(map_id)
+        if stored is None:
+            raise KeyError(f"No map with ID {map_id}")
+        return stored
+
+    def create_map(self, width, height, label=None):
+        with self._lock:
+            map_id = next(self._ids)
+            self._maps[map_id] = {'width': width, 'height': height, 'label': label, 'revision': 0, 'cells': {}}
+        return map_id
+
+    def delete_map(self, map_id):
+        with self._lock:
+            self._maps.pop(map_id, None)
+
+    def map_revision(self, label=None, map_id=None):
+        with self._lock:
+            if map_id is not None:
+                stored = self._maps.get(map_id)
+                return (map_id, stored['revision']) if stored is not None else None
+            for key in sorted(self._maps):
+                if self._maps[key]['label'] == label:
+                    return (key, self._maps[key]['revision'])
+        return None
+
+    # Writes of one call are checked before anything changes, so a bad cell or
+    # state leaves the map as it was, like a rolled back transaction
+    def _apply(self, stored, changes):
+        cells = stored['cells']
+        for cell, state in changes:
+            if state is None:
+                cells.pop(cell, None)
+            else:
+                cells[cell] = state
+        stored['revision'] += 1
+        self._stats['writes'] += 1
+
+    def apply_changes(self, map_id, changes):
+        changes = final_states(changes)
+        with self._lock:
+            self._apply(self._stored(map_id), changes)
+
+    def remove_shelves_bulk(self, map_id, cells):
+        cells = checked_cells(cells)
+        with self._lock:
+            stored = self._stored(map_id)
+            shelves = [cell for cell in cells if isinstance(stored['cells'].get(cell), tuple)]
+            self._apply(stored, [(cell, None) for cell in shelves])
+
+    def reset_map(self, map_id):
+        with self._lock:
+            stored = self._stored(map_id)
+            stored['cells'] = {}
+            stored['revision'] += 1
+            self._stats['writes'] += 1
+
+    @contextmanager
+    def map_rows(self, label=None, map_id=None, batch_size=None):
+        found = self.map_revision(label, map_id)
+        if found is None:
+            yield None
+            return
+        with self._lock:
+            stored = self._maps[found[0]]
+            rows = [cell + (tuple(state[1:]) if isinstance(state, tuple) else (None, None, None))
+                    for cell, state in stored['cells'].items()]
+            header = (found[0], stored['width'], stored['height'], stored['label'], stored['revision'])
+        yield header + (rows,)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['maps'] = len(self._maps)
+            stats['cells'] = sum(len(stored['cells']) for stored in self._maps.values())
+        return stats
+
+# A new backend by name, options go to its constructor
+def open_storage(name, **options):
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown storage backend '{name}', expected one of {tuple(BACKENDS)}")
+    module, cls = BACKENDS[name]
+    return getattr(importlib.import_module(module), cls)(**options)
@@ -0,0 +1,473 @@
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+import psycopg2
+from psycopg2.extras import execute_values
+import storage
+
+# PostgreSQL storage backend (see storage.py), the original backend of the app:
+# tables maps, obstacles and shelves, the shelves referencing their obstacle
+# so that deleting an obstacle cascades to its shelf.
+
+# File with one line "dbname,user,password,host,port"
+DEFAULT_CREDENTIALS = os.environ.get('DB_CREDENTIALS', 'db_credentials.txt')
+
+# Function to load database credentials from a file
+def load_db_credentials(file_path):
+    with open(file_path, 'r') as file:
+        line = file.readline().strip()
+        credentials = line.split(',')
+        return {
+            'dbname': credentials[0],
+            'user': credentials[1],
+            'password': credentials[2],
+            'host': credentials[3],
+            'port': credentials[4]
+        }
+
+# Rows fetched per round-trip while reading a map
+FETCH_SIZE = 10000
+
+class PoolTimeout(Exception):
+    pass
+
+# Shared pool of PostgreSQL connections. A thread keeps the same connection for
+# nested checkouts, idle connections are health-checked before reuse and
+# broken ones are replaced by a fresh connection.
+class ConnectionPool:
+    def __init__(self, params, size=5, timeout=30.0, health_check_interval=30.0):
+        self.params = params
+        self.size = size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self._idle = []  # (connection, last time it was returned)
+        self._opened = 0
+        self._cond = threading.Condition()
+        self._local = threading.local()
+        self._stats = {
+            'checkouts': 0,
+            'wait_time': 0.0,
+            'max_wait_time': 0.0,
+            'connections_created': 0,
+            'reconnects': 0,
+            'health_checks': 0,
+            'discarded': 0
+        }
+
+    def _connect(self):
+        conn = psycopg2.connect(**self.params)
+        with self._cond:
+            self._stats['connections_created'] += 1
+        return conn
+
+    def _is_healthy(self, conn, last_used):
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.health_check_interval:
+            return True
+        with self._cond:
+            self._stats['health_checks'] += 1
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _close_quietly(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _acquire(self):
+        began = time.monotonic()
+        deadline = began + self.timeout
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    break
+                if self._opened < self.size:
+                    self._opened += 1
+                    conn, last_used = None, None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeout(f"No database connection available after {self.timeout}s")
+                self._cond.wait(remaining)
+            waited = time.monotonic() - began
+            self._stats['checkouts'] += 1
+            self._stats['wait_time'] += waited
+            self._stats['max_wait_time'] = max(self._stats['max_wait_time'], waited)
+        try:
+            if conn is None:
+                conn = self._connect()
+            elif not self._is_healthy(conn, last_used):
+                self._close_quietly(conn)
+                with self._cond:
+                    self._stats['reconnects'] += 1
+                conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._opened -= 1
+                self._cond.notify()
+            raise
+        return conn
+
+    def _release(self, conn, broken):
+        if not broken:
+            try:
+                conn.rollback()  # no-op unless a transaction was left open
+            except psycopg2.Error:
+                broken = True
+        with self._cond:
+            if broken or conn.closed:
+                self._opened -= 1
+                self._stats['discarded'] += 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+        if broken:
+            self._close_quietly(conn)
+
+    @contextmanager
+    def connection(self):
+        local = self._local
+        conn = getattr(local, 'conn', None)
+        if conn is not None:
+            # Nested checkout on the same thread shares the outer connection
+            yield conn
+            return
+        conn = self._acquire()
+        local.conn = conn
+        broken = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            local.conn = None
+            self._release(conn, broken)
+
+    def resize(self, size):
+        with self._cond:
+            self.size = size
+            while self._idle and self._opened > size:
+                conn, _ = self._idle.pop()
+                self._opened -= 1
+                self._close_quietly(conn)
+            self._cond.notify_all()
+
+    def close_all(self):
+        with self._cond:
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._opened -= 1
+                self._close_quietly(conn)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats['size'] = self.size
+            stats['opened'] = self._opened
+            stats['idle'] = len(self._idle)
+            stats['in_use'] = self._opened - len(self._idle)
+        stats['avg_wait_time'] = stats['wait_time'] / stats['checkouts'] if stats['checkouts'] else 0.0
+        return stats
+
+
+class PostgresStorage(storage.Storage):
+    name = 'postgres'
+
+    def __init__(self, credentials=DEFAULT_CREDENTIALS, pool_size=None):
+        size = pool_size if pool_size is not None else int(os.environ.get('DB_POOL_SIZE', 5))
+        self.pool = ConnectionPool(load_db_credentials(credentials), size=size)
+
+    # Every write to the obstacles or shelves of a map bumps its revision in the
+    # same transaction
+    def _bump_revision(self, cur, map_id):
+        cur.execute("UPDATE maps SET revision = revision + 1 WHERE map_id = %s", (map_id,))
+
+    def create_tables(self):
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            # Check which of the "maps", "obstacles" and "shelves" tables exist, in one round-trip
+            cur.execute("""
+                SELECT to_regclass('maps') IS NOT NULL,
+                       to_regclass('obstacles') IS NOT NULL,
+                       to_regclass('shelves') IS NOT NULL;
+            """)
+            maps_exists, obstacles_exists, shelves_exists = cur.fetchone()
+            # Create the "maps" table if it doesn't exist
+            if not maps_exists:
+                cur.execute("""
+                    CREATE TABLE maps (
+                        map_id SERIAL PRIMARY KEY,
+                        width INT NOT NULL,
+                        height INT NOT NULL,
+                        label VARCHAR(255),
+                        revision BIGINT NOT NULL DEFAULT 0
+                    );
+                """)
+            else:
+                # Maps created before the snapshot stamps
+                cur.execute("ALTER TABLE maps ADD COLUMN IF NOT EXISTS revision BIGINT NOT NULL DEFAULT 0;")
+            # Create the "obstacles" table if it doesn't exist
+            if not obstacles_exists:
+                cur.execute("""
+                    CREATE TABLE obstacles (
+                        obstacle_id SERIAL PRIMARY KEY,
+                        map_id INT REFERENCES maps(map_id) ON DELETE CASCADE,
+                        x INT NOT NULL,
+                        y INT NOT NULL,
+                        UNIQUE(map_id, x, y)
+                    );
+                """)
+            # Create the "shelves" table if it doesn't exist
+            if not shelves_exists:
+                cur.execute("""
+                    CREATE TABLE shelves (
+                        shelf_id SERIAL PRIMARY KEY,
+                        map_id INT REFERENCES maps(map_id) ON DELETE CASCADE,
+                        x INT NOT NULL,
+                        y INT NOT NULL,
+                        flower VARCHAR(100),
+                        color VARCHAR(50),
+                        quantity INT NOT NULL,
+                        UNIQUE(map_id, x, y),
+                        CONSTRAINT fk_obstacle FOREIGN KEY (map_id, x, y)
+                        REFERENCES obstacles(map_id, x, y) ON DELETE CASCADE
+                    );
+                """)
+            # Commit the transaction, the connection goes back to the pool
+            conn.commit()
+        return [table for table, exists in (('maps', maps_exists), ('obstacles', obstacles_exists),
+                                            ('shelves', shelves_exists)) if not exists]
+
+    def create_map(self, width, height, label=None):
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            cur.execute(
+                "INSERT INTO maps (width, height, label) VALUES (%s, %s, %s) RETURNING map_id",
+                (width, height, label)
+            )
+            map_id = cur.fetchone()[0]
+            conn.commit()
+            return map_id
+
+    def delete_map(self, map_id):
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            cur.execute("DELETE FROM maps WHERE map_id = %s", (map_id,))
+            conn.commit()
+
+    def map_revision(self, label=None, map_id=None):
+        column, key = ('map_id', map_id) if map_id is not None else ('label', label)
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            cur.execute(f"SELECT map_id, revision FROM maps WHERE {column} = %s ORDER BY map_id LIMIT 1", (key,))
+            return cur.fetchone()
+
+    def add_obstacle(self, map_id, x, y):
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            cur.execute(
+                "INSERT INTO obstacles (map_id, x, y) VALUES (%s, %s, %s) ON CONFLICT DO NOTHING",
+                (map_id, x, y)
+            )
+            self._bump_revision(cur, map_id)
+            conn.commit()
+
+    def remove_obstacle(self, map_id, x, y):
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            cur.execute(
+                "DELETE FROM obstacles WHERE map_id = %s AND x = %s AND y = %s",
+                (map_id, x, y)
+            )
+            self._bump_revision(cur, map_id)
+            conn.commit()
+
+    def add_shelf(self, map_id, x, y, flower, color, quantity):
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            # Add obstacle first
+            cur.execute(
+                "INSERT INTO obstacles (map_id, x, y) VALUES (%s, %s, %s) ON CONFLICT DO NOTHING",
+                (map_id, x, y)
+            )
+            # Add shelf, overwriting a shelf already on the cell like add_shelves_bulk
+            cur.execute(
+                '''
+                INSERT INTO shelves (map_id, x, y, flower, color, quantity)
+                VALUES (%s, %s, %s, %s, %s, %s)
+                ON CONFLICT (map_id, x, y) DO UPDATE
+                SET flower = EXCLUDED.flower, color = EXCLUDED.color, quantity = EXCLUDED.quantity
+                ''',
+                (map_id, x, y, flower, color, quantity)
+            )
+            self._bump_revision(cur, map_id)
+            conn.commit()
+
+    def remove_shelf(self, map_id, x, y):
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            cur.execute(
+                "DELETE FROM shelves WHERE map_id = %s AND x = %s AND y = %s",
+                (map_id, x, y)
+            )
+            # Also remove the obstacle
+            cur.execute(
+                "DELETE FROM obstacles WHERE map_id = %s AND x = %s AND y = %s",
+                (map_id, x, y)
+            )
+            self._bump_revision(cur, map_id)
+            conn.commit()
+
+    # The bulk writes use one multi-row statement per table
+    def add_obstacles_bulk(self, map_id, cells):
+        xs, ys = [x for x, _ in cells], [y for _, y in cells]
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            cur.execute(
+                "DELETE FROM shelves WHERE map_id = %s AND (x, y) IN (SELECT * FROM unnest(%s::int[], %s::int[]))",
+                (map_id, xs, ys)
+            )
+            execute_values(
+                cur,
+                "INSERT INTO obstacles (map_id, x, y) VALUES %s ON CONFLICT DO NOTHING",
+                [(map_id, x, y) for x, y in cells],
+                page_size=len(cells)
+            )
+            self._bump_revision(cur, map_id)
+            conn.commit()
+
+    def remove_obstacles_bulk(self, map_id, cells):
+        xs, ys = [x for x, _ in cells], [y for _, y in cells]
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            cur.execute(
+                "DELETE FROM obstacles WHERE map_id = %s AND (x, y) IN (SELECT * FROM unnest(%s::int[], %s::int[]))",
+                (map_id, xs, ys)
+            )
+            self._bump_revision(cur, map_id)
+            conn.commit()
+
+    def add_shelves_bulk(self, map_id, shelves):
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            execute_values(
+                cur,
+                "INSERT INTO obstacles (map_id, x, y) VALUES %s ON CONFLICT DO NOTHING",
+                [(map_id, x, y) for x, y, _, _, _ in shelves],
+                page_size=len(shelves)
+            )
+            execute_values(
+                cur,
+                '''
+                INSERT INTO shelves (map_id, x, y, flower, color, quantity) VALUES %s
+                ON CONFLICT (map_id, x, y) DO UPDATE
+                SET flower = EXCLUDED.flower, color = EXCLUDED.color, quantity = EXCLUDED.quantity
+                ''',
+                [(map_id, x, y, flower, color, quantity) for x, y, flower, color, quantity in shelves],
+                page_size=len(shelves)
+            )
+            self._bump_revision(cur, map_id)
+            conn.commit()
+
+    def remove_shelves_bulk(self, map_id, cells):
+        cells = storage.checked_cells(cells)
+        xs, ys = [x for x, _ in cells], [y for _, y in cells]
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            # Deleting the obstacles cascades to the shelves on the same cells
+            cur.execute(
+                '''
+                DELETE FROM obstacles WHERE map_id = %s
+                AND (x, y) IN (SELECT s.x, s.y FROM shelves s JOIN unnest(%s::int[], %s::int[]) AS c(x, y)
+                               ON s.x = c.x AND s.y = c.y WHERE s.map_id = %s)
+                ''',
+                (map_id, xs, ys, map_id)
+            )
+            self._bump_revision(cur, map_id)
+            conn.commit()
+
+    def apply_changes(self, map_id, changes):
+        # One row per cell, ON CONFLICT DO UPDATE can't touch a row twice
+        changes = storage.final_states(changes)
+        freed = [cell for cell, state in changes if state is None]
+        obstacles = [cell for cell, state in changes if state == 'obstacle']
+        shelves = [(x, y) + tuple(state[1:]) for (x, y), state in changes if state is not None and state != 'obstacle']
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            if freed:
+                # Deleting the obstacles cascades to the shelves on the same cells
+                cur.execute(
+                    "DELETE FROM obstacles WHERE map_id = %s AND (x, y) IN (SELECT * FROM unnest(%s::int[], %s::int[]))",
+                    (map_id, [x for x, _ in freed], [y for _, y in freed])
+                )
+            if obstacles:
+                cur.execute(
+                    "DELETE FROM shelves WHERE map_id = %s AND (x, y) IN (SELECT * FROM unnest(%s::int[], %s::int[]))",
+                    (map_id, [x for x, _ in obstacles], [y for _, y in obstacles])
+                )
+            blocked = obstacles + [(x, y) for x, y, _, _, _ in shelves]
+            if blocked:
+                execute_values(
+                    cur,
+                    "INSERT INTO obstacles (map_id, x, y) VALUES %s ON CONFLICT DO NOTHING",
+                    [(map_id, x, y) for x, y in blocked],
+                    page_size=len(blocked)
+                )
+            if shelves:
+                execute_values(
+                    cur,
+                    '''
+                    INSERT INTO shelves (map_id, x, y, flower, color, quantity) VALUES %s
+                    ON CONFLICT (map_id, x, y) DO UPDATE
+                    SET flower = EXCLUDED.flower, color = EXCLUDED.color, quantity = EXCLUDED.quantity
+                    ''',
+                    [(map_id, x, y, flower, color, quantity) for x, y, flower, color, quantity in shelves],
+                    page_size=len(shelves)
+                )
+            self._bump_revision(cur, map_id)
+            conn.commit()
+
+    def reset_map(self, map_id):
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            # Delete all shelves associated with the map
+            cur.execute("DELETE FROM shelves WHERE map_id = %s", (map_id,))
+            # Delete all obstacles associated with the map
+            cur.execute("DELETE FROM obstacles WHERE map_id = %s", (map_id,))
+            self._bump_revision(cur, map_id)
+            conn.commit()
+
+    # One joined query streamed through a server-side cursor, batch_size rows
+    # per round-trip
+    @contextmanager
+    def map_rows(self, label=None, map_id=None, batch_size=None):
+        column, key = ('map_id', map_id) if map_id is not None else ('label', label)
+        with self.pool.connection() as conn:
+            with conn.cursor(name='map_hydration') as cur:
+                cur.itersize = batch_size or FETCH_SIZE
+                cur.execute(
+                    f'''
+                    SELECT m.map_id, m.width, m.height, m.label, m.revision, o.x, o.y, s.flower, s.color, s.quantity
+                    FROM (SELECT map_id, width, height, label, revision FROM maps WHERE {column} = %s ORDER BY map_id LIMIT 1) m
+                    LEFT JOIN obstacles o ON o.map_id = m.map_id
+                    LEFT JOIN shelves s ON s.map_id = o.map_id AND s.x = o.x AND s.y = o.y
+                    ''',
+                    (key,)
+                )
+                rows = iter(cur)
+                first = next(rows, None)
+                if first is None:
+                    yield None
+                    return
+                yield first[:5] + ((row[5:] for row in itertools.chain([first], rows) if row[5] is not None),)
+
+    def stats(self):
+        return self.pool.stats()
+
+    def configure_pool(self, size=None, timeout=None, health_check_interval=None):
+        if timeout is not None:
+            self.pool.timeout = timeout
+        if health_check_interval is not None:
+            self.pool.health_check_interval = health_check_interval
+        if size is not None:
+            self.pool.resize(size)
+
+    def close(self):
+        self.pool.close_all()
@@ -0,0 +1,157 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+import storage
+
+# Embedded SQLite storage backend (see storage.py) for small on-site boxes: one
+# database file in WAL mode with synchronous=NORMAL, so a write is a single
+# append to the log without waiting for the disk on every commit (a power
+# cut can lose the last commits, never corrupt the file). The tables follow
+# the PostgreSQL ones; the backend holds one connection, used by one thread
+# at a time (SQLite runs one write at a time anyway).
+
+DEFAULT_PATH = os.environ.get('SQLITE_PATH', 'warehouse.db')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS maps (
+    map_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    label TEXT,
+    revision INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS maps_label ON maps (label);
+CREATE TABLE IF NOT EXISTS obstacles (
+    map_id INTEGER NOT NULL REFERENCES maps (map_id) ON DELETE CASCADE,
+    x INTEGER NOT NULL,
+    y INTEGER NOT NULL,
+    PRIMARY KEY (map_id, x, y)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS shelves (
+    map_id INTEGER NOT NULL,
+    x INTEGER NOT NULL,
+    y INTEGER NOT NULL,
+    flower TEXT,
+    color TEXT,
+    quantity INTEGER NOT NULL,
+    PRIMARY KEY (map_id, x, y),
+    FOREIGN KEY (map_id, x, y) REFERENCES obstacles (map_id, x, y) ON DELETE CASCADE
+) WITHOUT ROWID;
+'''
+
+class SQLiteStorage(storage.Storage):
+    name = 'sqlite'
+
+    def __init__(self, path=DEFAULT_PATH, timeout=30.0):
+        self.path = path
+        # Transactions are opened explicitly with BEGIN IMMEDIATE
+        self._conn = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('PRAGMA foreign_keys=ON')
+        self._lock = threading.RLock()
+        self._stats = {'transactions': 0, 'rollbacks': 0}
+
+    @contextmanager
+    def _transaction(self, map_id=None):
+        with self._lock:
+            cur = self._conn.cursor()
+            cur.execute('BEGIN IMMEDIATE')
+            try:
+                yield cur
+                if map_id is not None:
+                    # Every write to a map bumps its revision in the same transaction
+                    cur.execute('UPDATE maps SET revision = revision + 1 WHERE map_id = ?', (map_id,))
+                    if not cur.rowcount:
+                        raise KeyError(f"No map with ID {map_id}")
+                cur.execute('COMMIT')
+                self._stats['transactions'] += 1
+            except BaseException:
+                cur.execute('ROLLBACK')
+                self._stats['rollbacks'] += 1
+                raise
+
+    def create_tables(self):
+        with self._lock:
+            self._conn.executescript(SCHEMA)
+
+    def create_map(self, width, height, label=None):
+        with self._transaction() as cur:
+            cur.execute('INSERT INTO maps (width, height, label) VALUES (?, ?, ?)', (width, height, label))
+            return cur.lastrowid
+
+    def delete_map(self, map_id):
+        with self._transaction() as cur:
+            cur.execute('DELETE FROM maps WHERE map_id = ?', (map_id,))
+
+    def map_revision(self, label=None, map_id=None):
+        column, key = ('map_id', map_id) if map_id is not None else ('label', label)
+        with self._lock:
+            return self._conn.execute(f'SELECT map_id, revision FROM maps WHERE {column} = ? ORDER BY map_id LIMIT 1',
+                                      (key,)).fetchone()
+
+    def apply_changes(self, map_id, changes):
+        changes = storage.final_states(changes)
+        freed = [(map_id, x, y) for (x, y), state in changes if state is None]
+        obstacles = [(map_id, x, y) for (x, y), state in changes if state == 'obstacle']
+        shelves = [(map_id, x, y) + tuple(state[1:]) for (x, y), state in changes
+                   if state is not None and state != 'obstacle']
+        with self._transaction(map_id) as cur:
+            # Deleting the obstacles cascades to the shelves on the same cells
+            cur.executemany('DELETE FROM obstacles WHERE map_id = ? AND x = ? AND y = ?', freed)
+            cur.executemany('DELETE FROM shelves WHERE map_id = ? AND x = ? AND y = ?', obstacles)
+            cur.executemany('INSERT OR IGNORE INTO obstacles (map_id, x, y) VALUES (?, ?, ?)',
+                            obstacles + [shelf[:3] for shelf in shelves])
+            cur.executemany('''
+                INSERT INTO shelves (map_id, x, y, flower, color, quantity) VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (map_id, x, y) DO UPDATE
+                SET flower = excluded.flower, color = excluded.color, quantity = excluded.quantity
+            ''', shelves)
+
+    def remove_shelves_bulk(self, map_id, cells):
+        cells = storage.checked_cells(cells)
+        with self._transaction(map_id) as cur:
+            cur.executemany('''
+                DELETE FROM obstacles WHERE map_id = ? AND x = ? AND y = ?
+                AND EXISTS (SELECT 1 FROM shelves s WHERE s.map_id = obstacles.map_id AND s.x = obstacles.x AND s.y = obstacles.y)
+            ''', [(map_id, x, y) for x, y in cells])
+
+    def reset_map(self, map_id):
+        with self._transaction(map_id) as cur:
+            cur.execute('DELETE FROM obstacles WHERE map_id = ?', (map_id,))
+
+    @contextmanager
+    def map_rows(self, label=None, map_id=None, batch_size=None):
+        column, key = ('map_id', map_id) if map_id is not None else ('label', label)
+        with self._lock:
+            # One read transaction, so the rows match the revision
+            cur = self._conn.cursor()
+            cur.execute('BEGIN')
+            try:
+                header = cur.execute(
+                    f'SELECT map_id, width, height, label, revision FROM maps WHERE {column} = ? ORDER BY map_id LIMIT 1',
+                    (key,)
+                ).fetchone()
+                if header is None:
+                    yield None
+                    return
+                rows = cur.execute('''
+                    SELECT o.x, o.y, s.flower, s.color, s.quantity
+                    FROM obstacles o LEFT JOIN shelves s ON s.map_id = o.map_id AND s.x = o.x AND s.y = o.y
+                    WHERE o.map_id = ?
+                ''', (header[0],))
+                yield header + (rows,)
+            finally:
+                cur.execute('COMMIT')
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        # The database file and its write-ahead log
+        stats['bytes'] = sum(os.path.getsize(path) for path in (self.path, self.path + '-wal') if os.path.exists(path))
+        return stats
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,238 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from map import Map, plan_path
+import replan
+import route
+import server
+
+# Concurrency stress test of the planners: planner threads plan routes on one
+# shared Map while editor threads keep adding and removing obstacles and
+# shelves. Every answer is checked against the map as it was while planning
+# (under the same read lock): a path must step between free neighbors and pass
+# every target, and None is only accepted when a target really is cut off.
+# With --endpoints the same load goes through the Flask app (test client, one
+# per thread, maps in the memory storage): editors post /add_obstacle and
+# /remove_obstacle on half of the cells, planners post /run_simulation and a
+# path must step between neighbors and never cross the cells nobody edits.
+# At the end /connect_obs and /changes must agree with the map.
+# Usage: python stress_planning.py [--size 60] [--planners 8] [--editors 2] [--seconds 10] [--endpoints]
+
+def reachable_from(map, start):
+    cells, offsets = map.cells, map.offsets
+    source = map.cell_id(*start)
+    seen = {source}
+    queue = deque([source])
+    while queue:
+        current = queue.popleft()
+        for offset in offsets:
+            neighbor = current + offset
+            if not cells[neighbor] and neighbor not in seen:
+                seen.add(neighbor)
+                queue.append(neighbor)
+    return seen
+
+def check(map, start, targets, end, path):
+    if path is None:
+        seen = reachable_from(map, start)
+        stops = [map.cell_id(*cell) for cell in list(targets) + [end] if cell != start]
+        if any(i not in seen for i in stops):
+            return True
+        # Leaving a blocked start the route can't come back through it: the
+        # end can't be the start and the stops must reach one another
+        if stops and not map.is_valid(*start):
+            if end == start:
+                return True
+            around = reachable_from(map, map.cell_xy(stops[0]))
+            return any(i not in around for i in stops)
+        return False
+    if path[0] != start or path[-1] != end:
+        return False
+    for a, b in zip(path, path[1:]):
+        if abs(a[0] - b[0]) + abs(a[1] - b[1]) != 1 or not map.is_valid(*b):
+            return False
+    return set(targets) <= set(path)
+
+def planner(map, args, seed, stop, counts, failures):
+    rnd = random.Random(seed)
+    size = map.width
+    cell = lambda: (rnd.randrange(size), rnd.randrange(size))
+    while not stop.is_set():
+        start, end = cell(), cell()
+        targets = [cell() for _ in range(rnd.randint(0, args.targets))]
+        algorithm = rnd.choice(('astar', 'jps')) if not targets else 'astar'
+        with map.lock.reading():
+            path = plan_path(map, start, targets, end, algorithm, 0.05)
+            ok = check(map, start, targets, end, path)
+        counts['plans'] += 1
+        if not ok:
+            failures.append((start, targets, end, algorithm, path))
+
+def session_runner(map, args, seed, stop, counts, failures):
+    rnd = random.Random(seed)
+    size = map.width
+    while not stop.is_set():
+        start, end = (rnd.randrange(size), rnd.randrange(size)), (rnd.randrange(size), rnd.randrange(size))
+        try:
+            session = replan.RouteSession(map, start, [], end)
+        except route.Unreachable:
+            continue  # the end is blocked or cut off
+        for _ in range(20):
+            if stop.is_set():
+                break
+            with map.lock.reading():
+                path = session.path()
+                ok = check(map, session.position, [], end, path)
+            counts['repairs'] += 1
+            if not ok:
+                failures.append((session.position, [], end, 'dstar', path))
+            if path is None or len(path) < 2:
+                break
+            session.move_to(path[1])
+        session.close()
+
+def editor(map, seed, stop, counts):
+    rnd = random.Random(seed)
+    size = map.width
+    while not stop.is_set():
+        cell = (rnd.randrange(size), rnd.randrange(size))
+        roll = rnd.random()
+        if roll < 0.45:
+            map.obstacles.add(cell)
+        elif roll < 0.9:
+            map.obstacles.discard(cell)
+        else:
+            map.shelves[cell] = {'flower': 'rose', 'color': 'red', 'quantity': 1}
+        counts['edits'] += 1
+        time.sleep(0.0005)
+
+def endpoint_planner(client, map, fixed, args, seed, stop, counts, failures):
+    rnd = random.Random(seed)
+    size = map.width
+    cell = lambda: (rnd.randrange(size), rnd.randrange(size))
+    position = lambda cell: {'row': cell[0], 'col': cell[1]}
+    while not stop.is_set():
+        start, end = cell(), cell()
+        targets = [cell() for _ in range(rnd.randint(0, args.targets))]
+        body = {'map_id': map.id, 'session': f"stress-{seed}", 'start': position(start), 'goal': position(end),
+                'goals': [position(target) for target in targets], 'time_budget': 0.05}
+        response = client.post('/run_simulation', json=body)
+        counts['plans'] += 1
+        if response.status_code == 404:
+            continue  # a target is blocked or cut off at the moment
+        path = [tuple(step) for step in response.get_json().get('path') or []] if response.status_code == 200 else None
+        ok = bool(path) and path[0] == start and path[-1] == end and set(targets) <= set(path)
+        ok = ok and all(abs(a[0] - b[0]) + abs(a[1] - b[1]) == 1 and b not in fixed for a, b in zip(path, path[1:]))
+        if not ok:
+            failures.append((start, targets, end, response.status_code, path))
+
+def endpoint_editor(client, map, volatile, seed, stop, counts):
+    rnd = random.Random(seed)
+    while not stop.is_set():
+        cells = rnd.sample(volatile, rnd.randint(1, 4))
+        positions = [{'row': x, 'col': y} for x, y in cells]
+        if rnd.random() < 0.5:
+            response = client.post('/add_obstacle', json={'map_id': map.id, 'positions': positions})
+        else:
+            response = client.post('/remove_obstacle', json={'map_id': map.id, 'position': positions})
+        if response.status_code != 200:
+            raise RuntimeError(f"edit answered {response.status_code}")
+        counts['edits'] += 1
+        time.sleep(0.0005)
+
+# The full lists and the change log served by the app against the map
+def check_endpoints(client, map):
+    obstacles = {(entry['row'], entry['col']) for entry in client.get(f"/connect_obs?map_id={map.id}").get_json()}
+    replayed = {}
+    for change in client.get(f"/changes?map_id={map.id}&since=0").get_json().get('changes', []):
+        replayed[(change['row'], change['col'])] = change['state'] != 'free'
+    with map.lock.reading():
+        current = set(map.obstacles)
+    wrong = [cell for cell, blocked in replayed.items() if blocked != (cell in current)]
+    return obstacles == current and not wrong
+
+def run_endpoints(args, map, rnd, run, stop, counts, failures):
+    # Not the lock of an app serving from this directory (see app.py)
+    os.environ.setdefault('PROCESS_LOCK', os.path.join(tempfile.gettempdir(), 'stress_planning.lock'))
+    import app
+    import registry
+    map.assign_id('stress_planning')
+    registry.maps.add(map)
+    cells = [(x, y) for x in range(args.size) for y in range(args.size)]
+    volatile = rnd.sample(cells, len(cells) // 2)
+    fixed = set(map.obstacles) - set(volatile)
+    threads = []
+    for k in range(args.planners):
+        threads.append(threading.Thread(target=run, args=(endpoint_planner, app.app.test_client(), map, fixed, args,
+                                                          args.seed + k, stop, counts, failures)))
+    for k in range(args.editors):
+        threads.append(threading.Thread(target=run, args=(endpoint_editor, app.app.test_client(), map, volatile,
+                                                          args.seed + 200 + k, stop, counts)))
+    return threads, lambda: check_endpoints(app.app.test_client(), map)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=60)
+    parser.add_argument('--clutter', type=float, default=0.25)
+    parser.add_argument('--targets', type=int, default=4)
+    parser.add_argument('--planners', type=int, default=8)
+    parser.add_argument('--sessions', type=int, default=2)
+    parser.add_argument('--editors', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--endpoints', action='store_true', help="drive the Flask endpoints instead of the planners")
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    map = Map(args.size, args.size)
+    for _ in range(int(args.size * args.size * args.clutter)):
+        map.obstacles.add((rnd.randrange(args.size), rnd.randrange(args.size)))
+
+    stop = threading.Event()
+    counts = {'plans': 0, 'repairs': 0, 'edits': 0}
+    failures = []
+    errors = []
+
+    def run(target, *target_args):
+        try:
+            target(*target_args)
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+
+    final_check = None
+    if args.endpoints:
+        server.use_storage('memory')
+        threads, final_check = run_endpoints(args, map, rnd, run, stop, counts, failures)
+    else:
+        threads = []
+        for k in range(args.planners):
+            threads.append(threading.Thread(target=run, args=(planner, map, args, args.seed + k, stop, counts, failures)))
+        for k in range(args.sessions):
+            threads.append(threading.Thread(target=run, args=(session_runner, map, args, args.seed + 100 + k, stop, counts, failures)))
+        for k in range(args.editors):
+            threads.append(threading.Thread(target=run, args=(editor, map, args.seed + 200 + k, stop, counts)))
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    if final_check is not None and not final_check():
+        failures.append("the full lists or the change log disagree with the map")
+
+    print(f"{counts['plans']} routes and {counts['repairs']} repairs planned during {counts['edits']} edits, "
+          f"{len(failures)} wrong answers, {len(errors)} errors")
+    for failure in failures[:5]:
+        print("Wrong answer:", failure)
+    for error in errors[:5]:
+        print("Error:", repr(error))
+    sys.exit(1 if failures or errors else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+import random
+from map import Map
+
+# Seeded synthetic warehouses for the benchmarks: the same size, layout and
+# seed always give the same map.
+#
+# 'aisles': racks two cells deep (two one-deep racks back to back) between
+# `aisle` wide aisles, a cross aisle after every `block` rack cells and a free
+# border two cells wide for the docks. Rack cells hold a shelf with
+# probability shelf_fill and are plain obstacles (empty racks, pillars)
+# otherwise.
+# 'clutter': an open floor where every cell is blocked with probability
+# `density`, blocked cells being shelves with probability shelf_fill.
+# Both get `clutter` of their free cells blocked at random (pallets, carts).
+# Shelves hold a random product of the catalog below and 1 to max_quantity
+# flowers.
+
+FLOWERS = ('rose', 'tulip', 'lily', 'orchid', 'daisy', 'peony', 'sunflower', 'carnation')
+COLORS = ('red', 'white', 'yellow', 'pink', 'purple', 'orange')
+PRODUCTS = [(flower, color) for flower in FLOWERS for color in COLORS]
+LAYOUTS = ('aisles', 'clutter')
+
+def _is_rack(x, y, width, height, aisle, block):
+    if x < 2 or y < 2 or x >= width - 2 or y >= height - 2:
+        return False
+    return (x - 2) % (2 + aisle) < 2 and (y - 2) % (block + 1) < block
+
+# Stored rows (x, y, flower, color, quantity) of a generated warehouse, the
+# shelf fields being None for plain obstacles (see Map.from_rows)
+def warehouse_rows(width, height, seed=0, layout='aisles', clutter=0.02, density=0.2, shelf_fill=0.7,
+                   aisle=2, block=15, max_quantity=50):
+    if layout not in LAYOUTS:
+        raise ValueError(f"Unknown layout '{layout}'")
+    rnd = random.Random(seed)
+    rows = []
+    for x in range(width):
+        for y in range(height):
+            roll = rnd.random()
+            if layout == 'aisles':
+                blocked = _is_rack(x, y, width, height, aisle, block)
+            else:
+                blocked = roll < density
+                roll = rnd.random()
+            if blocked and roll < shelf_fill:
+                flower, color = rnd.choice(PRODUCTS)
+                rows.append((x, y, flower, color, rnd.randint(1, max_quantity)))
+            elif blocked or roll > 1 - clutter:
+                rows.append((x, y, None, None, None))
+    return rows
+
+# A generated warehouse as an in-memory Map without a map id; options as for
+# warehouse_rows
+def generate_warehouse(width, height, seed=0, layout='aisles', label=None, **options):
+    map_instance = Map.from_rows(width, height, None, warehouse_rows(width, height, seed, layout, **options))
+    map_instance.label = label or f"{layout}_{width}x{height}_{seed}"
+    return map_instance
@@ -0,0 +1,42 @@
+import itertools
+import os
+import sys
+import tempfile
+import pytest
+
+# The backend modules import each other by bare name, as when the app is
+# started from src/backend
+BACKEND = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src', 'backend')
+sys.path.insert(0, BACKEND)
+
+# The tests never touch a database server: the app runs on the in-memory
+# storage, with its process lock in a temporary directory
+os.environ['STORAGE_BACKEND'] = 'memory'
+os.environ['PROCESS_LOCK'] = os.path.join(tempfile.mkdtemp(), 'app.lock')
+os.environ.pop('WRITE_BEHIND', None)
+os.environ.pop('MAP_SNAPSHOT_DIR', None)
+
+_labels = itertools.count()
+
+# Label of a new empty 20x20 map in the storage, for requests naming their map
+@pytest.fixture
+def map_label():
+    import server
+    label = f"test_{next(_labels)}"
+    assert server.create_map(20, 20, label) is not None
+    return label
+
+@pytest.fixture
+def client():
+    import app
+    return app.app.test_client()
+
+# Switch server.py to a fresh SQLite file for one test, back to the in-memory
+# storage after it
+@pytest.fixture
+def sqlite_storage(tmp_path):
+    import server
+    previous = server.backend()
+    opened = server.use_storage('sqlite', path=str(tmp_path / 'warehouse.db'))
+    yield opened
+    server.use_storage(previous)
@@ -0,0 +1,38 @@
+from collections import deque
+from map import Map
+
+# Helpers shared by the pathfinding tests: random maps and a plain
+# breadth-first search as the reference for shortest path lengths
+
+def random_map(rnd, width, height, clutter=0.3):
+    map_instance = Map(width, height)
+    for _ in range(int(width * height * clutter)):
+        map_instance.obstacles.add((rnd.randrange(width), rnd.randrange(height)))
+    return map_instance
+
+def free_cells(map_instance):
+    return [(x, y) for x in range(map_instance.width) for y in range(map_instance.height)
+            if map_instance.is_valid(x, y)]
+
+# Steps of the shortest path between two free cells, or None
+def bfs_length(map_instance, start, goal):
+    steps = {start: 0}
+    frontier = deque([start])
+    while frontier:
+        cell = frontier.popleft()
+        if cell == goal:
+            return steps[cell]
+        for neighbor in map_instance.neighbors(*cell):
+            if neighbor not in steps:
+                steps[neighbor] = steps[cell] + 1
+                frontier.append(neighbor)
+    return None
+
+# Whether path walks from start to goal one free cell at a time
+def is_walk(map_instance, path, start, goal):
+    if not path or path[0] != start or path[-1] != goal:
+        return False
+    for a, b in zip(path, path[1:]):
+        if abs(a[0] - b[0]) + abs(a[1] - b[1]) != 1 or not map_instance.is_valid(*b):
+            return False
+    return True
@@ -0,0 +1,66 @@
+import json
+import random
+import pytest
+import batch
+import route
+from grids import free_cells, random_map
+
+def make_jobs(rnd, map_instance, count):
+    cells = free_cells(map_instance)
+    return [(rnd.choice(cells), rnd.sample(cells, rnd.randint(0, 3)), rnd.choice(cells)) for _ in range(count)]
+
+def expected_result(map_instance, index, start, targets, end):
+    try:
+        return index, route.plan_route(map_instance, start, targets, end), None
+    except route.Unreachable as e:
+        return index, None, {'message': str(e), 'cell': e.cell, 'reason': e.reason}
+
+@pytest.fixture
+def batch_map():
+    rnd = random.Random(11)
+    map_instance = random_map(rnd, 18, 14, clutter=0.3)
+    jobs = make_jobs(rnd, map_instance, 12)
+    jobs.insert(5, (jobs[0][0], [(99, 99)], jobs[0][2]))
+    return map_instance, jobs
+
+def test_single_worker_plans_in_this_process(batch_map):
+    map_instance, jobs = batch_map
+    results = list(batch.plan_batch(map_instance, jobs, workers=1))
+    assert [index for index, _, _ in results] == list(range(len(jobs)))
+    for (index, path, error), job in zip(results, jobs):
+        expected = expected_result(map_instance, index, *job)
+        assert (path is None, error) == (expected[1] is None, expected[2])
+        if path is not None:
+            assert len(path) == len(expected[1])
+    assert any(error is not None for _, _, error in results)
+
+def test_pool_gives_the_same_routes(batch_map, monkeypatch):
+    monkeypatch.setattr(batch, 'pool_size', lambda: 3)
+    map_instance, jobs = batch_map
+    results = sorted(batch.plan_batch(map_instance, jobs, workers=3), key=lambda result: result[0])
+    assert batch._pool is not None
+    assert [index for index, _, _ in results] == list(range(len(jobs)))
+    for (index, path, error), job in zip(results, jobs):
+        expected = expected_result(map_instance, index, *job)
+        assert error == expected[2]
+        assert (path is None) == (expected[1] is None)
+        if path is not None:
+            assert len(path) == len(expected[1])
+    # Stopping early cancels the rest of the batch
+    for _ in batch.plan_batch(map_instance, jobs, workers=3):
+        break
+
+@pytest.mark.parametrize('workers', ['many', 0, -2, 1.5, True])
+def test_bad_workers_answer_400(client, map_label, workers):
+    job = {'start': {'row': 0, 'col': 0}, 'end': {'row': 3, 'col': 3}, 'goals': []}
+    response = client.post('/plan_batch', json={'map': map_label, 'jobs': [job], 'workers': workers})
+    assert response.status_code == 400
+
+def test_endpoint_streams_one_line_per_job(client, map_label):
+    jobs = [{'start': {'row': 0, 'col': 0}, 'end': {'row': 3, 'col': 3}, 'goals': [{'row': 5, 'col': 5}]},
+            {'start': {'row': 1, 'col': 1}, 'end': {'row': 25, 'col': 1}}]
+    response = client.post('/plan_batch', json={'map': map_label, 'jobs': jobs, 'workers': '64'})
+    assert response.status_code == 200
+    lines = sorted((json.loads(line) for line in response.data.decode().splitlines()), key=lambda line: line['index'])
+    assert len(lines[0]['path']) == 1 + 10 + 4
+    assert lines[1]['reason'] == 'out of bounds'
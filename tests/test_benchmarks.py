@@ -0,0 +1,69 @@
+import json
+import sys
+import pytest
+import benchmarks
+import server
+import warehouse
+
+@pytest.mark.parametrize('layout', warehouse.LAYOUTS)
+def test_same_seed_same_warehouse(layout):
+    rows = warehouse.warehouse_rows(40, 30, 7, layout)
+    assert rows == warehouse.warehouse_rows(40, 30, 7, layout)
+    assert rows != warehouse.warehouse_rows(40, 30, 8, layout)
+    for x, y, flower, color, quantity in rows:
+        assert 0 <= x < 40 and 0 <= y < 30
+        if flower is not None:
+            assert (flower, color) in warehouse.PRODUCTS and 1 <= quantity <= 50
+
+def test_aisles_layout():
+    rows = warehouse.warehouse_rows(30, 30, 0, 'aisles', clutter=0, shelf_fill=1, aisle=2, block=5)
+    cells = {(x, y) for x, y, _, _, _ in rows}
+    assert all(flower is not None for _, _, flower, _, _ in rows)
+    # Racks two deep, two-wide aisles, a cross aisle after five rack cells and
+    # a free border of two
+    assert {(2, 2), (3, 2), (6, 2), (7, 6)} <= cells
+    assert not cells & {(4, 2), (5, 2), (2, 7), (0, 5), (28, 10), (10, 28)}
+
+def test_unknown_layout():
+    with pytest.raises(ValueError):
+        warehouse.warehouse_rows(10, 10, 0, 'maze')
+
+def test_generated_map_matches_its_rows():
+    map_instance = warehouse.generate_warehouse(25, 25, 3, 'clutter')
+    rows = warehouse.warehouse_rows(25, 25, 3, 'clutter')
+    assert set(map_instance.obstacles) == {(x, y) for x, y, _, _, _ in rows}
+    assert len(map_instance.shelves) == sum(1 for row in rows if row[2] is not None)
+    assert map_instance.label == 'clutter_25x25_3'
+
+def test_compare_reports_regressions(tmp_path, capsys):
+    before = tmp_path / 'before.json'
+    old = {'suite': 'pathfinding', 'case': 'astar', 'layout': 'aisles', 'size': 20}
+    before.write_text(json.dumps({'results': [dict(old, p50_s=0.010), dict(old, case='jps', p50_s=0.010)]}))
+    results = [dict(old, p50_s=0.011), dict(old, case='jps', p50_s=0.020), dict(old, case='hpa', p50_s=1.0)]
+    regressions = benchmarks.compare(results, str(before), 1.25)
+    assert [result['case'] for result in regressions] == ['jps']
+    assert 'slower' in capsys.readouterr().out
+
+def test_suite_runs_end_to_end(tmp_path, monkeypatch, capsys):
+    output = tmp_path / 'results.json'
+    monkeypatch.setattr(sys, 'argv', ['benchmarks.py', '--sizes', '20', '--queries', '2', '--storage', 'memory',
+                                      '--targets', '3', '--batches', '1', '--output', str(output)])
+    previous = server.backend()
+    try:
+        benchmarks.main()
+    finally:
+        server.use_storage(previous)
+    report = json.loads(output.read_text())
+    assert report['environment']['options']['seed'] == 0
+    suites = {result['suite'] for result in report['results']}
+    assert suites == set(benchmarks.SUITES)
+    for result in report['results']:
+        assert result.get('skipped') or result['p50_s'] >= 0
+    # Compared with itself nothing is a regression
+    monkeypatch.setattr(sys, 'argv', sys.argv + ['--compare', str(output), '--threshold', '1000'])
+    try:
+        with pytest.raises(SystemExit) as e:
+            benchmarks.main()
+    finally:
+        server.use_storage(previous)
+    assert e.value.code == 0
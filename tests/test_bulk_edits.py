@@ -0,0 +1,50 @@
+import server
+from map import Map, get_map_data
+
+def stored_map(width=10, height=10, label='bulk'):
+    map_instance = Map(width, height)
+    assert map_instance.assign_id(label)
+    return map_instance
+
+def test_each_bulk_edit_is_one_transaction(sqlite_storage):
+    map_instance = stored_map()
+    before = sqlite_storage.stats()['transactions']
+    assert map_instance.add_obstacles_bulk([(x, 1) for x in range(8)])
+    assert map_instance.add_shelves_bulk([(x, 3, 'rose', 'red', x) for x in range(8)])
+    assert map_instance.remove_shelves_bulk([(x, 3) for x in range(4)])
+    assert map_instance.remove_obstacles_bulk([(x, 1) for x in range(4)])
+    assert sqlite_storage.stats()['transactions'] == before + 4
+
+def test_bulk_edits_are_stored(sqlite_storage):
+    map_instance = stored_map()
+    map_instance.add_obstacles_bulk([(0, 0), (1, 1), (0, 0)])
+    map_instance.add_shelves_bulk([(2, 2, 'rose', 'red', 5), (2, 2, 'tulip', 'white', 7), (1, 1, 'lily', 'pink', 1)])
+    map_instance.remove_obstacles_bulk([(0, 0)])
+    loaded = get_map_data('bulk')
+    assert set(loaded.obstacles) == {(1, 1), (2, 2)}
+    assert loaded.shelves[(2, 2)] == {'flower': 'tulip', 'color': 'white', 'quantity': 7}
+    assert loaded.shelves[(1, 1)] == {'flower': 'lily', 'color': 'pink', 'quantity': 1}
+
+def test_failed_bulk_edit_leaves_the_map_unchanged(sqlite_storage):
+    map_instance = stored_map()
+    map_instance.add_obstacles_bulk([(1, 1)])
+    version = map_instance.version
+    server.delete_map(map_instance.id)  # every write to the map now fails
+    assert not map_instance.add_obstacles_bulk([(2, 2), (3, 3)])
+    assert not map_instance.add_shelves_bulk([(4, 4, 'rose', 'red', 1)])
+    assert not map_instance.remove_obstacles_bulk([(1, 1)])
+    assert set(map_instance.obstacles) == {(1, 1)}
+    assert not map_instance.shelves
+    assert map_instance.version == version
+
+def test_endpoints_write_every_position(client, map_label):
+    positions = [{'row': x, 'col': 2} for x in range(5)]
+    response = client.post('/add_obstacle', json={'map': map_label, 'positions': positions})
+    assert response.status_code == 200
+    details = [{'row': x, 'col': 4, 'flower': 'rose', 'color': 'red', 'quantity': 3} for x in range(3)]
+    assert client.post('/add_shelf', json={'map': map_label, 'details': details}).status_code == 200
+    assert client.post('/remove_obstacle', json={'map': map_label, 'position': positions[:2]}).status_code == 200
+    assert client.post('/remove_shelf', json={'map': map_label, 'position': details[:1]}).status_code == 200
+    loaded = get_map_data(map_label)
+    assert set(loaded.obstacles) == {(2, 2), (3, 2), (4, 2), (1, 4), (2, 4)}
+    assert set(loaded.shelves) == {(1, 4), (2, 4)}
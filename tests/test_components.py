@@ -0,0 +1,60 @@
+import random
+import pytest
+import components
+import route
+import search
+from grids import bfs_length, free_cells, random_map
+from map import Map
+
+def check_labels(map_instance, index, rnd, count=60):
+    cells = free_cells(map_instance)
+    for _ in range(count):
+        a, b = rnd.choice(cells), rnd.choice(cells)
+        connected = index.connected(map_instance.cell_id(*a), map_instance.cell_id(*b))
+        assert connected == (bfs_length(map_instance, a, b) is not None)
+
+@pytest.mark.parametrize('seed', range(4))
+def test_labels_follow_random_edits(seed):
+    rnd = random.Random(seed)
+    map_instance = random_map(rnd, 15, 12, clutter=0.35)
+    index = components.components_for(map_instance)
+    check_labels(map_instance, index, rnd)
+    for _ in range(60):
+        cell = (rnd.randrange(15), rnd.randrange(12))
+        if cell in map_instance.obstacles:
+            map_instance.obstacles.discard(cell)
+        else:
+            map_instance.obstacles.add(cell)
+        check_labels(map_instance, index, rnd, 10)
+
+def test_closing_and_opening_a_wall():
+    map_instance = Map(9, 9)
+    map_instance.obstacles |= {(4, y) for y in range(8)}
+    index = components.components_for(map_instance)
+    left, right = map_instance.cell_id(0, 0), map_instance.cell_id(8, 0)
+    assert index.connected(left, right)
+    map_instance.obstacles.add((4, 8))
+    assert not index.connected(left, right)
+    map_instance.obstacles.discard((4, 3))
+    assert index.connected(left, right)
+    assert not index.connected(left, map_instance.cell_id(4, 8))
+
+def test_unreachable_goals_fail_without_searching():
+    map_instance = Map(30, 30)
+    map_instance.obstacles |= {(15, y) for y in range(30)}
+    engine = search.engine_for(map_instance)
+    engine.expanded = 0
+    assert search.find_path(map_instance, (0, 0), (29, 29), use_cache=False) is None
+    assert engine.expanded == 0
+    with pytest.raises(route.Unreachable) as e:
+        route.check_targets(map_instance, (0, 0), [(1, 1), (20, 20)], (0, 0))
+    assert e.value.cell == (20, 20) and e.value.reason == 'unreachable'
+
+def test_simulation_answers_404_for_a_walled_off_goal(client, map_label):
+    wall = [{'row': 10, 'col': y} for y in range(20)]
+    assert client.post('/add_obstacle', json={'map': map_label, 'positions': wall}).status_code == 200
+    response = client.post('/run_simulation', json={'map': map_label, 'start': {'row': 0, 'col': 0},
+                                                    'goal': {'row': 0, 'col': 1}, 'goals': [{'row': 15, 'col': 5}]})
+    assert response.status_code == 404
+    body = response.get_json()
+    assert body['reason'] == 'unreachable' and body['target'] == {'row': 15, 'col': 5}
@@ -0,0 +1,96 @@
+import random
+import threading
+import time
+from collections import Counter
+from types import SimpleNamespace
+import pytest
+import app
+import stress_planning
+from grids import random_map
+from map import Map, RWLock, plan_path
+
+def test_planning_leaves_the_map_endpoints_alone():
+    map_instance = Map(10, 10)
+    map_instance.start, map_instance.goal = (0, 0), (9, 9)
+    path = plan_path(map_instance, (2, 2), [(5, 5)], (7, 7))
+    assert path[0] == (2, 2) and path[-1] == (7, 7)
+    assert (map_instance.start, map_instance.goal) == ((0, 0), (9, 9))
+
+def test_sessions_keep_their_own_endpoints(client, map_label):
+    first = {'map': map_label, 'session': 'a', 'start': {'row': 0, 'col': 0}, 'goal': {'row': 3, 'col': 0}}
+    second = {'map': map_label, 'session': 'b', 'start': {'row': 5, 'col': 5}, 'goal': {'row': 5, 'col': 9}}
+    assert client.post('/set_start_goal', json=first).status_code == 200
+    assert client.post('/set_start_goal', json=second).status_code == 200
+    path = client.post('/run_simulation', json={'map': map_label, 'session': 'a', 'goals': []}).get_json()['path']
+    assert path[0] == [0, 0] and path[-1] == [3, 0]
+    path = client.post('/run_simulation', json={'map': map_label, 'session': 'b', 'goals': []}).get_json()['path']
+    assert path[0] == [5, 5] and path[-1] == [5, 9]
+
+def test_writer_waits_for_readers():
+    lock = RWLock()
+    reading = threading.Event()
+    release = threading.Event()
+    order = []
+    def reader():
+        with lock.reading():
+            reading.set()
+            release.wait()
+            order.append('read')
+    def writer():
+        with lock.writing():
+            order.append('write')
+    first = threading.Thread(target=reader)
+    first.start()
+    reading.wait()
+    second = threading.Thread(target=writer)
+    second.start()
+    time.sleep(0.05)
+    assert order == []
+    release.set()
+    first.join()
+    second.join()
+    assert order == ['read', 'write']
+
+def test_lock_is_reentrant():
+    lock = RWLock()
+    with lock.writing():
+        with lock.reading():
+            with lock.writing():
+                pass
+    with lock.reading():
+        with lock.reading():
+            pass
+
+# A short run of stress_planning.py: every answer planned while editors change
+# the map must be a valid route on the map it was planned on
+def test_planning_while_editing():
+    map_instance = random_map(random.Random(3), 24, 24, clutter=0.25)
+    args = SimpleNamespace(targets=2)
+    stop = threading.Event()
+    counts = Counter()
+    failures = []
+    threads = [threading.Thread(target=stress_planning.planner, args=(map_instance, args, k, stop, counts, failures))
+               for k in range(3)]
+    threads.append(threading.Thread(target=stress_planning.editor, args=(map_instance, 100, stop, counts)))
+    for thread in threads:
+        thread.start()
+    time.sleep(1)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    assert counts['plans'] and counts['edits']
+    assert failures == []
+
+def test_second_process_answers_503(client, monkeypatch, tmp_path):
+    fcntl = pytest.importorskip('fcntl')
+    lock_file = tmp_path / 'app.lock'
+    monkeypatch.setattr(app, 'PROCESS_LOCK', str(lock_file))
+    # The lock taken as if by another process
+    monkeypatch.setattr(app, '_process_lock', None)
+    with open(lock_file, 'a+') as other:
+        fcntl.flock(other, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        response = client.get('/metrics')
+        assert response.status_code == 503
+        fcntl.flock(other, fcntl.LOCK_UN)
+    assert client.get('/metrics').status_code == 200
+    app._process_lock[1].close()
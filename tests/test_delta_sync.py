@@ -0,0 +1,51 @@
+import pytest
+import map as map_module
+
+def add_obstacles(client, label, *cells):
+    positions = [{'row': x, 'col': y} for x, y in cells]
+    return client.post('/add_obstacle', json={'map': label, 'positions': positions}).get_json()
+
+def test_edits_answer_with_their_changes(client, map_label):
+    answer = add_obstacles(client, map_label, (1, 1), (2, 2))
+    assert answer['changes'] == [{'row': 1, 'col': 1, 'state': 'obstacle'}, {'row': 2, 'col': 2, 'state': 'obstacle'}]
+    assert answer['version'] > 0
+
+def test_changes_since_a_version(client, map_label):
+    version = add_obstacles(client, map_label, (1, 1))['version']
+    add_obstacles(client, map_label, (2, 2), (3, 3))
+    client.post('/remove_obstacle', json={'map': map_label, 'position': {'row': 2, 'col': 2}})
+    client.post('/add_shelf', json={'map': map_label, 'details': [
+        {'row': 4, 'col': 4, 'flower': 'tulip', 'color': 'white', 'quantity': 2}]})
+    answer = client.get(f'/changes?map={map_label}&since={version}').get_json()
+    # Only the latest state of every cell changed after that version
+    assert answer['changes'] == [{'row': 3, 'col': 3, 'state': 'obstacle'},
+                                 {'row': 2, 'col': 2, 'state': 'free'},
+                                 {'row': 4, 'col': 4, 'state': 'shelf', 'flower': 'tulip', 'color': 'white',
+                                  'quantity': 2}]
+    now = client.get(f'/changes?map={map_label}&since={answer["version"]}').get_json()
+    assert now == {'version': answer['version'], 'changes': []}
+
+def test_bad_since_answers_400(client, map_label):
+    assert client.get(f'/changes?map={map_label}&since=soon').status_code == 400
+
+def test_full_reload_after_a_reset(client, map_label):
+    version = add_obstacles(client, map_label, (1, 1))['version']
+    client.post('/reset_map', json={'map': map_label})
+    assert client.get(f'/changes?map={map_label}&since={version}').get_json()['full'] is True
+
+def test_full_reload_past_the_change_log(client, map_label, monkeypatch):
+    monkeypatch.setattr(map_module, 'CHANGE_LOG_SIZE', 2)
+    version = add_obstacles(client, map_label, (1, 1))['version']
+    add_obstacles(client, map_label, (2, 2), (3, 3), (4, 4))
+    assert client.get(f'/changes?map={map_label}&since={version}').get_json()['full'] is True
+
+@pytest.mark.parametrize('path', ['/connect_obs', '/connect_shel'])
+def test_etag_until_the_next_edit(client, map_label, path):
+    first = client.get(f'{path}?map={map_label}')
+    etag = first.headers['ETag']
+    again = client.get(f'{path}?map={map_label}', headers={'If-None-Match': etag})
+    assert again.status_code == 304 and again.data == b''
+    add_obstacles(client, map_label, (5, 5))
+    changed = client.get(f'{path}?map={map_label}', headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
@@ -0,0 +1,87 @@
+import random
+import pytest
+import distance_fields
+from grids import bfs_length, free_cells, is_walk, random_map
+from map import Map
+
+def stock(map_instance, cells):
+    for cell in cells:
+        map_instance.shelves[cell] = {'flower': 'rose', 'color': 'red', 'quantity': 1}
+
+# Walking distance to the nearest free cell next to the shelf
+def expected_distance(map_instance, start, shelf):
+    lengths = [bfs_length(map_instance, start, cell) for cell in map_instance.neighbors(*shelf)]
+    lengths = [length for length in lengths if length is not None]
+    return min(lengths) if lengths else None
+
+def check_field(fields, map_instance, shelf):
+    for start in free_cells(map_instance):
+        expected = expected_distance(map_instance, start, shelf)
+        assert fields.distance(start, shelf) == expected
+        path = fields.path_to_shelf(start, shelf)
+        if expected is None:
+            assert path is None
+        else:
+            assert is_walk(map_instance, path, start, path[-1])
+            assert len(path) - 1 == expected
+            assert abs(path[-1][0] - shelf[0]) + abs(path[-1][1] - shelf[1]) == 1
+
+@pytest.mark.parametrize('seed', range(3))
+def test_fields_match_breadth_first_search(seed):
+    rnd = random.Random(seed)
+    map_instance = random_map(rnd, 14, 11, clutter=0.25)
+    shelves = rnd.sample(free_cells(map_instance), 3)
+    stock(map_instance, shelves)
+    fields = distance_fields.DistanceFields(map_instance)
+    for shelf in shelves:
+        check_field(fields, map_instance, shelf)
+    assert fields.stats['descents'] > 0
+    fields.close()
+
+def test_edits_rebuild_the_fields_they_affect():
+    map_instance = Map(12, 12)
+    stock(map_instance, [(6, 6)])
+    fields = distance_fields.DistanceFields(map_instance)
+    assert fields.distance((0, 6), (6, 6)) == 5
+    map_instance.obstacles |= {(5, y) for y in range(1, 12)}
+    # Stale fields answer through A* until the rebuild is done
+    assert fields.distance((0, 6), (6, 6)) == expected_distance(map_instance, (0, 6), (6, 6))
+    fields.wait()
+    assert fields.stats['rebuilds'] >= 1
+    check_field(fields, map_instance, (6, 6))
+    fields.close()
+
+def test_least_recently_used_fields_are_dropped():
+    map_instance = Map(10, 10)
+    shelves = [(2, 2), (2, 7), (7, 2)]
+    stock(map_instance, shelves)
+    fields = distance_fields.DistanceFields(map_instance, max_bytes=2 * 2 * len(map_instance.cells))
+    assert fields.max_fields == 2
+    for shelf in shelves:
+        assert fields.distance((0, 0), shelf) is not None
+    assert fields.stats['evictions'] == 1
+    assert len(fields._fields) == 2
+    assert fields.distance((0, 0), (2, 2)) == expected_distance(map_instance, (0, 0), (2, 2))
+    fields.close()
+
+def test_cells_beyond_the_cap_fall_back_to_search(monkeypatch):
+    monkeypatch.setattr(distance_fields, 'UNREACHABLE', 6)
+    map_instance = Map(1, 20)
+    stock(map_instance, [(0, 0)])
+    fields = distance_fields.DistanceFields(map_instance)
+    assert fields.distance((0, 3), (0, 0)) == 2
+    assert fields.distance((0, 19), (0, 0)) == 18
+    assert len(fields.path_to_shelf((0, 19), (0, 0))) == 19
+    assert fields.field(map_instance.cell_id(0, 0)).capped
+    assert fields.stats['fallbacks'] == 2
+    fields.close()
+
+def test_nearest_shelves_in_walking_distance():
+    map_instance = Map(10, 10)
+    map_instance.obstacles |= {(1, y) for y in range(9)}
+    stock(map_instance, [(0, 5), (4, 0)])
+    # (0, 5) is closer as the crow flies but behind the wall
+    nearest = distance_fields.nearest_shelves(map_instance, (2, 4), [(0, 5), (4, 0)], k=2)
+    assert [(distance, shelf) for distance, shelf, _ in nearest] == [(5, (4, 0)), (10, (0, 5))]
+    nearest = distance_fields.nearest_shelves(map_instance, (0, 0), [(0, 5), (4, 0)], k=1)
+    assert [(distance, shelf) for distance, shelf, _ in nearest] == [(4, (0, 5))]
@@ -0,0 +1,50 @@
+import random
+import pytest
+import hpa
+import search
+from grids import bfs_length, free_cells, is_walk, random_map
+from map import Map
+
+@pytest.mark.parametrize('seed', range(5))
+def test_hpa_finds_a_walk_whenever_there_is_one(seed):
+    rnd = random.Random(seed)
+    map_instance = random_map(rnd, 30, 22, clutter=0.25)
+    hierarchy = hpa.HierarchicalMap(map_instance, cluster_size=6)
+    cells = free_cells(map_instance)
+    for _ in range(40):
+        start, goal = rnd.choice(cells), rnd.choice(cells)
+        path = hierarchy.find_path(start, goal)
+        expected = bfs_length(map_instance, start, goal)
+        if expected is None:
+            assert path is None
+        else:
+            assert is_walk(map_instance, path, start, goal)
+            assert len(path) - 1 >= expected
+
+def test_hpa_is_near_optimal_on_open_floors():
+    map_instance = Map(64, 64)
+    map_instance.obstacles |= {(20, y) for y in range(50)} | {(40, y) for y in range(14, 64)}
+    hierarchy = hpa.HierarchicalMap(map_instance, cluster_size=8)
+    path = hierarchy.find_path((0, 0), (63, 63))
+    expected = bfs_length(map_instance, (0, 0), (63, 63))
+    assert is_walk(map_instance, path, (0, 0), (63, 63))
+    assert len(path) - 1 <= 1.2 * expected
+
+def test_edits_rebuild_the_clusters_they_touch():
+    map_instance = Map(24, 24)
+    hierarchy = hpa.HierarchicalMap(map_instance, cluster_size=6)
+    assert hierarchy.find_path((0, 0), (23, 0)) is not None
+    # A wall across the map with a single gap at the far end
+    map_instance.obstacles |= {(12, y) for y in range(23)}
+    path = hierarchy.find_path((0, 0), (23, 0))
+    assert is_walk(map_instance, path, (0, 0), (23, 0))
+    assert (12, 23) in path
+    map_instance.obstacles.add((12, 23))
+    assert hierarchy.find_path((0, 0), (23, 0)) is None
+
+def test_find_path_dispatches_to_the_hierarchy():
+    map_instance = Map(40, 40)
+    map_instance.obstacles |= {(x, 20) for x in range(39)}
+    path = search.find_path(map_instance, (0, 0), (0, 39), algorithm='hpa')
+    assert is_walk(map_instance, path, (0, 0), (0, 39))
+    assert search.find_path(map_instance, (0, 0), (0, 20), algorithm='hpa') is None
@@ -0,0 +1,31 @@
+from map import Map, get_map_data
+
+def test_load_reads_every_cell_without_writing(sqlite_storage):
+    stored = Map(12, 8)
+    assert stored.assign_id('hydrated')
+    stored.add_obstacles_bulk([(0, 0), (11, 7), (5, 5)])
+    stored.add_shelves_bulk([(3, 4, 'rose', 'red', 2), (5, 5, 'tulip', 'white', 0)])
+    transactions = sqlite_storage.stats()['transactions']
+    revision = sqlite_storage.map_revision('hydrated')
+
+    loaded = Map.load('hydrated', batch_size=2)
+    assert (loaded.id, loaded.label, loaded.width, loaded.height) == (stored.id, 'hydrated', 12, 8)
+    assert set(loaded.obstacles) == set(stored.obstacles)
+    assert dict(loaded.shelves) == dict(stored.shelves)
+    assert len(loaded.obstacles) == 4
+    assert loaded.revision == revision[1]
+    # Loading again by map id gives the same map, and nothing was written
+    assert set(Map.load(map_id=stored.id).obstacles) == set(stored.obstacles)
+    assert sqlite_storage.stats()['transactions'] == transactions
+    assert sqlite_storage.map_revision('hydrated') == revision
+
+def test_rows_outside_the_map_are_skipped():
+    rows = [(0, 0, None, None, None), (9, 9, None, None, None), (1, 1, 'rose', 'red', 4)]
+    map_instance = Map.from_rows(5, 5, 7, rows)
+    assert map_instance.id == 7
+    assert set(map_instance.obstacles) == {(0, 0), (1, 1)}
+    assert map_instance.find_stock('rose', 'red', 4) == [(1, 1)]
+
+def test_missing_map_loads_as_none(sqlite_storage):
+    assert get_map_data('nowhere') is None
+    assert get_map_data(map_id=404) is None
@@ -0,0 +1,42 @@
+import random
+import pytest
+import search
+from bench_search import make_aisles
+from grids import bfs_length, free_cells, is_walk, random_map
+from map import Map, astar
+
+def check_against_bfs(rnd, map_instance, count):
+    cells = free_cells(map_instance)
+    for _ in range(count):
+        start, goal = rnd.choice(cells), rnd.choice(cells)
+        path = search.find_path(map_instance, start, goal, algorithm='jps', use_cache=False)
+        expected = bfs_length(map_instance, start, goal)
+        if expected is None:
+            assert path is None
+        else:
+            assert is_walk(map_instance, path, start, goal)
+            assert len(path) - 1 == expected
+
+@pytest.mark.parametrize('seed', range(5))
+def test_jps_lengths_match_breadth_first_search(seed):
+    rnd = random.Random(seed)
+    check_against_bfs(rnd, random_map(rnd, 24, 17, clutter=0.3), 30)
+
+@pytest.mark.parametrize('size', [12, 25, 40])
+def test_jps_on_aisles(size):
+    check_against_bfs(random.Random(size), make_aisles(size, block=7), 30)
+
+def test_jps_expands_fewer_cells_on_open_floors():
+    map_instance = Map(60, 60)
+    search.find_path(map_instance, (0, 0), (59, 59), algorithm='astar', use_cache=False)
+    astar_expanded = search.engine_for(map_instance).expanded
+    path = search.find_path(map_instance, (0, 0), (59, 59), algorithm='jps', use_cache=False)
+    assert len(path) == 119
+    assert search.engine_for(map_instance).expanded < astar_expanded
+
+def test_astar_entry_point_takes_the_algorithm():
+    map_instance = Map(8, 8)
+    map_instance.obstacles |= {(3, y) for y in range(7)}
+    path = astar(map_instance, 'jps', (0, 0), (7, 0))
+    assert is_walk(map_instance, path, (0, 0), (7, 0))
+    assert len(path) - 1 == bfs_length(map_instance, (0, 0), (7, 0))
@@ -0,0 +1,63 @@
+import pytest
+import server
+from map import Map, get_map_data
+
+def test_views_behave_like_the_old_set_and_dict():
+    map_instance = Map(4, 3)
+    map_instance.obstacles.add((1, 1))
+    map_instance.obstacles |= {(2, 2), (3, 0)}
+    map_instance.shelves[(0, 2)] = {'flower': 'rose', 'color': 'red', 'quantity': 4}
+    assert set(map_instance.obstacles) == {(1, 1), (2, 2), (3, 0), (0, 2)}
+    assert len(map_instance.obstacles) == 4
+    assert (0, 2) in map_instance.obstacles and (0, 0) not in map_instance.obstacles
+    assert (9, 9) not in map_instance.obstacles
+    assert dict(map_instance.shelves) == {(0, 2): {'flower': 'rose', 'color': 'red', 'quantity': 4}}
+    # A shelf removed stays an obstacle, an obstacle removed takes its shelf along
+    del map_instance.shelves[(0, 2)]
+    assert (0, 2) in map_instance.obstacles
+    map_instance.shelves[(2, 2)] = {'flower': 'lily', 'color': 'white', 'quantity': 1}
+    map_instance.obstacles.discard((2, 2))
+    assert (2, 2) not in map_instance.shelves
+    map_instance.obstacles.clear()
+    assert len(map_instance.obstacles) == 0 and not map_instance.shelves
+
+def test_neighbors_stay_inside_the_map():
+    map_instance = Map(3, 3)
+    map_instance.obstacles.add((1, 0))
+    assert sorted(map_instance.neighbors(0, 0)) == [(0, 1)]
+    assert sorted(map_instance.neighbors(1, 1)) == [(0, 1), (1, 2), (2, 1)]
+    assert not map_instance.is_valid(3, 0)
+    assert not map_instance.is_valid(1, 0)
+    i = map_instance.cell_id(2, 2)
+    assert sorted(map_instance.cell_xy(j) for j in map_instance.neighbor_ids(i)) == [(1, 2), (2, 1)]
+
+def test_views_reject_cells_outside_the_map():
+    map_instance = Map(5, 5)
+    with pytest.raises(ValueError):
+        map_instance.obstacles.add((5, 0))
+    with pytest.raises(ValueError):
+        map_instance.shelves[(-1, 2)] = {'flower': 'rose', 'color': 'red', 'quantity': 1}
+    assert len(map_instance.obstacles) == 0
+
+def test_edits_outside_the_map_write_nothing(sqlite_storage):
+    map_instance = Map(5, 5)
+    assert map_instance.assign_id('bounded')
+    transactions = sqlite_storage.stats()['transactions']
+    assert map_instance.add_obstacles_bulk([(1, 1), (50, 50)]) is False
+    assert map_instance.add_shelves_bulk([(1, 1, 'rose', 'red', 1), (0, 5, 'rose', 'red', 1)]) is False
+    assert map_instance.add_obstacle(50, 50) is False
+    assert map_instance.add_shelf(-1, 0, 'rose', 'red', 1) is False
+    assert sqlite_storage.stats()['transactions'] == transactions
+    assert len(map_instance.obstacles) == 0
+    assert len(get_map_data('bounded').obstacles) == 0
+
+def test_endpoints_answer_400_outside_the_map(client, map_label):
+    response = client.post('/add_obstacle', json={'map': map_label, 'positions': [{'row': 50, 'col': 50}]})
+    assert response.status_code == 400
+    details = [{'row': 1, 'col': 1, 'flower': 'rose', 'color': 'red', 'quantity': 1},
+               {'row': 20, 'col': 0, 'flower': 'rose', 'color': 'red', 'quantity': 1}]
+    assert client.post('/add_shelf', json={'map': map_label, 'details': details}).status_code == 400
+    loaded = get_map_data(map_label)
+    assert len(loaded.obstacles) == 0
+    with server.map_rows(map_label) as found:
+        assert list(found[5]) == []
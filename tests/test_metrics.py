@@ -0,0 +1,72 @@
+import time
+import app
+import metrics
+import profiler
+
+def test_counter_and_histogram_text(monkeypatch):
+    monkeypatch.setattr(metrics, '_metrics', [])
+    monkeypatch.setattr(metrics, '_collectors', [])
+    counter = metrics.Counter('test_total', "Test counter", ('kind',))
+    counter.inc('a')
+    counter.inc('a', amount=2)
+    counter.inc('say "hi"')
+    histogram = metrics.Histogram('test_seconds', "Test histogram", buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 3.0):
+        histogram.observe(value)
+    metrics.collect_stats('test_', lambda: {'entries': 4, 'hit_rate': 0.5, 'enabled': True, 'name': 'x'})
+    lines = metrics.render().splitlines()
+    assert 'warehouse_test_total{kind="a"} 3' in lines
+    assert 'warehouse_test_total{kind="say \\"hi\\""} 1' in lines
+    assert lines.index('# TYPE warehouse_test_total counter') < lines.index('warehouse_test_total{kind="a"} 3')
+    assert 'warehouse_test_seconds_bucket{le="0.1"} 1' in lines
+    assert 'warehouse_test_seconds_bucket{le="1.0"} 3' in lines
+    assert 'warehouse_test_seconds_bucket{le="+Inf"} 4' in lines
+    assert 'warehouse_test_seconds_sum 4.05' in lines
+    assert 'warehouse_test_seconds_count 4' in lines
+    assert 'warehouse_test_entries 4' in lines and 'warehouse_test_hit_rate 0.5' in lines
+    assert not [line for line in lines if 'test_enabled' in line or 'test_name' in line]
+
+def test_requests_and_searches_are_counted(client, map_label):
+    before = metrics.REQUESTS.value('run_simulation', 'POST', '200')
+    searches = metrics.SEARCHES.value('astar')
+    timed = metrics.REQUEST_SECONDS.count('run_simulation', 'POST')
+    body = {'map': map_label, 'start': {'row': 0, 'col': 0}, 'goal': {'row': 7, 'col': 9}, 'goals': []}
+    assert client.post('/run_simulation', json=body).status_code == 200
+    assert metrics.REQUESTS.value('run_simulation', 'POST', '200') == before + 1
+    assert metrics.REQUEST_SECONDS.count('run_simulation', 'POST') == timed + 1
+    assert metrics.SEARCHES.value('astar') > searches
+    response = client.get('/metrics')
+    assert response.mimetype == 'text/plain'
+    text = response.get_data(as_text=True)
+    assert f'warehouse_http_requests_total{{endpoint="run_simulation",method="POST",status="200"}} {before + 1}' in text
+    assert '# TYPE warehouse_search_seconds histogram' in text
+    assert 'warehouse_path_cache_entries' in text
+
+def test_database_calls_are_counted(map_label):
+    import server
+    calls = metrics.DB_CALLS.value('map_revision')
+    server.map_revision(map_label)
+    assert metrics.DB_CALLS.value('map_revision') == calls + 1
+
+def busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        sum(range(100))
+
+def test_profile_samples_the_thread():
+    profile = profiler.Profile('busy').start()
+    busy(0.1)
+    profile.stop()
+    assert profile.samples > 0
+    assert 'busy (test_metrics.py' in profile.collapsed()
+    assert profiler.find(profile.id) is profile
+    assert abs(sum(row['share'] for row in profile.top(1000)) - 1) < 1e-9
+
+def test_profiled_requests(client, map_label, monkeypatch):
+    monkeypatch.setattr(app, 'PROFILE_REQUESTS', True)
+    response = client.get(f'/connect_obs?map={map_label}&profile=1')
+    profile_id = int(response.headers['X-Profile-Id'])
+    assert profile_id in [profile['id'] for profile in client.get('/profiles').get_json()['profiles']]
+    assert client.get(f'/profiles/{profile_id}').status_code == 200
+    assert 'X-Profile-Id' not in client.get(f'/connect_obs?map={map_label}').headers
+    assert client.get('/profiles/0').status_code == 404
@@ -0,0 +1,100 @@
+import random
+import pytest
+import multiagent
+import route
+from grids import free_cells, random_map
+from map import Map
+
+def cell_at(path, t, stay):
+    if t < len(path):
+        return path[t]
+    return path[-1] if stay else None
+
+# Vertex and swap conflicts between the planned paths
+def conflicts(paths, stay=True):
+    found = []
+    for t in range(max(len(path) for path in paths)):
+        now = [cell_at(path, t, stay) for path in paths]
+        after = [cell_at(path, t + 1, stay) for path in paths]
+        for i in range(len(paths)):
+            for j in range(i + 1, len(paths)):
+                if now[i] is not None and now[i] == now[j]:
+                    found.append(('cell', i, j, t))
+                elif None not in (now[i], now[j], after[i], after[j]) and now[i] == after[j] and now[j] == after[i] \
+                        and now[i] != now[j]:
+                    found.append(('move', i, j, t))
+    return found
+
+def check_path(map_instance, path, start, targets, end):
+    assert path[0] == start and path[-1] == end
+    assert set(targets) <= set(path)
+    for a, b in zip(path, path[1:]):
+        assert a == b or (abs(a[0] - b[0]) + abs(a[1] - b[1]) == 1 and map_instance.is_valid(*b))
+
+# A one-cell corridor along x = 1 with a side pocket at (0, 2)
+def corridor():
+    map_instance = Map(3, 7)
+    map_instance.obstacles |= {(x, y) for x in (0, 2) for y in range(7)} - {(0, 2)}
+    return map_instance
+
+@pytest.mark.parametrize('mode', ['cooperative', 'cbs'])
+def test_pickers_pass_each_other_in_a_corridor(mode):
+    map_instance = corridor()
+    pickers = [((1, 0), [], (1, 6)), ((1, 6), [], (1, 0))]
+    used, paths = multiagent.plan_team(map_instance, pickers, mode)
+    assert used == mode
+    for path, (start, targets, end) in zip(paths, pickers):
+        check_path(map_instance, path, start, targets, end)
+    assert conflicts(paths) == []
+    # One of them steps into the pocket to let the other one by
+    assert any((0, 2) in path for path in paths)
+
+@pytest.mark.parametrize('seed', range(3))
+def test_random_teams_have_no_conflicts(seed):
+    rnd = random.Random(seed)
+    map_instance = random_map(rnd, 14, 14, clutter=0.15)
+    cells = free_cells(map_instance)
+    rnd.shuffle(cells)
+    pickers = [(cells[k], [cells[10 + k]], cells[20 + k]) for k in range(4)]
+    costs = {}
+    for mode in ('cooperative', 'cbs'):
+        _, paths = multiagent.plan_team(map_instance, pickers, mode)
+        assert None not in paths
+        for path, (start, targets, end) in zip(paths, pickers):
+            check_path(map_instance, path, start, targets, end)
+        assert conflicts(paths) == []
+        costs[mode] = sum(len(path) - 1 for path in paths)
+    assert costs['cbs'] <= costs['cooperative']
+
+def test_pickers_leaving_the_floor_share_a_dock():
+    map_instance = Map(6, 6)
+    pickers = [((0, 0), [(2, 2)], (5, 5)), ((0, 5), [(3, 1)], (5, 5))]
+    _, paths = multiagent.plan_team(map_instance, pickers, stay=False)
+    assert [path[-1] for path in paths] == [(5, 5), (5, 5)]
+    assert conflicts(paths, stay=False) == []
+    with pytest.raises(ValueError):
+        multiagent.plan_team(map_instance, pickers)
+
+def test_bad_teams_are_refused():
+    map_instance = corridor()
+    with pytest.raises(ValueError):
+        multiagent.plan_team(map_instance, [((1, 0), [], (1, 5)), ((1, 0), [], (1, 6))])
+    with pytest.raises(route.Unreachable):
+        multiagent.plan_team(map_instance, [((1, 0), [(2, 2)], (1, 6))])
+
+def post_team(client, label, **body):
+    pickers = [{'start': {'row': 0, 'col': 0}, 'goals': [{'row': 4, 'col': 4}], 'end': {'row': 9, 'col': 0}},
+               {'start': {'row': 9, 'col': 0}, 'goals': [{'row': 4, 'col': 5}], 'end': {'row': 0, 'col': 0}}]
+    return client.post('/plan_team', json={'map': label, 'pickers': pickers, **body})
+
+def test_plan_team_endpoint(client, map_label):
+    answer = post_team(client, map_label, mode='cbs').get_json()
+    assert answer['mode'] == 'cbs' and answer['unplanned'] == []
+    paths = [[tuple(cell) for cell in path] for path in answer['paths']]
+    assert conflicts(paths) == []
+    assert answer['makespan'] == max(len(path) - 1 for path in paths)
+    assert answer['sum_of_costs'] == sum(len(path) - 1 for path in paths)
+
+@pytest.mark.parametrize('body', [{'mode': 'fastest'}, {'time_budget': -1}])
+def test_plan_team_bad_parameters_answer_400(client, map_label, body):
+    assert post_team(client, map_label, **body).status_code == 400
@@ -0,0 +1,77 @@
+import pytest
+import orders
+from grids import is_walk
+from map import Map
+
+def stocked_map():
+    map_instance = Map(12, 12)
+    map_instance.shelves[(2, 2)] = {'flower': 'rose', 'color': 'red', 'quantity': 4}
+    map_instance.shelves[(10, 10)] = {'flower': 'rose', 'color': 'red', 'quantity': 9}
+    map_instance.shelves[(2, 6)] = {'flower': 'rose', 'color': 'red', 'quantity': 3}
+    map_instance.shelves[(6, 2)] = {'flower': 'tulip', 'color': 'white', 'quantity': 5}
+    return map_instance
+
+def picked(plan):
+    totals = {}
+    for _, _, flower, color, quantity in plan.picks:
+        totals[(flower, color)] = totals.get((flower, color), 0) + quantity
+    return totals
+
+def test_plan_covers_the_order():
+    map_instance = stocked_map()
+    lines = [('rose', 'red', 6), ('tulip', 'white', 2), ('rose', 'red', 1)]
+    plan = orders.plan_order(map_instance, (0, 0), lines)
+    assert picked(plan) == {('rose', 'red'): 7, ('tulip', 'white'): 2}
+    # The two nearby rose shelves cover it, the far one is left alone
+    assert {shelf for shelf, _, _, _, _ in plan.picks} == {(2, 2), (2, 6), (6, 2)}
+    for shelf, stop, _, _, quantity in plan.picks:
+        assert quantity <= map_instance.shelves[shelf]['quantity']
+        assert abs(shelf[0] - stop[0]) + abs(shelf[1] - stop[1]) == 1
+        assert stop in plan.path
+    assert is_walk(map_instance, plan.path, (0, 0), (0, 0))
+
+def test_plan_ends_at_the_dock():
+    plan = orders.plan_order(stocked_map(), (0, 0), [('tulip', 'white', 1)], (11, 0))
+    assert plan.path[0] == (0, 0) and plan.path[-1] == (11, 0)
+
+def test_missing_stock():
+    with pytest.raises(orders.OutOfStock) as e:
+        orders.plan_order(stocked_map(), (0, 0), [('tulip', 'white', 8)])
+    assert (e.value.flower, e.value.color, e.value.missing) == ('tulip', 'white', 3)
+    with pytest.raises(orders.OutOfStock):
+        orders.plan_order(stocked_map(), (0, 0), [('lily', 'white', 1)])
+
+def test_line_without_a_color():
+    with pytest.raises(ValueError):
+        orders.plan_order(stocked_map(), (0, 0), [('rose', None, 1)])
+
+def test_empty_order_goes_to_the_dock():
+    plan = orders.plan_order(stocked_map(), (0, 0), [], (0, 3))
+    assert plan.picks == [] and plan.path == [(0, 0), (0, 1), (0, 2), (0, 3)]
+
+def fulfil(client, label, lines):
+    return client.post('/fulfil_order', json={'map': label, 'start': {'row': 0, 'col': 0}, 'lines': lines})
+
+def test_fulfil_order_reserves_the_stock(client, map_label):
+    client.post('/add_shelf', json={'map': map_label, 'details': [
+        {'row': 3, 'col': 3, 'flower': 'rose', 'color': 'red', 'quantity': 4}]})
+    answer = fulfil(client, map_label, [{'flower': 'rose', 'color': 'red', 'quantity': 3}]).get_json()
+    assert answer['picks'][0]['quantity'] == 3
+    assert answer['changes'] == [{'row': 3, 'col': 3, 'state': 'shelf', 'flower': 'rose', 'color': 'red',
+                                  'quantity': 1}]
+    response = fulfil(client, map_label, [{'flower': 'rose', 'color': 'red', 'quantity': 2}])
+    assert response.status_code == 404
+    assert response.get_json()['missing'] == 1
+
+@pytest.mark.parametrize('lines', [
+    'roses',
+    ['rose'],
+    [{'flower': 'rose', 'quantity': 1}],
+    [{'flower': 'rose', 'color': '', 'quantity': 1}],
+    [{'flower': 7, 'color': 'red', 'quantity': 1}],
+    [{'flower': 'rose', 'color': 'red'}],
+    [{'flower': 'rose', 'color': 'red', 'quantity': 0}],
+    [{'flower': 'rose', 'color': 'red', 'quantity': 'many'}],
+])
+def test_bad_order_lines_answer_400(client, map_label, lines):
+    assert fulfil(client, map_label, lines).status_code == 400
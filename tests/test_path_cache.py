@@ -0,0 +1,100 @@
+import random
+import path_cache
+import search
+from grids import bfs_length, free_cells, random_map
+from map import EDIT_LOG_SIZE, Map
+
+def ids(map_instance, cells):
+    return [map_instance.cell_id(*cell) for cell in cells]
+
+def straight_path(map_instance):
+    # (0, 0) -> (0, 9) along the first column of an open 10x10 map
+    return ids(map_instance, [(0, y) for y in range(10)])
+
+def test_hits_in_both_directions():
+    map_instance = Map(10, 10)
+    cache = path_cache.PathCache()
+    path = straight_path(map_instance)
+    cache.put(map_instance, path[0], path[-1], path)
+    assert cache.get(map_instance, path[0], path[-1]) == (True, path)
+    assert cache.get(map_instance, path[-1], path[0]) == (True, path[::-1])
+    assert cache.get(map_instance, path[0], path[1]) == (False, None)
+    assert cache.stats()['hits'] == 2
+
+def test_blocking_a_cell_only_drops_the_paths_through_it():
+    map_instance = Map(10, 10)
+    cache = path_cache.PathCache()
+    path = straight_path(map_instance)
+    cache.put(map_instance, path[0], path[-1], path)
+    map_instance.obstacles.add((5, 5))  # off the path
+    assert cache.get(map_instance, path[0], path[-1]) == (True, path)
+    assert cache.stats()['revalidations'] == 1
+    map_instance.obstacles.add((0, 5))  # on the path
+    assert cache.get(map_instance, path[0], path[-1]) == (False, None)
+    assert cache.stats()['invalidations'] == 1
+
+def test_freeing_a_cell_drops_the_paths_it_could_shorten():
+    map_instance = Map(10, 10)
+    map_instance.obstacles |= {(1, y) for y in range(9)} | {(8, 8)}
+    start, goal = map_instance.cell_id(0, 0), map_instance.cell_id(2, 0)
+    path = ids(map_instance, search.find_path(map_instance, (0, 0), (2, 0), use_cache=False))
+    cache = path_cache.PathCache()
+    cache.put(map_instance, start, goal, path)
+    map_instance.obstacles.discard((8, 8))  # too far to shorten the detour
+    assert cache.get(map_instance, start, goal)[0]
+    map_instance.obstacles.discard((1, 0))  # a shortcut
+    assert cache.get(map_instance, start, goal) == (False, None)
+
+def test_unreachable_answers_are_dropped_when_a_cell_frees():
+    map_instance = Map(5, 5)
+    map_instance.obstacles |= {(2, y) for y in range(5)}
+    start, goal = map_instance.cell_id(0, 0), map_instance.cell_id(4, 4)
+    cache = path_cache.PathCache()
+    cache.put(map_instance, start, goal, None)
+    assert cache.get(map_instance, start, goal) == (True, None)
+    map_instance.obstacles.add((0, 3))
+    assert cache.get(map_instance, start, goal) == (True, None)
+    map_instance.obstacles.discard((2, 2))
+    assert cache.get(map_instance, start, goal) == (False, None)
+
+def test_entries_older_than_the_edit_log_are_dropped():
+    map_instance = Map(10, 10)
+    cache = path_cache.PathCache()
+    path = straight_path(map_instance)
+    cache.put(map_instance, path[0], path[-1], path)
+    for _ in range(EDIT_LOG_SIZE // 2 + 1):
+        map_instance.obstacles.add((9, 9))
+        map_instance.obstacles.discard((9, 9))
+    assert cache.get(map_instance, path[0], path[-1]) == (False, None)
+
+def test_least_recently_used_entries_go_first():
+    map_instance = Map(10, 10)
+    path = straight_path(map_instance)
+    cache = path_cache.PathCache(max_bytes=2 * (path_cache.ENTRY_OVERHEAD + 4 * len(path)))
+    for y in range(3):
+        row = ids(map_instance, [(x, y) for x in range(10)])
+        cache.put(map_instance, row[0], row[-1], row)
+    stats = cache.stats()
+    assert stats['entries'] == 2 and stats['evictions'] == 1
+    first = map_instance.cell_id(0, 0), map_instance.cell_id(9, 0)
+    assert cache.get(map_instance, *first) == (False, None)
+
+def test_cached_paths_stay_shortest_through_random_edits():
+    rnd = random.Random(5)
+    map_instance = random_map(rnd, 16, 16, clutter=0.2)
+    pairs = [(rnd.choice(free_cells(map_instance)), rnd.choice(free_cells(map_instance))) for _ in range(10)]
+    for _ in range(40):
+        for start, goal in pairs:
+            if not map_instance.is_valid(*start) or not map_instance.is_valid(*goal):
+                continue
+            path = search.find_path(map_instance, start, goal)
+            expected = bfs_length(map_instance, start, goal)
+            assert (path is None) == (expected is None)
+            if path is not None:
+                assert len(path) - 1 == expected
+        cell = (rnd.randrange(16), rnd.randrange(16))
+        if cell in map_instance.obstacles:
+            map_instance.obstacles.discard(cell)
+        else:
+            map_instance.obstacles.add(cell)
+    assert path_cache.cache.stats()['revalidations'] > 0
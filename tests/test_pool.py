@@ -0,0 +1,109 @@
+import threading
+import pytest
+
+psycopg2 = pytest.importorskip('psycopg2')
+import storage_postgres
+from storage_postgres import ConnectionPool, PoolTimeout
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params=None):
+        if self.conn.broken:
+            raise psycopg2.OperationalError("server closed the connection")
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.broken = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+@pytest.fixture
+def connections(monkeypatch):
+    opened = []
+    def connect(**params):
+        opened.append(FakeConnection())
+        return opened[-1]
+    monkeypatch.setattr(storage_postgres.psycopg2, 'connect', connect)
+    return opened
+
+def test_connections_are_reused(connections):
+    pool = ConnectionPool({}, size=2)
+    for _ in range(5):
+        with pool.connection():
+            pass
+    assert len(connections) == 1
+    assert pool.stats()['checkouts'] == 5
+
+def test_nested_checkout_shares_the_connection(connections):
+    pool = ConnectionPool({}, size=1, timeout=0.1)
+    with pool.connection() as outer:
+        with pool.connection() as inner:
+            assert inner is outer
+    assert pool.stats()['in_use'] == 0
+
+def test_checkout_waits_for_a_free_connection(connections):
+    pool = ConnectionPool({}, size=1, timeout=0.05)
+    held = threading.Event()
+    release = threading.Event()
+    def hold():
+        with pool.connection():
+            held.set()
+            release.wait()
+    thread = threading.Thread(target=hold)
+    thread.start()
+    held.wait()
+    with pytest.raises(PoolTimeout):
+        with pool.connection():
+            pass
+    release.set()
+    thread.join()
+    with pool.connection():
+        pass
+    assert len(connections) == 1
+
+def test_broken_connection_is_replaced(connections):
+    pool = ConnectionPool({}, size=1)
+    with pytest.raises(psycopg2.OperationalError):
+        with pool.connection() as conn:
+            raise psycopg2.OperationalError("server closed the connection")
+    assert conn.closed
+    with pool.connection() as fresh:
+        assert fresh is not conn
+    assert pool.stats()['discarded'] == 1
+
+def test_idle_connection_is_health_checked(connections):
+    pool = ConnectionPool({}, size=1, health_check_interval=0)
+    with pool.connection() as conn:
+        pass
+    conn.broken = True
+    with pool.connection() as fresh:
+        assert fresh is not conn
+    stats = pool.stats()
+    assert stats['health_checks'] == 1
+    assert stats['reconnects'] == 1
+
+def test_resize_closes_idle_connections(connections):
+    pool = ConnectionPool({}, size=2)
+    with pool.connection():
+        with pool.connection():
+            pass
+    first = connections[0]
+    pool.resize(0)
+    assert first.closed
+    assert pool.stats()['opened'] == 0
@@ -0,0 +1,49 @@
+import threading
+import time
+import registry
+import server
+import snapshot
+
+def test_label_and_id_share_one_load(map_label, monkeypatch):
+    map_id = server.map_revision(map_label)[0]
+    maps = registry.MapRegistry()
+    load_map = snapshot.load_map
+    def slow_load(*args, **kwargs):
+        time.sleep(0.05)
+        return load_map(*args, **kwargs)
+    monkeypatch.setattr(snapshot, 'load_map', slow_load)
+    found = []
+    threads = [threading.Thread(target=lambda key=key: found.append(maps.get(key)))
+               for key in (map_label, map_id, map_label, map_id)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert found[0] is not None
+    assert all(map_instance is found[0] for map_instance in found)
+    assert maps.stats()['loads'] == 1
+
+def test_missing_map():
+    maps = registry.MapRegistry()
+    assert maps.get('test_registry_missing') is None
+    map_instance = maps.get('test_registry_missing', create=(8, 6))
+    assert (map_instance.width, map_instance.height) == (8, 6)
+    assert maps.get('test_registry_missing') is map_instance
+    assert maps.get(map_instance.id) is map_instance
+    assert maps.stats()['created'] == 1
+
+def test_least_recently_used_map_is_dropped(map_label):
+    maps = registry.MapRegistry()
+    first = maps.get(map_label)
+    second = maps.get('test_registry_second', create=(20, 20))
+    dropped = []
+    maps.evict_listeners.append(dropped.append)
+    maps.resize(first.memory_bytes() + second.memory_bytes())
+    assert dropped == []
+    maps.get(map_label)  # the first map is now the most recent
+    maps.resize(first.memory_bytes())
+    assert dropped == [second]
+    assert [loaded['label'] for loaded in maps.loaded()] == [map_label]
+    # Loaded again on its next request
+    again = maps.get('test_registry_second')
+    assert again is not second and again.id == second.id
@@ -0,0 +1,88 @@
+import random
+import pytest
+import replan
+from grids import bfs_length, is_walk, random_map
+from map import Map
+
+def toggle(map_instance, cell):
+    if cell in map_instance.obstacles:
+        map_instance.obstacles.discard(cell)
+    else:
+        map_instance.obstacles.add(cell)
+
+@pytest.mark.parametrize('seed', range(4))
+def test_repaired_paths_stay_shortest(seed):
+    rnd = random.Random(seed)
+    map_instance = random_map(rnd, 16, 16, clutter=0.2)
+    start, goal = (0, 0), (15, 15)
+    map_instance.obstacles.discard(start)
+    map_instance.obstacles.discard(goal)
+    planner = replan.DStarLite(map_instance, map_instance.cell_id(*start), map_instance.cell_id(*goal))
+    map_instance.listeners.append(planner.cell_changed)
+    position = start
+    for _ in range(30):
+        path = planner.path()
+        expected = bfs_length(map_instance, position, goal)
+        if expected is None:
+            assert path is None
+        else:
+            cells = [map_instance.cell_xy(i) for i in path]
+            assert is_walk(map_instance, cells, position, goal)
+            assert len(cells) - 1 == expected
+            if len(cells) > 1:
+                position = cells[1]
+                planner.move_to(path[1])
+        for _ in range(3):
+            cell = (rnd.randrange(16), rnd.randrange(16))
+            if cell not in (position, goal):
+                toggle(map_instance, cell)
+
+def test_session_keeps_the_given_visiting_order():
+    map_instance = Map(10, 10)
+    waypoints = [(9, 0), (0, 9), (9, 9)]
+    session = replan.RouteSession(map_instance, (0, 0), [(0, 9), (9, 0)], (9, 9), waypoints=waypoints)
+    path = session.path()
+    assert is_walk(map_instance, path, (0, 0), (9, 9))
+    assert path.index((9, 0)) < path.index((0, 9))
+    assert len(path) - 1 == 9 + 18 + 9
+    session.close()
+    assert session.cell_changed not in map_instance.listeners
+
+def test_session_repairs_its_route_after_edits_and_moves():
+    map_instance = Map(10, 10)
+    session = replan.RouteSession(map_instance, (0, 0), [(5, 5)], (9, 9))
+    assert len(session.path()) - 1 == 18
+    map_instance.obstacles |= {(x, 3) for x in range(9)}
+    path = session.path()
+    assert is_walk(map_instance, path, (0, 0), (9, 9))
+    assert (9, 3) in path and (5, 5) in path
+    assert len(path) - 1 == 12 + 6 + 8
+    session.move_to(path[1])
+    assert session.path()[0] == path[1]
+    map_instance.obstacles.add((9, 3))
+    assert session.path() is None
+    session.close()
+
+def start_simulation(client, map_label, session):
+    return client.post('/run_simulation', json={'map': map_label, 'session': session, 'start': {'row': 0, 'col': 0},
+                                                'goal': {'row': 9, 'col': 9}, 'goals': [{'row': 3, 'col': 7}]})
+
+def test_route_sessions_are_capped(client, map_label, monkeypatch):
+    import app
+    monkeypatch.setattr(app, 'MAX_ROUTE_SESSIONS', 2)
+    for session in ('a', 'b', 'c'):
+        assert start_simulation(client, map_label, session).status_code == 200
+    state = [state for state in app.states.values() if state.map.label == map_label][0]
+    route_sessions = state.route_sessions
+    assert list(route_sessions) == ['b', 'c']
+    assert client.post('/update_route', json={'map': map_label, 'session': 'a'}).status_code == 404
+    response = client.post('/update_route', json={'map': map_label, 'session': 'c', 'position': {'row': 0, 'col': 1}})
+    assert response.status_code == 200
+    assert response.get_json()['path'][0] == [0, 1]
+
+def test_idle_route_sessions_expire(client, map_label, monkeypatch):
+    import app
+    assert start_simulation(client, map_label, 'idle').status_code == 200
+    assert client.post('/update_route', json={'map': map_label, 'session': 'idle'}).status_code == 200
+    monkeypatch.setattr(app, 'ROUTE_SESSION_IDLE', -1)
+    assert client.post('/update_route', json={'map': map_label, 'session': 'idle'}).status_code == 404
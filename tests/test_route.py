@@ -0,0 +1,84 @@
+import itertools
+import random
+import pytest
+import route
+from grids import bfs_length, is_walk
+from map import Map, plan_path
+
+def random_matrix(rnd, n):
+    points = [(rnd.randrange(30), rnd.randrange(30)) for _ in range(n)]
+    return [[abs(a[0] - b[0]) + abs(a[1] - b[1]) for b in points] for a in points]
+
+def best_length(dist):
+    n = len(dist)
+    return min(route.route_length([0] + list(middle) + [n - 1], dist)
+               for middle in itertools.permutations(range(1, n - 1)))
+
+@pytest.mark.parametrize('seed', range(6))
+def test_held_karp_is_optimal(seed):
+    dist = random_matrix(random.Random(seed), 8)
+    order = route.held_karp(dist)
+    assert order[0] == 0 and order[-1] == 7 and sorted(order) == list(range(8))
+    assert route.route_length(order, dist) == best_length(dist)
+
+def test_local_search_never_worsens_nearest_neighbor():
+    dist = random_matrix(random.Random(1), route.HELD_KARP_MAX + 10)
+    start = route.nearest_neighbor(dist)
+    order = route.solve_order(dist, time_budget=0.05)
+    assert sorted(order) == list(range(len(dist)))
+    assert order[0] == 0 and order[-1] == len(dist) - 1
+    assert route.route_length(order, dist) <= route.route_length(start, dist)
+
+def test_route_follows_walking_distances():
+    # The target just across the wall is far on foot, so it is picked last
+    map_instance = Map(10, 10)
+    map_instance.obstacles |= {(5, y) for y in range(9)}
+    targets = [(6, 0), (4, 8), (1, 1)]
+    path = plan_path(map_instance, (0, 0), targets, (0, 0))
+    assert is_walk(map_instance, path, (0, 0), (0, 0))
+    assert set(targets) <= set(path)
+    assert route.order_along(path, targets, (0, 0)) == [(1, 1), (4, 8), (6, 0), (0, 0)]
+    cells = [(0, 0)] + targets + [(0, 0)]
+    dist = [[bfs_length(map_instance, a, b) for b in cells] for a in cells]
+    assert len(path) - 1 == best_length(dist)
+
+def test_unreachable_targets_are_refused():
+    map_instance = Map(6, 6)
+    map_instance.obstacles |= {(3, y) for y in range(6)}
+    with pytest.raises(route.Unreachable) as e:
+        route.plan_route(map_instance, (0, 0), [(1, 1), (5, 5)], (0, 0))
+    assert (e.value.cell, e.value.reason) == ((5, 5), 'unreachable')
+    with pytest.raises(route.Unreachable) as e:
+        route.plan_route(map_instance, (0, 0), [(3, 2)], (0, 0))
+    assert e.value.reason == 'blocked'
+    with pytest.raises(route.Unreachable) as e:
+        route.plan_route(map_instance, (0, 0), [(6, 0)], (0, 0))
+    assert e.value.reason == 'out of bounds'
+
+# A robot on a blocked cell may leave it but never come back
+def test_target_on_a_blocked_start():
+    map_instance = Map(6, 6)
+    map_instance.obstacles.add((2, 2))
+    path = route.plan_route(map_instance, (2, 2), [(4, 4), (2, 2)], (0, 0))
+    assert path[0] == (2, 2) and path[-1] == (0, 0)
+    assert len(path) - 1 == 12
+    assert route.visit_order(map_instance, (2, 2), [(2, 2), (4, 4)], (0, 0)) == [(2, 2), (4, 4), (0, 0)]
+    with pytest.raises(route.Unreachable):
+        route.plan_route(map_instance, (2, 2), [(4, 4)], (2, 2))
+
+@pytest.mark.parametrize('budget', ['soon', -1, 'nan', 'inf', True, [1]])
+def test_bad_time_budget_answers_400(client, map_label, budget):
+    response = client.post('/run_simulation', json={'map': map_label, 'start': {'row': 0, 'col': 0},
+                                                    'goal': {'row': 5, 'col': 5}, 'goals': [{'row': 2, 'col': 3}],
+                                                    'time_budget': budget})
+    assert response.status_code == 400
+
+def test_simulation_plans_through_every_goal(client, map_label):
+    goals = [{'row': 2, 'col': 3}, {'row': 7, 'col': 1}]
+    response = client.post('/run_simulation', json={'map': map_label, 'start': {'row': 0, 'col': 0},
+                                                    'goal': {'row': 5, 'col': 5}, 'goals': goals,
+                                                    'time_budget': '0.1'})
+    assert response.status_code == 200
+    path = [tuple(cell) for cell in response.get_json()['path']]
+    assert path[0] == (0, 0) and path[-1] == (5, 5)
+    assert {(2, 3), (7, 1)} <= set(path)
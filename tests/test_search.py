@@ -0,0 +1,59 @@
+import random
+import pytest
+import search
+from bench_search import legacy_astar
+from grids import bfs_length, free_cells, is_walk, random_map
+from map import Map, astar
+
+def queries(rnd, map_instance, count):
+    cells = free_cells(map_instance)
+    return [(rnd.choice(cells), rnd.choice(cells)) for _ in range(count)]
+
+@pytest.mark.parametrize('seed', range(5))
+def test_astar_lengths_match_breadth_first_search(seed):
+    rnd = random.Random(seed)
+    map_instance = random_map(rnd, 25, 18)
+    for start, goal in queries(rnd, map_instance, 30):
+        path = search.find_path(map_instance, start, goal, use_cache=False)
+        expected = bfs_length(map_instance, start, goal)
+        if expected is None:
+            assert path is None
+        else:
+            assert is_walk(map_instance, path, start, goal)
+            assert len(path) - 1 == expected
+
+@pytest.mark.parametrize('seed', range(5))
+def test_astar_returns_the_cells_of_the_original_astar(seed):
+    rnd = random.Random(seed)
+    map_instance = random_map(rnd, 20, 20, clutter=0.25)
+    for start, goal in queries(rnd, map_instance, 30):
+        assert astar(map_instance, start=start, goal=goal) == legacy_astar(map_instance, start, goal)
+
+def test_tie_break_toward_goal_keeps_the_length():
+    rnd = random.Random(7)
+    map_instance = random_map(rnd, 30, 30, clutter=0.1)
+    for start, goal in queries(rnd, map_instance, 20):
+        default = search.find_path(map_instance, start, goal, use_cache=False)
+        toward_goal = search.find_path(map_instance, start, goal, True, use_cache=False)
+        assert (default is None) == (toward_goal is None)
+        if default is not None:
+            assert len(default) == len(toward_goal)
+            assert is_walk(map_instance, toward_goal, start, goal)
+
+def test_buffers_survive_the_generation_wraparound():
+    map_instance = Map(6, 6)
+    engine = search.engine_for(map_instance)
+    assert search.engine_for(map_instance) is engine
+    engine.generation = search.MAX_GENERATION
+    path = search.find_path(map_instance, (0, 0), (5, 5), use_cache=False)
+    assert len(path) == 11
+    assert engine.generation == 1
+
+def test_no_path_and_cells_outside_the_map():
+    map_instance = Map(5, 5)
+    map_instance.obstacles |= {(2, y) for y in range(5)}
+    assert search.find_path(map_instance, (0, 0), (4, 4)) is None
+    assert search.find_path(map_instance, (0, 0), (9, 9)) is None
+    assert search.find_path(map_instance, (1, 1), (1, 1)) == [(1, 1)]
+    with pytest.raises(ValueError):
+        search.find_path(map_instance, (0, 0), (1, 1), algorithm='dijkstra')
@@ -0,0 +1,73 @@
+import os
+import pytest
+import server
+import snapshot
+from snapshot import SnapshotError
+
+SHELVES = [(3, 4, 'rose', 'red', 5), (7, 1, 'tulip', None, 2)]
+
+@pytest.fixture
+def stocked_label(map_label):
+    map_id = server.map_revision(map_label)[0]
+    assert server.add_obstacles_bulk(map_id, [(1, 1), (2, 5), (19, 19)])
+    assert server.add_shelves_bulk(map_id, SHELVES)
+    return map_label
+
+def contents(map_instance):
+    return set(map_instance.obstacles), dict(map_instance.shelves)
+
+def expected():
+    shelves = {(x, y): {'flower': flower, 'color': color, 'quantity': quantity}
+               for x, y, flower, color, quantity in SHELVES}
+    return {(1, 1), (2, 5), (19, 19)} | set(shelves), shelves
+
+def test_snapshot_round_trip(stocked_label, tmp_path):
+    loaded = snapshot.load_map(stocked_label, directory=str(tmp_path))
+    path = snapshot.snapshot_path(loaded.id, str(tmp_path))
+    again = snapshot.load_snapshot(path)
+    assert contents(again) == contents(loaded) == expected()
+    assert (again.id, again.label, again.revision) == (loaded.id, stocked_label, loaded.revision)
+    assert (again.width, again.height) == (20, 20)
+
+def test_current_snapshot_skips_the_database(stocked_label, tmp_path, monkeypatch):
+    snapshot.load_map(stocked_label, directory=str(tmp_path))
+    monkeypatch.setattr(snapshot, 'get_map_data', lambda *args, **kwargs: pytest.fail("read the database"))
+    assert contents(snapshot.load_map(stocked_label, directory=str(tmp_path))) == expected()
+
+def test_stale_snapshot_is_rewritten(stocked_label, tmp_path):
+    first = snapshot.load_map(stocked_label, directory=str(tmp_path))
+    path = snapshot.snapshot_path(first.id, str(tmp_path))
+    assert server.remove_obstacles_bulk(first.id, [(1, 1)])
+    assert snapshot.snapshot_stamp(path) == (first.id, first.revision)
+    second = snapshot.load_map(stocked_label, directory=str(tmp_path))
+    assert (1, 1) not in second.obstacles
+    assert snapshot.snapshot_stamp(path) == (first.id, second.revision) != (first.id, first.revision)
+
+def test_corrupt_snapshot_is_refused(stocked_label, tmp_path):
+    loaded = snapshot.load_map(stocked_label, directory=str(tmp_path))
+    path = snapshot.snapshot_path(loaded.id, str(tmp_path))
+    with open(path, 'r+b') as file:
+        file.seek(os.path.getsize(path) - 10)
+        byte = file.read(1)
+        file.seek(-1, os.SEEK_CUR)
+        file.write(bytes([byte[0] ^ 0xFF]))
+    with pytest.raises(SnapshotError):
+        snapshot.load_snapshot(path)
+    # Read from the database instead, and written again
+    assert contents(snapshot.load_map(stocked_label, directory=str(tmp_path))) == expected()
+    assert contents(snapshot.load_snapshot(path)) == expected()
+
+def test_not_a_snapshot(tmp_path):
+    for data in (b'', b'WHMAP', b'NOTASNAP' + bytes(64)):
+        path = tmp_path / 'bad.snap'
+        path.write_bytes(data)
+        with pytest.raises(SnapshotError):
+            snapshot.load_snapshot(str(path))
+
+def test_import_snapshot(stocked_label, tmp_path):
+    loaded = snapshot.load_map(stocked_label, directory=str(tmp_path))
+    map_id = snapshot.import_snapshot(snapshot.snapshot_path(loaded.id, str(tmp_path)), 'test_imported')
+    assert map_id is not None and map_id != loaded.id
+    imported = snapshot.load_map(map_id=map_id)
+    assert imported.label == 'test_imported'
+    assert contents(imported) == expected()
@@ -0,0 +1,75 @@
+import gzip
+import json
+import app
+
+def listed(client, path, label):
+    return client.get(f'{path}?map={label}').get_json()
+
+def obstacle_cells(client, label):
+    return {(entry['row'], entry['col']) for entry in listed(client, '/connect_obs', label)}
+
+def shelf_cells(client, label):
+    return {tuple(entry['position']): (entry['flower'], entry['quantity'])
+            for entry in listed(client, '/connect_shel', label)}
+
+def stock(client, label):
+    client.post('/add_obstacle', json={'map': label, 'positions': [{'row': 1, 'col': 2}, {'row': 3, 'col': 4}]})
+    client.post('/add_shelf', json={'map': label, 'details': [
+        {'row': 5, 'col': 5, 'flower': 'rose', 'color': 'red', 'quantity': 9},
+        {'row': 6, 'col': 1, 'flower': 'lily', 'color': 'white', 'quantity': 4}]})
+
+def test_lists_follow_the_edits(client, map_label):
+    assert listed(client, '/connect_obs', map_label) == []
+    stock(client, map_label)
+    assert obstacle_cells(client, map_label) == {(1, 2), (3, 4), (5, 5), (6, 1)}
+    assert shelf_cells(client, map_label) == {(5, 5): ('rose', 9), (6, 1): ('lily', 4)}
+    # A single position may come as a dict
+    client.post('/remove_obstacle', json={'map': map_label, 'position': {'row': 3, 'col': 4}})
+    client.post('/remove_shelf', json={'map': map_label, 'position': [{'row': 6, 'col': 1}]})
+    assert obstacle_cells(client, map_label) == {(1, 2), (5, 5)}
+    assert shelf_cells(client, map_label) == {(5, 5): ('rose', 9)}
+
+def test_reset_empties_the_lists(client, map_label):
+    stock(client, map_label)
+    client.post('/reset_map', json={'map': map_label})
+    assert listed(client, '/connect_obs', map_label) == []
+    assert listed(client, '/connect_shel', map_label) == []
+
+def test_get_shelf(client, map_label):
+    stock(client, map_label)
+    everything = client.post('/get_shelf', json={'map': map_label}).get_json()
+    assert everything == listed(client, '/connect_shel', map_label)
+    picked = client.post('/get_shelf', json={'map': map_label, 'selectedCells': [{'row': 5, 'col': 5}]})
+    assert picked.get_json() == [{'flower': 'rose', 'color': 'red', 'quantity': 9}]
+    missing = client.post('/get_shelf', json={'map': map_label, 'selectedCells': [{'row': 0, 'col': 0}]})
+    assert missing.get_json() is None
+
+def test_gzipped_lists(client, map_label):
+    stock(client, map_label)
+    plain = client.get(f'/connect_shel?map={map_label}')
+    zipped = client.get(f'/connect_shel?map={map_label}', headers={'Accept-Encoding': 'gzip'})
+    assert zipped.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in zipped.headers['Vary']
+    assert json.loads(gzip.decompress(zipped.data)) == plain.get_json()
+    assert zipped.headers['ETag'] == plain.headers['ETag'][:-1] + '-gzip"'
+    # The ETag of one encoding doesn't answer for the other
+    again = client.get(f'/connect_shel?map={map_label}',
+                       headers={'Accept-Encoding': 'gzip', 'If-None-Match': plain.headers['ETag']})
+    assert again.status_code == 200
+    again = client.get(f'/connect_shel?map={map_label}',
+                       headers={'Accept-Encoding': 'gzip', 'If-None-Match': zipped.headers['ETag']})
+    assert again.status_code == 304
+
+def test_lists_are_built_once_per_version(client, map_label, monkeypatch):
+    built = []
+    def obstacles_json(map_instance):
+        built.append(map_instance.version)
+        return []
+    monkeypatch.setitem(app.PAYLOADS, 'obstacles', obstacles_json)
+    for _ in range(3):
+        client.get(f'/connect_obs?map={map_label}')
+        client.get(f'/connect_obs?map={map_label}', headers={'Accept-Encoding': 'gzip'})
+    assert len(built) == 1
+    stock(client, map_label)
+    client.get(f'/connect_obs?map={map_label}')
+    assert len(built) == 2 and built[1] > built[0]
@@ -0,0 +1,66 @@
+import pytest
+from map import Map
+
+def stocked_map():
+    map_instance = Map(10, 10)
+    map_instance.shelves[(1, 1)] = {'flower': 'rose', 'color': 'red', 'quantity': 5}
+    map_instance.shelves[(1, 3)] = {'flower': 'rose', 'color': 'white', 'quantity': 1}
+    map_instance.shelves[(4, 4)] = {'flower': 'tulip', 'color': 'red', 'quantity': 8}
+    return map_instance
+
+def test_find_stock_by_product():
+    map_instance = stocked_map()
+    assert sorted(map_instance.find_stock('rose')) == [(1, 1), (1, 3)]
+    assert sorted(map_instance.find_stock(color='red')) == [(1, 1), (4, 4)]
+    assert map_instance.find_stock('rose', 'white') == [(1, 3)]
+    assert sorted(map_instance.find_stock()) == [(1, 1), (1, 3), (4, 4)]
+    assert map_instance.find_stock('rose', quantity=2) == [(1, 1)]
+    assert map_instance.find_stock('lily') == []
+
+def test_stock_index_follows_the_shelves():
+    map_instance = stocked_map()
+    map_instance.shelves[(1, 1)] = {'flower': 'lily', 'color': 'red', 'quantity': 5}
+    assert map_instance.find_stock('rose') == [(1, 3)]
+    assert map_instance.find_stock('lily') == [(1, 1)]
+    map_instance.obstacles.discard((1, 3))
+    assert map_instance.find_stock('rose') == []
+    del map_instance.shelves[(4, 4)]
+    assert map_instance.find_stock('tulip') == []
+    # Quantities are read when looking up
+    map_instance.shelves[(1, 1)]['quantity'] = 0
+    assert map_instance.find_stock('lily') == []
+
+def post_stock(client, label, **body):
+    return client.post('/find_stock', json={'map': label, 'start': {'row': 0, 'col': 0}, **body})
+
+@pytest.fixture
+def walled_label(client, map_label):
+    # The tulips at (0, 4) are nearer as the crow flies, the wall along y = 3
+    # makes those at (6, 0) nearer on foot
+    client.post('/add_obstacle', json={'map': map_label, 'positions': [{'row': x, 'col': 3} for x in range(6)]})
+    client.post('/add_shelf', json={'map': map_label, 'details': [
+        {'row': 0, 'col': 4, 'flower': 'tulip', 'color': 'red', 'quantity': 3},
+        {'row': 6, 'col': 0, 'flower': 'tulip', 'color': 'red', 'quantity': 1}]})
+    return map_label
+
+def test_nearest_shelf_by_walking_distance(client, walled_label):
+    shelves = post_stock(client, walled_label, flower='tulip', k=2).get_json()['shelves']
+    assert [shelf['position'] for shelf in shelves] == [[6, 0], [0, 4]]
+    assert shelves[0]['distance'] == 5 < shelves[1]['distance']
+    for shelf in shelves:
+        assert len(shelf['path']) - 1 == shelf['distance']
+        assert shelf['path'][0] == [0, 0]
+    shelves = post_stock(client, walled_label, flower='tulip', quantity=2).get_json()['shelves']
+    assert [shelf['position'] for shelf in shelves] == [[0, 4]]
+
+def test_no_stock_answers_404(client, walled_label):
+    assert post_stock(client, walled_label, flower='lily').status_code == 404
+    assert post_stock(client, walled_label, flower='tulip', quantity=10).status_code == 404
+
+@pytest.mark.parametrize('body', [{'k': 0}, {'k': 'two'}, {'k': True}, {'quantity': -1}, {'quantity': [2]}])
+def test_bad_parameters_answer_400(client, walled_label, body):
+    assert post_stock(client, walled_label, flower='tulip', **body).status_code == 400
+
+def test_blocked_start_answers_400(client, walled_label):
+    response = client.post('/find_stock', json={'map': walled_label, 'start': {'row': 0, 'col': 3}, 'flower': 'tulip'})
+    assert response.status_code == 400
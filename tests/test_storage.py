@@ -0,0 +1,125 @@
+import pytest
+import server
+import storage
+from map import Map
+
+# Every test runs against each embedded backend, through the Storage interface
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmp_path):
+    options = {'path': str(tmp_path / 'warehouse.db')} if request.param == 'sqlite' else {}
+    opened = storage.open_storage(request.param, **options)
+    opened.create_tables()
+    yield opened
+    opened.close()
+
+def cells(store, map_id):
+    with store.map_rows(map_id=map_id) as found:
+        return {(x, y): (flower, color, quantity) for x, y, flower, color, quantity in found[5]}
+
+def revision(store, map_id):
+    return store.map_revision(map_id=map_id)[1]
+
+def test_maps_by_label_and_id(store):
+    first = store.create_map(20, 10, 'north')
+    second = store.create_map(5, 5, 'north')
+    assert first != second
+    # The oldest map wins a shared label
+    assert store.map_revision('north')[0] == first
+    assert store.map_revision(map_id=second) == (second, 0)
+    with store.map_rows('north') as found:
+        assert found[:5] == (first, 20, 10, 'north', 0) and list(found[5]) == []
+    store.delete_map(first)
+    assert store.map_revision(map_id=first) is None
+    assert store.map_revision('north')[0] == second
+    assert store.map_revision('south') is None
+    with store.map_rows('south') as found:
+        assert found is None
+
+def test_edits_round_trip(store):
+    map_id = store.create_map(10, 10, 'edits')
+    store.add_obstacle(map_id, 1, 1)
+    store.add_obstacles_bulk(map_id, [(2, 2), (3, 3)])
+    store.add_shelf(map_id, 4, 4, 'rose', 'red', 7)
+    store.add_shelves_bulk(map_id, [(5, 5, 'lily', 'white', 2), (6, 6, 'tulip', None, 1)])
+    assert cells(store, map_id) == {(1, 1): (None, None, None), (2, 2): (None, None, None),
+                                    (3, 3): (None, None, None), (4, 4): ('rose', 'red', 7),
+                                    (5, 5): ('lily', 'white', 2), (6, 6): ('tulip', None, 1)}
+    assert revision(store, map_id) == 4
+    # Shelves are overwritten, an obstacle on a shelf is a plain obstacle again
+    store.add_shelf(map_id, 4, 4, 'rose', 'red', 3)
+    store.add_obstacle(map_id, 5, 5)
+    store.remove_obstacle(map_id, 1, 1)
+    store.remove_obstacles_bulk(map_id, [(2, 2), (6, 6)])
+    assert cells(store, map_id) == {(3, 3): (None, None, None), (4, 4): ('rose', 'red', 3),
+                                    (5, 5): (None, None, None)}
+    # Removing a shelf frees its cell, plain obstacles stay
+    store.remove_shelves_bulk(map_id, [(4, 4), (3, 3)])
+    store.remove_shelf(map_id, 5, 5)
+    assert cells(store, map_id) == {(3, 3): (None, None, None), (5, 5): (None, None, None)}
+    assert revision(store, map_id) == 10
+
+def test_apply_changes_keeps_the_final_state(store):
+    map_id = store.create_map(10, 10, 'changes')
+    store.apply_changes(map_id, [((1, 1), 'obstacle'), ((2, 2), ('shelf', 'rose', 'red', 1)), ((1, 1), None),
+                                 ((3, 3), 'obstacle'), ((2, 2), ('shelf', 'rose', 'red', 4))])
+    assert cells(store, map_id) == {(2, 2): ('rose', 'red', 4), (3, 3): (None, None, None)}
+    assert revision(store, map_id) == 1
+
+@pytest.mark.parametrize('changes', [
+    [((1, 1), 'obstacle'), (('x', 2), 'obstacle')],
+    [((1, 1), 'obstacle'), ((2, 2), 'wall')],
+    [((1, 1), 'obstacle'), ((2, 2), ('shelf', 'rose'))],
+])
+def test_bad_change_writes_nothing(store, changes):
+    map_id = store.create_map(10, 10, 'atomic')
+    store.add_shelf(map_id, 5, 5, 'rose', 'red', 1)
+    with pytest.raises(Exception):
+        store.apply_changes(map_id, changes)
+    assert cells(store, map_id) == {(5, 5): ('rose', 'red', 1)}
+    assert revision(store, map_id) == 1
+
+def test_bad_shelf_removal_writes_nothing(store):
+    map_id = store.create_map(10, 10, 'atomic')
+    store.add_shelves_bulk(map_id, [(1, 1, 'rose', 'red', 1), (2, 2, 'rose', 'red', 1)])
+    with pytest.raises(Exception):
+        store.remove_shelves_bulk(map_id, [(1, 1), (2, None)])
+    assert set(cells(store, map_id)) == {(1, 1), (2, 2)}
+    assert revision(store, map_id) == 1
+
+def test_reset_and_other_maps(store):
+    first = store.create_map(10, 10, 'first')
+    second = store.create_map(10, 10, 'second')
+    store.add_obstacles_bulk(first, [(1, 1), (2, 2)])
+    store.add_obstacles_bulk(second, [(3, 3)])
+    store.reset_map(first)
+    assert cells(store, first) == {}
+    assert revision(store, first) == 2
+    assert cells(store, second) == {(3, 3): (None, None, None)}
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        storage.open_storage('cassandra')
+
+def test_map_survives_reopening_the_sqlite_file(tmp_path):
+    path = str(tmp_path / 'warehouse.db')
+    first = storage.open_storage('sqlite', path=path)
+    first.create_tables()
+    map_id = first.create_map(8, 8, 'kept')
+    first.add_shelf(map_id, 2, 3, 'orchid', 'purple', 6)
+    first.close()
+    again = storage.open_storage('sqlite', path=path)
+    try:
+        assert again.map_revision('kept') == (map_id, 1)
+        assert cells(again, map_id) == {(2, 3): ('orchid', 'purple', 6)}
+    finally:
+        again.close()
+
+# A Map loaded through server.py from the SQLite file matches what was stored
+def test_map_loads_from_sqlite(sqlite_storage):
+    map_id = server.create_map(12, 9, 'loaded')
+    assert server.add_obstacles_bulk(map_id, [(0, 0), (11, 8)])
+    assert server.add_shelves_bulk(map_id, [(4, 4, 'rose', 'red', 2)])
+    map_instance = Map.load('loaded')
+    assert (map_instance.id, map_instance.width, map_instance.height) == (map_id, 12, 9)
+    assert set(map_instance.obstacles) == {(0, 0), (11, 8), (4, 4)}
+    assert map_instance.shelves[(4, 4)] == {'flower': 'rose', 'color': 'red', 'quantity': 2}
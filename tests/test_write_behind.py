@@ -0,0 +1,70 @@
+import shutil
+import pytest
+import persistence
+import server
+
+SHELF = ('shelf', 'rose', 'red', 3)
+
+def stored_cells(map_id):
+    with server.map_rows(map_id=map_id) as found:
+        return {(row[0], row[1]): row[2:] for row in found[5]}
+
+@pytest.fixture
+def map_id(map_label):
+    return server.map_revision(map_label)[0]
+
+@pytest.fixture
+def writer(tmp_path):
+    # The background thread stays idle, the tests flush themselves
+    opened = persistence.WriteBehind(str(tmp_path / 'edits.journal'), interval=60, fsync=False)
+    yield opened
+    opened.close()
+
+def test_changes_reach_the_database_on_flush(writer, map_id):
+    writer.record(map_id, [((1, 1), None, 'obstacle'), ((2, 2), None, SHELF)])
+    assert stored_cells(map_id) == {}
+    assert writer.flush()
+    assert stored_cells(map_id) == {(1, 1): (None, None, None), (2, 2): ('rose', 'red', 3)}
+    assert writer.pending() == 0
+
+def test_changes_are_coalesced_per_cell(writer, map_id):
+    writer.record(map_id, [((1, 1), None, 'obstacle')])
+    writer.record(map_id, [((1, 1), 'obstacle', SHELF), ((3, 3), None, 'obstacle')])
+    writer.record(map_id, [((3, 3), 'obstacle', None)])
+    assert writer.pending() == 1
+    assert writer.stats()['coalesced'] == 1
+    writer.flush()
+    assert stored_cells(map_id) == {(1, 1): ('rose', 'red', 3)}
+
+def test_journal_is_replayed_after_a_crash(writer, map_id, tmp_path):
+    writer.record(map_id, [((4, 5), None, SHELF), ((6, 7), None, 'obstacle')])
+    # A process dying now leaves its journal behind
+    shutil.copy(writer.journal, tmp_path / 'crashed.journal')
+    restarted = persistence.WriteBehind(str(tmp_path / 'crashed.journal'), interval=60, fsync=False)
+    try:
+        assert restarted.pending() == 2
+        assert restarted.flush()
+    finally:
+        restarted.close()
+    assert stored_cells(map_id) == {(4, 5): ('rose', 'red', 3), (6, 7): (None, None, None)}
+
+def test_torn_last_line_is_ignored(tmp_path, map_id):
+    journal = tmp_path / 'torn.journal'
+    journal.write_text(f'[{map_id}, 1, 2, null, "obstacle"]\n[{map_id}, 3, 4, nu')
+    restarted = persistence.WriteBehind(str(journal), interval=60, fsync=False)
+    try:
+        assert restarted.pending() == 1
+    finally:
+        restarted.close()
+    assert stored_cells(map_id) == {(1, 2): (None, None, None)}
+
+def test_failed_flush_keeps_the_changes(writer, map_id, monkeypatch):
+    writer.record(map_id, [((1, 1), None, 'obstacle')])
+    monkeypatch.setattr(server, 'apply_changes', lambda map_id, changes: False)
+    assert not writer.flush()
+    writer.record(map_id, [((2, 2), None, 'obstacle')])
+    assert writer.pending() == 2
+    assert writer.stats()['failed_flushes'] == 1
+    monkeypatch.undo()
+    assert writer.flush()
+    assert set(stored_cells(map_id)) == {(1, 1), (2, 2)}